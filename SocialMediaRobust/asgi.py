@@ -8,22 +8,22 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
 import os
-#from SocialMediaRobust.api.routing import websocket_urlpatterns
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from api.consumers import VideoCallConsumer
-from django.urls import path  # You need to import path for WebSocket routing
 
 # Set the default settings module for Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SocialMediaRobust.settings')
 
+# Initialize Django before importing consumers, they import models
+django_asgi_app = get_asgi_application()
+
+from SocialMediaRobust.routing import websocket_urlpatterns  # noqa: E402
+
 # Initialize the ASGI application for HTTP and WebSocket protocols
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),  # HTTP handling
+    "http": django_asgi_app,  # HTTP handling
     "websocket": AuthMiddlewareStack(  # WebSocket handling with authentication
-        URLRouter([
-            path('ws/call/<room_name>/', VideoCallConsumer.as_asgi()),  # WebSocket URL route
-        ])
+        URLRouter(websocket_urlpatterns)
     ),
 })
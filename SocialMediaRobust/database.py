@@ -0,0 +1,66 @@
+"""
+Database profiles, selected with the DATABASE_PROFILE environment variable.
+
+sqlite (default)
+    The db.sqlite3 file in WAL mode: readers no longer block the writer, and
+    transactions take the write lock up front (BEGIN IMMEDIATE) and wait up to
+    SQLITE_TIMEOUT seconds for it, instead of failing with "database is locked".
+
+postgres
+    PostgreSQL configured from POSTGRES_* environment variables, with a psycopg
+    connection pool (requires psycopg[pool]), or persistent connections when
+    POSTGRES_POOL=0.
+"""
+import os
+
+# Pragmas run on every new SQLite connection
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',  # Readers and the writer work concurrently
+    'PRAGMA synchronous=NORMAL',  # fsync at checkpoints only; safe with WAL
+    'PRAGMA mmap_size=134217728',  # Read through 128 MB of memory-mapped I/O
+    'PRAGMA cache_size=-65536',  # 64 MB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def sqlite(path):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': float(os.environ.get('SQLITE_TIMEOUT', 20)),  # Seconds to wait for the write lock
+        },
+    }
+
+
+def postgres():
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'socialmedia'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if os.environ.get('POSTGRES_POOL', '1') == '1':
+        # Django can't combine its own persistent connections with a pool
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 20)),
+            'timeout': int(os.environ.get('POSTGRES_POOL_TIMEOUT', 10)),  # Seconds to wait for a free connection
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600))
+    return database
+
+
+def profile(name, base_dir):
+    if name == 'sqlite':
+        return sqlite(base_dir / 'db.sqlite3')
+    if name == 'postgres':
+        return postgres()
+    raise ValueError(f'Unknown DATABASE_PROFILE {name!r}, use sqlite or postgres')
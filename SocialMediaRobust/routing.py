@@ -1,9 +1,11 @@
 # SocialMediaRobust/routing.py
 from django.urls import path
-from api.consumers import VideoCallConsumer  # Import the consumer from the api directory
+from api.consumers import ChatConsumer, NotificationConsumer, VideoCallConsumer  # Import the consumers from the api directory
 
 # Define WebSocket URL patterns
 websocket_urlpatterns = [
     path('ws/call/<str:room_name>/', VideoCallConsumer.as_asgi()),  # Use room_name as the dynamic part
+    path('ws/notifications/', NotificationConsumer.as_asgi()),  # Per-user notification push
+    path('ws/chat/', ChatConsumer.as_asgi()),  # Direct messages with delivery/read receipts
 ]
 
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 
+from SocialMediaRobust import database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -84,17 +86,15 @@ WSGI_APPLICATION = 'SocialMediaRobust.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Profiles in SocialMediaRobust/database.py: sqlite (WAL, default) or postgres (pooled)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database.profile(os.environ.get('DATABASE_PROFILE', 'sqlite'), BASE_DIR),
 }
 
 # REST framework settings (including JWT authentication and pagination)
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # Use JWT Authentication
+        'api.authentication.CachedJWTAuthentication',  # JWT Authentication, users resolved through api/user_cache.py
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  # Enforce authentication for all endpoints
@@ -103,6 +103,38 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,  # Set the number of posts per page
 }
 
+# Per-process user cache for authentication and serializers (see api/user_cache.py)
+USER_CACHE_SIZE = 10000  # Users kept per process
+USER_CACHE_TTL = 60  # Seconds before a cached user is reloaded, bounds staleness across processes
+
+# Home timeline settings (see api/timeline.py)
+TIMELINE_FANOUT_THRESHOLD = 10000  # Authors with more followers than this are merged in at read time
+TIMELINE_MAX_LENGTH = 800  # Number of precomputed entries read per feed, and kept by python manage.py trim_timelines
+TIMELINE_BACKFILL_LIMIT = 50  # Posts copied into the timeline when following someone
+TIMELINE_BATCH_SIZE = 1000  # Rows per INSERT during fan-out
+
+# Trending posts settings (see api/trending.py)
+TRENDING_CACHE = 'default'  # Cache alias holding the scores; use a shared backend to share them across workers
+TRENDING_WINDOWS = {'1h': 60 * 60, '24h': 24 * 60 * 60, '7d': 7 * 24 * 60 * 60}  # Window name -> half-life in seconds
+TRENDING_WEIGHTS = {'like': 1, 'comment': 2, 'repost': 3}
+TRENDING_CAPACITY = 1000  # Candidate posts kept per window
+TRENDING_TOP_K = 10
+TRENDING_FLUSH_INTERVAL = 1.0  # Seconds a worker buffers events before merging them into the shared scores (0 merges each one)
+TRENDING_LOCK_TIMEOUT = 5  # Seconds a merge may hold the scores' lock
+
+# Trending hashtags settings (see api/sketch.py)
+TRENDING_HASHTAGS_WINDOW = 60 * 60  # Sliding window in seconds
+TRENDING_HASHTAGS_BUCKETS = 12  # Buckets per window (5 minutes each)
+TRENDING_HASHTAGS_SKETCH_WIDTH = 2048  # Count-Min Sketch counters per row
+TRENDING_HASHTAGS_SKETCH_DEPTH = 4  # Count-Min Sketch rows
+TRENDING_HASHTAGS_CAPACITY = 100  # Heavy-hitter candidates tracked
+TRENDING_HASHTAGS_SNAPSHOT = os.path.join(BASE_DIR, 'trending_hashtags.json')  # Restores a cold cache; None disables snapshots
+
+# Search settings (see api/search.py)
+SEARCH_RESULTS = 20  # Results returned by default
+SEARCH_MAX_RESULTS = 50  # Upper bound for ?limit=
+SEARCH_AUTOCOMPLETE_RESULTS = 5  # Users and tags each
+
 # JWT Token Settings
 from datetime import timedelta
 SIMPLE_JWT = {
@@ -121,7 +153,53 @@ CHANNEL_LAYERS = {
             'hosts': [('127.0.0.1', 6379)],  # Redis instance
         },
     },
-},
+}
+
+# Notification push settings (see NotificationConsumer)
+NOTIFICATION_BATCH_WINDOW = 1.0  # Seconds to collect a burst of notifications into one frame
+NOTIFICATION_BATCH_MAX = 50  # Send early once this many notifications are waiting
+NOTIFICATION_LATEST_ACTORS = 3  # Actors kept on a folded notification ("alice, bob and 10 others")
+NOTIFICATION_UNREAD_COUNT_TTL = 5 * 60  # Seconds a cached unread count lives before it is recounted
+
+# Cache, chosen by the CACHE_BACKEND environment variable: 'local' (default) is
+# in-process, 'redis' is shared by every worker and needed when there is more than
+# one, so that writes invalidate the cached reads of all of them. Code using the
+# cache logs and carries on without it if Redis is unreachable.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+CACHES = {
+    'local': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'redis': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://127.0.0.1:6379/1'),  # Database 1 (channels uses 0)
+        },
+    },
+}[CACHE_BACKEND]
+
+# Read-through cache for hot read endpoints (see api/caching.py)
+READ_CACHE_TIMEOUTS = {  # Seconds per entity kind; writes invalidate entries before they expire
+    'profile': 300,
+    'post': 60,
+    'hashtag': 3600,
+    'trending': 30,  # Not invalidated by likes/comments, only by post deletion
+}
+READ_CACHE_LOCK_TIMEOUT = 5  # Seconds concurrent misses wait for the one recomputing a key
+
+# Video call rooms (see api/presence.py)
+VIDEO_CALL_ROOM_LIMIT = 8  # Sockets per room
+VIDEO_CALL_PRESENCE_TTL = 3600  # Seconds a silent socket keeps its place in a room
+
+# Follower graph (see api/graph.py)
+FOLLOWER_GRAPH_TTL = 300  # Seconds before a process reloads the graph, picking up other processes' follows
+FOLLOWER_SUGGESTION_SAMPLE = 500  # Followed users whose follows are counted for suggestions
+
+# Chat settings (see ChatConsumer)
+CHAT_BATCH_SIZE = 100  # Messages stored per INSERT
+CHAT_BATCH_INTERVAL = 0.05  # Seconds a message waits for others to join its batch
+
+# Notification retention (python manage.py prune_notifications)
+NOTIFICATION_RETENTION_DAYS = 30  # Read notifications older than this are deleted
+NOTIFICATION_MAX_PER_USER = 500  # Read notifications past this many per user are deleted
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # Adjust the path as needed
@@ -129,6 +207,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # Adjust the path as needed
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media files are stored once per content and served by api.storage.serve_media
+STORAGES = {
+    'default': {'BACKEND': 'api.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600  # Seconds clients may cache a content-addressed file (it never changes)
+
+# Uploaded images (see api/media.py)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024  # Larger uploads are streamed to a temporary file instead of memory
+MEDIA_WORKERS = 2  # Processes rendering image renditions; 0 renders them in the request thread
+MEDIA_RENDITIONS = {  # Longest side in pixels
+    'thumbnail': 320,  # Feeds and avatars
+    'large': 1280,  # Post and profile pages
+}
+MEDIA_RENDITION_QUALITY = 80  # WebP quality, 0-100
+
 
 
 
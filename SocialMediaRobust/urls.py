@@ -35,9 +35,14 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  # For refreshing token
 ]
 
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
+from django.urls import re_path
+
+from api.storage import serve_media
 
-# Add this at the end of your main urls.py file
-if settings.DEBUG:  # Only serve media files in development
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Media files, with ETag, Range and Cache-Control support (not only in development)
+urlpatterns += [
+    re_path(r'^%s(?P<name>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media),
+]
@@ -0,0 +1,144 @@
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import timeline
+from .caching import aread_through
+from .graph import arelationship_flags
+from .models import Notification, Post, Profile
+from .pagination import KeysetPagination
+from .prefetch import aload_related, select_related
+from .serializers import (
+    CompactPostSerializer, NotificationSerializer, PostSerializer, ProfileSerializer, absolute_urls,
+)
+from .trending import trending_posts
+from .views import ProfileViewSet, annotate_liked_by_me
+
+# Async views for the hot read endpoints.
+#
+# Under ASGI a DRF view runs in a worker thread; these run on the event loop and
+# only leave it for the queries themselves (async ORM). They return the same JSON as
+# the DRF views they replace. DRF has no async handlers, so AsyncAPIView runs the
+# handler on the loop around the usual APIView steps: initial() (authentication,
+# permissions, throttling, content negotiation, all synchronous and possibly hitting
+# the database, so in a thread), handle_exception() and the renderers.
+
+
+class AsyncAPIView(APIView):
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):  # options() is synchronous
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class FeedView(AsyncAPIView):
+
+    async def get(self, request):
+        # Served from the materialized timeline instead of a join over every followed author
+        compact = request.query_params.get('compact') in ('1', 'true')
+        serializer_class = CompactPostSerializer if compact else PostSerializer
+        posts = timeline.home_timeline(request.user)
+        if compact:
+            posts = annotate_liked_by_me(posts, request.user)
+
+        # Sorting by date or popularity (likes); the paginator applies the ordering.
+        # Likes keep changing, so popularity cursors page a moving list (see KeysetPagination)
+        paginator = KeysetPagination()
+        if request.query_params.get('sort_by', 'date') == 'popularity':
+            paginator.ordering = ('-like_count', '-id')
+
+        page = await paginator.apaginate_queryset(select_related(posts, serializer_class), request)
+        await aload_related(page, serializer_class)
+        serializer = serializer_class(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class TrendingView(AsyncAPIView):
+
+    async def get(self, request):
+        # Top posts by time-decayed engagement, maintained incrementally by the trending engine
+        window = request.query_params.get('window', '24h')
+        if window not in settings.TRENDING_WINDOWS:
+            return Response(
+                {'error': f'Unknown window, use one of: {", ".join(settings.TRENDING_WINDOWS)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        async def serialize():
+            # A cold engine rebuilds its scores from the database
+            post_ids = await sync_to_async(trending_posts.top)(window)
+            posts = await select_related(Post.objects.all(), PostSerializer).ain_bulk(post_ids)
+            ranked = [posts[post_id] for post_id in post_ids if post_id in posts]
+            await aload_related(ranked, PostSerializer)
+            return PostSerializer(ranked, many=True).data
+
+        posts = await aread_through('trending', window, serialize)
+        return Response([absolute_urls(post, PostSerializer, request) for post in posts])
+
+
+class NotificationListView(AsyncAPIView):
+
+    async def get(self, request):
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(
+            select_related(Notification.objects.filter(user=request.user), NotificationSerializer), request
+        )
+        await aload_related(page, NotificationSerializer)
+        return paginator.get_paginated_response(NotificationSerializer(page, many=True).data)
+
+
+class ProfileDetailView(AsyncAPIView):
+
+    async def get(self, request, pk):
+        # Served from the read-through cache, dropped when the profile or its user is saved
+        async def serialize():
+            profile = await select_related(Profile.objects.filter(pk=pk), ProfileSerializer).afirst()
+            if profile is None:
+                raise NotFound('No Profile matches the given query.')
+            return ProfileSerializer(profile).data
+
+        data = absolute_urls(await aread_through('profile', pk, serialize), ProfileSerializer, request)
+        # The cached part is the same for everyone; the relationship to the viewer is not
+        user_id = data['user']['id']
+        return Response({**data, **(await arelationship_flags(request.user.id, [user_id]))[user_id]})
+
+
+feed = FeedView.as_view()
+trending = TrendingView.as_view()
+notifications = NotificationListView.as_view()
+profile_retrieve = ProfileDetailView.as_view()
+# Everything but reads stays on the DRF viewset, which also answers OPTIONS and 405s
+profile_other = ProfileViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+
+
+@csrf_exempt
+async def profile_detail(request, pk):
+    if request.method in ('GET', 'HEAD'):
+        return await profile_retrieve(request, pk=pk)
+    return await sync_to_async(profile_other)(request, pk=pk)
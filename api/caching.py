@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache for hot read endpoints.
+#
+# Entries are keyed per entity ('read:post:42') with a TTL per kind from
+# READ_CACHE_TIMEOUTS, and deleted by the signal receivers in signals.py when the
+# entity is written. When a hot key is missing, only the caller that wins the
+# key's lock recomputes it; concurrent callers wait for that result instead of all
+# hitting the database at once. Cache errors are logged and the value is computed
+# directly, so a Redis outage slows reads down instead of failing them.
+
+MISSING = object()
+POLL_INTERVAL = 0.02
+
+
+def cache_key(kind, identifier):
+    return f'read:{kind}:{identifier}'
+
+
+def read_through(kind, identifier, compute):
+    """
+    Returns the cached value for the entity, computing and caching it on a miss.
+    None results are not cached.
+    """
+    key = cache_key(kind, identifier)
+    value = _cache_call('get', key, MISSING)
+    if value is not MISSING:
+        return value
+
+    lock_timeout = settings.READ_CACHE_LOCK_TIMEOUT
+    if _cache_call('add', f'{key}:lock', 1, lock_timeout, failed=True):
+        try:
+            value = compute()
+            if value is not None:
+                _cache_call('set', key, value, settings.READ_CACHE_TIMEOUTS[kind])
+        finally:
+            _cache_call('delete', f'{key}:lock')
+        return value
+
+    # Someone else is computing it
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = _cache_call('get', key, MISSING)
+        if value is not MISSING:
+            return value
+    return compute()
+
+
+async def aread_through(kind, identifier, compute):
+    """
+    read_through() for async views; compute is a coroutine function.
+    """
+    key = cache_key(kind, identifier)
+    value = await _acache_call('aget', key, MISSING)
+    if value is not MISSING:
+        return value
+
+    lock_timeout = settings.READ_CACHE_LOCK_TIMEOUT
+    if await _acache_call('aadd', f'{key}:lock', 1, lock_timeout, failed=True):
+        try:
+            value = await compute()
+            if value is not None:
+                await _acache_call('aset', key, value, settings.READ_CACHE_TIMEOUTS[kind])
+        finally:
+            await _acache_call('adelete', f'{key}:lock')
+        return value
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        value = await _acache_call('aget', key, MISSING)
+        if value is not MISSING:
+            return value
+    return await compute()
+
+
+def invalidate(kind, *identifiers):
+    """
+    Deletes the entities' entries once the current transaction commits, so readers
+    can't cache the pre-commit state again.
+    """
+    keys = [cache_key(kind, identifier) for identifier in identifiers]
+    transaction.on_commit(lambda: _cache_call('delete_many', keys))
+
+
+def _cache_call(method, *args, failed=None):
+    try:
+        return getattr(cache, method)(*args)
+    except Exception:
+        logger.warning('Cache %s failed', method, exc_info=True)
+        return args[1] if method == 'get' else failed
+
+
+async def _acache_call(method, *args, failed=None):
+    try:
+        return await getattr(cache, method)(*args)
+    except Exception:
+        logger.warning('Cache %s failed', method, exc_info=True)
+        return args[1] if method == 'aget' else failed
@@ -0,0 +1,91 @@
+import json
+
+import msgpack
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+# WebSocket frame codecs.
+#
+# Clients pick the encoding with the WebSocket subprotocol header:
+#   new WebSocket(url, ['msgpack'])  -> binary msgpack frames
+#   new WebSocket(url) or ['json']   -> JSON text frames (the default)
+# Incoming frames are decoded by their kind, so a msgpack client may still send text
+# JSON frames; outgoing frames use the negotiated codec.
+
+
+class JSONCodec:
+    subprotocol = 'json'
+    binary = False
+
+    @staticmethod
+    def encode(content):
+        return json.dumps(content)
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    subprotocol = 'msgpack'
+    binary = True
+
+    @staticmethod
+    def encode(content):
+        return msgpack.packb(content, use_bin_type=True)
+
+    @staticmethod
+    def decode(data):
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except msgpack.UnpackException as error:
+            raise ValueError(error) from error
+
+
+CODECS = {codec.subprotocol: codec for codec in (MsgpackCodec, JSONCodec)}
+
+
+def negotiate(subprotocols):
+    """
+    Returns the first codec the client asked for that we support, JSON otherwise.
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return JSONCodec
+
+
+class CodecConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer that exchanges dicts instead of raw frames: subclasses
+    implement receive_frame(content) and reply with send_frame(content).
+    """
+
+    codec = JSONCodec
+
+    async def accept(self, subprotocol=None, headers=None):
+        requested = self.scope.get('subprotocols', [])
+        self.codec = negotiate(requested)
+        if subprotocol is None and self.codec.subprotocol in requested:
+            subprotocol = self.codec.subprotocol
+        await super().accept(subprotocol=subprotocol, headers=headers)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            content = JSONCodec.decode(text_data) if text_data is not None else MsgpackCodec.decode(bytes_data)
+        except ValueError:
+            await self.send_frame({'type': 'error', 'error': 'Invalid frame'})
+            return
+        if not isinstance(content, dict):
+            await self.send_frame({'type': 'error', 'error': 'Invalid frame'})
+            return
+        await self.receive_frame(content)
+
+    async def receive_frame(self, content):
+        pass
+
+    async def send_frame(self, content):
+        frame = self.codec.encode(content)
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
@@ -1,47 +1,119 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+import asyncio
+import logging
+import time
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from .notifications import coalesce, group_name as notification_group_name
+from .messaging import mark_conversation_read, message_payload, persist_messages
+from . import presence
+from .codec import CodecConsumer
+
+logger = logging.getLogger(__name__)
+
+class VideoCallConsumer(CodecConsumer):
+    """
+    WebRTC signaling for one call room (ws/call/<room_name>/).
+
+    On joining, the socket receives {"type": "peers", "peer": <own id>, "peers": [...]}
+    and the other members get {"type": "peer-joined", ...}. Offers, answers and ICE
+    candidates go to a single peer:
+        {"type": "offer" | "answer" | "ice", "to": <peer id>, "data": {...}}
+    and arrive as {"type": ..., "from": <peer id>, "user": ..., "data": {...}}.
+    {"message": ...} is still broadcast to the room.
+    """
+
+    signals = {'offer', 'answer', 'ice'}
+    touch_every = 0.1  # Fraction of VIDEO_CALL_PRESENCE_TTL between two refreshes of the slot
 
-class VideoCallConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Authenticate user before allowing the connection
-        if self.scope["user"].is_authenticated:
-            # Accept the connection
-            await self.accept()
-            self.room_name = 'room_name'  # Set the room name
-            self.room_group_name = f'chat_{self.room_name}'
-
-            # Join room group
-            await self.channel_layer.group_add(
-                self.room_group_name,
-                self.channel_name
-            )
-        else:
+        if not self.scope["user"].is_authenticated:
             # Reject the connection if not authenticated
             await self.close()
+            return
+
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        if not presence.is_valid_room(self.room_name):
+            await self.close()
+            return
+        self.room_group_name = f'call_{self.room_name}'
+        self.member = {
+            'peer': self.channel_name,
+            'user': self.scope["user"].id,
+            'username': self.scope["user"].username,
+        }
+
+        await self.accept()
+        try:
+            self.slot = await presence.join(self.room_name, self.member)
+        except Exception:
+            # Rooms live in the cache; without it a slot can't be claimed
+            logger.warning('Joining call room %s failed', self.room_name, exc_info=True)
+            await self.send_frame({'type': 'error', 'error': 'Calls are unavailable'})
+            await self.close(code=1011)
+            return
+        if self.slot is None:
+            await self.send_frame({'type': 'error', 'error': 'Room is full'})
+            await self.close(code=4003)
+            return
+
+        self.touched_at = time.monotonic()
+
+        # Join room group
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        members = await presence.members(self.room_name)
+        self.peers = {member['peer'] for member in members} - {self.channel_name}
+        await self.send_frame({
+            'type': 'peers',
+            'peer': self.channel_name,
+            'peers': [member for member in members if member['peer'] != self.channel_name],
+        })
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'peer.joined', **self.member})
 
     async def disconnect(self, close_code):
+        if getattr(self, 'slot', None) is None:
+            return
         # Leave the room group on disconnect
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-
-    async def receive(self, text_data):
-        # Handle incoming messages
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-
-        # Broadcast the message to the group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'user': self.scope["user"].username
-            }
-        )
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await presence.leave(self.room_name, self.slot, self.channel_name)
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'peer.left', **self.member})
+
+    async def receive_frame(self, data):
+        await self.refresh_presence()
+
+        kind, to = data.get('type'), data.get('to')
+        if isinstance(kind, str) and kind in self.signals:
+            if not isinstance(to, str) or to not in self.peers:
+                await self.send_frame({'type': 'error', 'error': 'Unknown peer', 'to': to if isinstance(to, str) else None})
+                return
+            # Straight to the peer's channel, nobody else in the room sees it
+            await self.channel_layer.send(data['to'], {
+                'type': 'call.signal',
+                'signal': data['type'],
+                'from': self.channel_name,
+                'user': self.member['user'],
+                'data': data.get('data'),
+            })
+        elif 'message' in data:
+            # Broadcast the message to the room
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'chat_message',
+                    'message': data['message'],
+                    'user': self.scope["user"].username
+                }
+            )
+        else:
+            await self.send_frame({'type': 'error', 'error': 'Invalid frame'})
+
+    async def refresh_presence(self):
+        # Keeps the slot from expiring, with one cache round trip per interval rather than per frame
+        now = time.monotonic()
+        if now - self.touched_at >= settings.VIDEO_CALL_PRESENCE_TTL * self.touch_every:
+            self.touched_at = now
+            await presence.touch(self.room_name, self.slot)
 
     async def chat_message(self, event):
         # Receive the message from the group
@@ -49,7 +121,219 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         user = event['user']
 
         # Send the message back to the WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'message': message,
             'user': user
-        }))
+        })
+
+    async def call_signal(self, event):
+        await self.send_frame({'type': event['signal'], 'from': event['from'], 'user': event['user'], 'data': event['data']})
+
+    async def peer_joined(self, event):
+        if event['peer'] != self.channel_name:
+            self.peers.add(event['peer'])
+            await self.send_frame({**event, 'type': 'peer-joined'})
+
+    async def peer_left(self, event):
+        if event['peer'] != self.channel_name:
+            self.peers.discard(event['peer'])
+            await self.send_frame({**event, 'type': 'peer-left'})
+
+
+class NotificationConsumer(CodecConsumer):
+    """
+    Pushes the user's new notifications, coalescing bursts into batched frames.
+
+    Events arriving within NOTIFICATION_BATCH_WINDOW seconds of the first one are
+    sent together, grouped by type and post ("12 people liked your post").
+    """
+
+    async def connect(self):
+        # Authenticate user before allowing the connection
+        if self.scope["user"].is_authenticated:
+            self.group_name = notification_group_name(self.scope["user"].id)
+            self.pending = []
+            self.flush_task = None
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.accept()
+        else:
+            await self.close()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            if self.flush_task is not None:
+                self.flush_task.cancel()
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_created(self, event):
+        # Queue the notification; the first one of a burst schedules the flush
+        self.pending.append(event)
+        if len(self.pending) >= settings.NOTIFICATION_BATCH_MAX:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.NOTIFICATION_BATCH_WINDOW)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        events, self.pending = self.pending, []
+        if events:
+            await self.send_frame({'type': 'notifications', 'batch': coalesce(events)})
+
+
+class MessageWriter:
+    """
+    Collects chat messages from every ChatConsumer in the process and stores them
+    in batches: a flush runs CHAT_BATCH_INTERVAL seconds after the first queued
+    message, or as soon as CHAT_BATCH_SIZE are waiting.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.flush_task = None
+
+    async def submit(self, sender_id, recipient_id, content):
+        """
+        Queues a message and waits for its batch; returns the saved Message, or
+        None if the recipient does not exist.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append(((sender_id, recipient_id, content), future))
+        if len(self.queue) >= settings.CHAT_BATCH_SIZE:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+        return await future
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.CHAT_BATCH_INTERVAL)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        batch, self.queue = self.queue, []
+        if not batch:
+            return
+        try:
+            saved = await database_sync_to_async(persist_messages)([draft for draft, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+        else:
+            for (_, future), message in zip(batch, saved):
+                future.set_result(message)
+
+
+message_writer = MessageWriter()
+
+
+def chat_group_name(user_id):
+    return f'chat_{user_id}'
+
+
+class ChatConsumer(CodecConsumer):
+    """
+    Direct messaging with delivery and read receipts.
+
+    Client frames:
+        {"type": "message", "recipient": <user id>, "content": "...", "client_id": "..."}
+        {"type": "read", "conversation": <conversation id>}
+
+    Server frames:
+        {"type": "sent", "client_id": "...", "message": {...}}  -- stored, to the sending socket
+        {"type": "message", "message": {...}}                   -- to every socket of both users
+        {"type": "receipt", "status": "delivered" | "read", ...} -- to the other side
+        {"type": "error", "error": "...", "client_id": "..."}
+    """
+
+    async def connect(self):
+        # Authenticate user before allowing the connection
+        if self.scope["user"].is_authenticated:
+            self.user = self.scope["user"]
+            self.group_name = chat_group_name(self.user.id)
+            self.sending = set()  # Running send_message() tasks; the loop only keeps weak references
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            await self.accept()
+        else:
+            await self.close()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_frame(self, data):
+        try:
+            kind = data['type']
+            if kind == 'message':
+                draft = (int(data['recipient']), str(data['content']), data.get('client_id'))
+            elif kind == 'read':
+                conversation_id = int(data['conversation'])
+            else:
+                raise ValueError(kind)
+        except (ValueError, TypeError, KeyError):
+            await self.send_frame({'type': 'error', 'error': 'Invalid frame'})
+            return
+
+        if kind == 'message':
+            # Don't wait for the batch here so a burst from this socket lands in one batch
+            task = asyncio.ensure_future(self.send_message(*draft))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+        else:
+            await self.mark_read(conversation_id)
+
+    async def send_message(self, recipient_id, content, client_id):
+        # Runs as its own task, so errors are reported to the socket and logged here
+        try:
+            message = await message_writer.submit(self.user.id, recipient_id, content)
+        except Exception:
+            logger.warning('Storing a chat message from user %s failed', self.user.id, exc_info=True)
+            await self.send_frame({'type': 'error', 'error': 'Message could not be stored', 'client_id': client_id})
+            return
+        if message is None:
+            await self.send_frame({'type': 'error', 'error': 'Recipient does not exist.', 'client_id': client_id})
+            return
+
+        payload = message_payload(message, self.user.username)
+        await self.send_frame({'type': 'sent', 'client_id': client_id, 'message': payload})
+        event = {'type': 'chat.message', 'message': payload}
+        try:
+            for user_id in {self.user.id, recipient_id}:
+                await self.channel_layer.group_send(chat_group_name(user_id), event)
+        except Exception:
+            # The message is stored either way, clients pick it up on their next fetch
+            logger.warning('Could not push chat message %s', message.id, exc_info=True)
+
+    async def mark_read(self, conversation_id):
+        read_at, others = await database_sync_to_async(mark_conversation_read)(self.user, conversation_id)
+        if read_at is None:
+            await self.send_frame({'type': 'error', 'error': 'Conversation not found'})
+            return
+        receipt = {
+            'type': 'chat.receipt', 'status': 'read', 'conversation': conversation_id,
+            'user': self.user.id, 'read_at': read_at.isoformat(),
+        }
+        for user_id in others:
+            await self.channel_layer.group_send(chat_group_name(user_id), receipt)
+
+    async def chat_message(self, event):
+        message = event['message']
+        await self.send_frame({'type': 'message', 'message': message})
+        if message['sender']['id'] != self.user.id:
+            # Tell the sender it reached one of the recipient's sockets
+            await self.channel_layer.group_send(chat_group_name(message['sender']['id']), {
+                'type': 'chat.receipt', 'status': 'delivered', 'conversation': message['conversation'],
+                'message': message['id'], 'user': self.user.id,
+            })
+
+    async def chat_receipt(self, event):
+        await self.send_frame({**event, 'type': 'receipt'})
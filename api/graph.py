@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Follower
+
+logger = logging.getLogger(__name__)
+
+# In-memory follower graph.
+#
+# Each process keeps who-follows-whom as sorted arrays of user ids (8 bytes per
+# edge and direction), loaded from Follower on first use. Follows made through
+# FollowerViewSet, deleted follows and deleted users (see signals.py) update it in
+# place; other processes' changes are picked up when the graph is reloaded in the
+# background every FOLLOWER_GRAPH_TTL seconds (a failed reload is retried after
+# another TTL). Writes insert into the arrays in place, so reads hold the lock as
+# well.
+
+
+def contains(ids, user_id):
+    index = bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+class FollowerGraph:
+    """
+    Follow edges in both directions, for common follows and follow suggestions
+    without database queries.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.following = {}  # user id -> sorted array of the ids they follow
+        self.followers = {}  # user id -> sorted array of their followers' ids
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.reloading = None  # Edges changed since the running reload read the table
+
+    def ready(self):
+        """
+        Loads the graph on first use and starts a background reload once it's older
+        than the TTL; until that is done the current graph is served.
+        """
+        if self.loaded_at is None:
+            with self.lock:
+                if self.loaded_at is None:
+                    self.following, self.followers = self.load()
+                    self.loaded_at = time.monotonic()
+        elif time.monotonic() - self.loaded_at > self.ttl:
+            with self.lock:
+                if self.reloading is None and time.monotonic() - self.loaded_at > self.ttl:
+                    self.reloading = []
+                    threading.Thread(target=self.reload, daemon=True).start()
+        return self
+
+    def reload(self):
+        try:
+            following, followers = self.load()
+        except Exception:
+            logger.warning('Reloading the follower graph failed', exc_info=True)
+            with self.lock:
+                # Keep serving the current graph and try again after another TTL
+                self.reloading = None
+                self.loaded_at = time.monotonic()
+            return
+        finally:
+            connection.close()  # This thread is done with the database
+        with self.lock:
+            # Replay the follows and unfollows made while the table was being read
+            changes, self.reloading = self.reloading, None
+            self.following, self.followers = following, followers
+            for method, *args in changes:
+                method(*args)
+            self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def load():
+        following = {}
+        followers = {}
+        edges = Follower.objects.values_list('user_from', 'user_to').order_by().iterator(chunk_size=10000)
+        for user_id, followed_id in edges:
+            following.setdefault(user_id, []).append(followed_id)
+            followers.setdefault(followed_id, []).append(user_id)
+        return (
+            {user_id: array('q', sorted(ids)) for user_id, ids in following.items()},
+            {user_id: array('q', sorted(ids)) for user_id, ids in followers.items()},
+        )
+
+    def clear(self):
+        with self.lock:
+            self.following, self.followers = {}, {}
+            self.loaded_at = None
+
+    def add(self, user_id, followed_id):
+        with self.lock:
+            self._link(user_id, followed_id)
+            if self.reloading is not None:
+                self.reloading.append((self._link, user_id, followed_id))
+
+    def remove(self, user_id, followed_id):
+        with self.lock:
+            self._unlink(user_id, followed_id)
+            if self.reloading is not None:
+                self.reloading.append((self._unlink, user_id, followed_id))
+
+    def remove_user(self, user_id):
+        with self.lock:
+            self._drop(user_id)
+            if self.reloading is not None:
+                self.reloading.append((self._drop, user_id))
+
+    def _link(self, user_id, followed_id):
+        self._insert(self.following, user_id, followed_id)
+        self._insert(self.followers, followed_id, user_id)
+
+    def _unlink(self, user_id, followed_id):
+        self._delete(self.following, user_id, followed_id)
+        self._delete(self.followers, followed_id, user_id)
+
+    def _drop(self, user_id):
+        for followed_id in self.following.pop(user_id, ()):
+            self._delete(self.followers, followed_id, user_id)
+        for follower_id in self.followers.pop(user_id, ()):
+            self._delete(self.following, follower_id, user_id)
+
+    @staticmethod
+    def _insert(adjacency, key, user_id):
+        ids = adjacency.setdefault(key, array('q'))
+        index = bisect_left(ids, user_id)
+        if index == len(ids) or ids[index] != user_id:
+            ids.insert(index, user_id)
+
+    @staticmethod
+    def _delete(adjacency, key, user_id):
+        ids = adjacency.get(key)
+        if ids is not None and contains(ids, user_id):
+            ids.pop(bisect_left(ids, user_id))
+            if not ids:
+                del adjacency[key]
+
+    def common_following(self, user_id, other_id):
+        """
+        Ids of the users both users follow.
+        """
+        self.ready()
+        with self.lock:
+            return sorted(set(self.following.get(user_id, ())).intersection(self.following.get(other_id, ())))
+
+    def suggestions(self, user_id, limit):
+        """
+        Returns up to `limit` (user id, count) pairs: users followed by the most of
+        the people user_id follows, and not followed by user_id yet.
+        """
+        self.ready()
+        counts = Counter()
+        with self.lock:
+            following = self.following.get(user_id, array('q'))
+            # Bound the work for users who follow a lot of people with an evenly spaced
+            # sample, so the same graph always gives the same suggestions
+            step = -(-len(following) // settings.FOLLOWER_SUGGESTION_SAMPLE)
+            for followed_id in following[::max(step, 1)]:
+                counts.update(self.following.get(followed_id, ()))
+            counts.pop(user_id, None)
+            for followed_id in following:
+                counts.pop(followed_id, None)
+        return counts.most_common(limit)
+
+
+follower_graph = FollowerGraph(settings.FOLLOWER_GRAPH_TTL)
+
+
+# Exact relationship flags for a page of users, in one query. The graph above can
+# lag behind follows made in other processes; these are read from the table.
+
+def relationship_flags(user_id, other_ids):
+    """
+    Returns {other id: {'following': bool, 'followed_by': bool}} as seen by user_id.
+    """
+    return _flags(user_id, other_ids, list(_edges(user_id, other_ids)))
+
+
+async def arelationship_flags(user_id, other_ids):
+    return _flags(user_id, other_ids, [edge async for edge in _edges(user_id, other_ids)])
+
+
+def _edges(user_id, other_ids):
+    return Follower.objects.filter(
+        Q(user_from=user_id, user_to__in=other_ids) | Q(user_from__in=other_ids, user_to=user_id)
+    ).values_list('user_from', 'user_to')
+
+
+def _flags(user_id, other_ids, edges):
+    flags = {other_id: {'following': False, 'followed_by': False} for other_id in other_ids}
+    for user_from, user_to in edges:
+        if user_from == user_id and user_to in flags:
+            flags[user_to]['following'] = True
+        if user_to == user_id and user_from in flags:
+            flags[user_from]['followed_by'] = True
+    return flags
@@ -0,0 +1,50 @@
+import re
+import unicodedata
+
+from .models import Hashtag, PostHashtag
+
+# Hashtag extraction: '#' followed by word characters, not preceded by one
+# (so 'a#b' and URL fragments like 'page#top' are not tags)
+HASHTAG_PATTERN = re.compile(r'(?<![\w#&/])#(\w+)')
+MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+
+
+def normalize(name):
+    """
+    Returns the canonical form of a tag: NFKC-normalized, case-folded, without '#'.
+    """
+    return unicodedata.normalize('NFKC', name).lstrip('#').casefold()[:MAX_LENGTH]
+
+
+def extract_hashtags(text):
+    """
+    Returns the distinct normalized tags in the text, in order of appearance.
+    """
+    return list(dict.fromkeys(normalize(match) for match in HASHTAG_PATTERN.findall(text or '')))
+
+
+def sync_post_hashtags(post):
+    """
+    Makes the post's Hashtag/PostHashtag rows match the tags in its content.
+
+    Missing tags are upserted in a single INSERT ... ON CONFLICT statement that
+    returns their ids, and the links are added and removed in bulk.
+    """
+    names = extract_hashtags(post.content)
+    hashtags = []
+    if names:
+        hashtags = Hashtag.objects.bulk_create(
+            [Hashtag(name=name) for name in names],
+            update_conflicts=True, unique_fields=['name'], update_fields=['name'],
+        )
+        if any(hashtag.pk is None for hashtag in hashtags):
+            # Backends that can't return ids from an upsert
+            hashtags = list(Hashtag.objects.filter(name__in=names))
+
+    hashtag_ids = [hashtag.pk for hashtag in hashtags]
+    PostHashtag.objects.filter(post=post).exclude(hashtag__in=hashtag_ids).delete()
+    PostHashtag.objects.bulk_create(
+        [PostHashtag(post=post, hashtag_id=hashtag_id, timestamp=post.timestamp) for hashtag_id in hashtag_ids],
+        ignore_conflicts=True,
+    )
+    return names
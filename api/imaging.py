@@ -0,0 +1,36 @@
+import io
+
+from PIL import Image, ImageOps
+
+# Image renditions, computed in the media worker processes (see media.py).
+#
+# Nothing here touches Django: the workers only decode and re-encode, and the
+# parent process stores the results.
+
+FORMAT = 'WEBP'  # Keeps transparency and is smaller than JPEG at the same quality
+EXTENSION = 'webp'
+
+
+def render(path, sizes, quality):
+    """
+    Returns {rendition: WebP bytes} for the image at path, scaled down to fit
+    each rendition's size (longest side, in pixels).
+    """
+    largest = max(sizes.values())
+    renditions = {}
+    with Image.open(path) as image:
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale, which is much cheaper for big photos
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+        # Largest first, so each rendition is scaled down from the previous one
+        for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, FORMAT, quality=quality)
+            renditions[name] = buffer.getvalue()
+    return renditions
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
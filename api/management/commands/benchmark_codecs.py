@@ -0,0 +1,63 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from api.codec import CODECS
+
+# Frames as the consumers send them
+SAMPLE_FRAMES = {
+    'ice': {
+        'type': 'ice',
+        'from': 'specific.a1b2c3d4!e5f6g7h8i9j0',
+        'user': 42,
+        'data': {
+            'candidate': 'candidate:842163049 1 udp 1677729535 203.0.113.7 46154 typ srflx '
+                         'raddr 192.168.1.12 rport 46154 generation 0 ufrag sXpQ network-cost 999',
+            'sdpMid': '0',
+            'sdpMLineIndex': 0,
+        },
+    },
+    'chat': {
+        'type': 'message',
+        'message': {
+            'id': 123456,
+            'conversation': 789,
+            'sender': {'id': 42, 'username': 'alice'},
+            'recipient': 43,
+            'content': 'Are we still on for tonight?',
+            'timestamp': '2024-10-01T18:30:12.345678+00:00',
+        },
+    },
+    'notifications': {
+        'type': 'notifications',
+        'batch': [
+            {
+                'notification_type': 'like', 'post': post, 'count': 12, 'actors': ['alice', 'bob', 'carol'],
+                'latest_id': 1000 + post, 'timestamp': '2024-10-01T18:30:12.345678+00:00',
+                'message': '12 people liked your post',
+            }
+            for post in range(5)
+        ],
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Compares encode/decode time and frame size of the WebSocket codecs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=100000, help='Frames encoded/decoded per measurement')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        self.stdout.write(f"{'frame':<14}{'codec':<9}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+        for name, frame in SAMPLE_FRAMES.items():
+            for codec in CODECS.values():
+                encoded = codec.encode(frame)
+                size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+                encode = min(timeit.repeat(lambda: codec.encode(frame), number=number, repeat=3))
+                decode = min(timeit.repeat(lambda: codec.decode(encoded), number=number, repeat=3))
+                self.stdout.write(
+                    f'{name:<14}{codec.subprotocol:<9}{size:>7}'
+                    f'{encode / number * 1e6:>11.2f}{decode / number * 1e6:>11.2f}'
+                )
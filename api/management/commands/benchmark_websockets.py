@@ -0,0 +1,202 @@
+import asyncio
+import json
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import msgpack
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from SocialMediaRobust.routing import websocket_urlpatterns
+from api.notifications import group_name as notification_group_name
+
+# In-process WebSocket load test.
+#
+# Clients are WebsocketCommunicators driving the real consumers through the project's
+# URL router, all on one event loop, so the numbers include the consumers' own CPU
+# time and the channel layer but not the network or the ASGI server. Users are
+# unsaved User instances: the scenarios never touch the database. Notification
+# latency includes NOTIFICATION_BATCH_WINDOW, as clients see it.
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}}
+IN_MEMORY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}  # Call room presence
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Client:
+    """
+    One simulated socket: records when each timestamped frame arrives.
+    """
+
+    def __init__(self, path, user, codec):
+        subprotocols = [codec] if codec == 'msgpack' else None
+        self.communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path, subprotocols=subprotocols)
+        self.communicator.scope['user'] = user
+        self.codec = codec
+        self.latencies = []
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError(f'{self.communicator.scope["path"]} refused the connection')
+
+    async def receive(self):
+        frame = await self.communicator.receive_from(timeout=3600)
+        return msgpack.unpackb(frame) if isinstance(frame, bytes) else json.loads(frame)
+
+    async def send(self, content):
+        if self.codec == 'msgpack':
+            await self.communicator.send_to(bytes_data=msgpack.packb(content))
+        else:
+            await self.communicator.send_json_to(content)
+
+    def start_reading(self, timestamps):
+        async def read():
+            while True:
+                frame = await self.receive()
+                now = time.perf_counter()
+                self.latencies.extend(now - sent for sent in timestamps(frame))
+        self.reader = asyncio.ensure_future(read())
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = 'Opens simulated WebSocket clients against the consumers and reports connect time, fan-out latency and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['call', 'notifications'])
+        parser.add_argument('--clients', type=int, default=200, help='Sockets to open')
+        parser.add_argument('--room-size', type=int, default=4, help='Sockets per call room')
+        parser.add_argument('--rate', type=float, default=5, help='Messages per second per sender')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds to send for')
+        parser.add_argument('--payload', type=int, default=200, help='Bytes of filler per message')
+        parser.add_argument('--codec', choices=['json', 'msgpack'], default='json')
+        parser.add_argument(
+            '--layer', choices=['memory', 'configured'], default='memory',
+            help='memory: in-process layer and cache; configured: CHANNEL_LAYERS and CACHES from settings (e.g. a local Redis)',
+        )
+
+    def handle(self, *args, **options):
+        if options['scenario'] == 'call' and options['room_size'] > settings.VIDEO_CALL_ROOM_LIMIT:
+            raise CommandError(f'--room-size is above VIDEO_CALL_ROOM_LIMIT ({settings.VIDEO_CALL_ROOM_LIMIT})')
+        layer = (
+            override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, CACHES=IN_MEMORY_CACHE)
+            if options['layer'] == 'memory' else nullcontext()
+        )
+        with layer:
+            asyncio.run(self.run(options))
+
+    async def run(self, options):
+        self.layer = get_channel_layer()
+        self.options = options
+        clients = [self.make_client(i) for i in range(options['clients'])]
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        connect_times = []
+        for client in clients:
+            started = time.perf_counter()
+            await client.connect()
+            await self.after_connect(client)
+            connect_times.append(time.perf_counter() - started)
+        memory = (tracemalloc.get_traced_memory()[0] - baseline) / len(clients)
+        tracemalloc.stop()
+
+        for client in clients:
+            client.start_reading(self.timestamps)
+        sent, expected = await self.drive(clients)
+        # Let the last frames arrive
+        await asyncio.sleep(1)
+
+        latencies = [latency for client in clients for latency in client.latencies]
+        for client in clients:
+            await client.close()
+
+        self.stdout.write(f"scenario      {options['scenario']} ({options['codec']}, {options['layer']} layer)")
+        self.stdout.write(f'clients       {len(clients)}')
+        self.stdout.write(
+            f'connect       p50 {percentile(connect_times, .5) * 1e3:.2f} ms, '
+            f'p99 {percentile(connect_times, .99) * 1e3:.2f} ms, total {sum(connect_times):.2f} s'
+        )
+        self.stdout.write(f'memory        {memory / 1024:.1f} KiB per connection')
+        self.stdout.write(f'messages      {sent} sent, {len(latencies)} of {expected} deliveries received')
+        self.stdout.write(
+            f'fan-out       p50 {percentile(latencies, .5) * 1e3:.2f} ms, p99 {percentile(latencies, .99) * 1e3:.2f} ms'
+        )
+
+    def make_client(self, i):
+        user = User(id=i + 1, username=f'bench{i + 1}')
+        if self.options['scenario'] == 'call':
+            return Client(f"/ws/call/bench{i // self.options['room_size']}/", user, self.options['codec'])
+        return Client('/ws/notifications/', user, self.options['codec'])
+
+    async def after_connect(self, client):
+        if self.options['scenario'] == 'call':
+            # Peer list
+            await client.receive()
+
+    def timestamps(self, frame):
+        if self.options['scenario'] == 'call':
+            message = frame.get('message')
+            return [message['sent']] if isinstance(message, dict) else []
+        # Notification batches carry the send time of each group's latest event
+        return [group['timestamp'] for group in frame.get('batch', [])]
+
+    async def drive(self, clients):
+        """
+        Sends at the configured rate for the configured duration. Returns the number of
+        messages sent and of deliveries expected.
+        """
+        options = self.options
+        filler = 'x' * options['payload']
+        interval = 1 / options['rate']
+        deadline = time.perf_counter() + options['duration']
+        counts = [0, 0]
+
+        async def call_sender(client, room_size):
+            while time.perf_counter() < deadline:
+                await client.send({'message': {'sent': time.perf_counter(), 'filler': filler}})
+                counts[0] += 1
+                counts[1] += room_size
+                await asyncio.sleep(interval)
+
+        async def notification_sender(client):
+            user_id = client.communicator.scope['user'].id
+            sequence = 0
+            while time.perf_counter() < deadline:
+                sequence += 1
+                await self.layer.group_send(notification_group_name(user_id), {
+                    'type': 'notification.created', 'id': sequence, 'notification_type': 'comment',
+                    'post': sequence, 'sender': filler, 'timestamp': time.perf_counter(),
+                })
+                counts[0] += 1
+                counts[1] += 1
+                await asyncio.sleep(interval)
+
+        if options['scenario'] == 'call':
+            senders = []
+            for index, client in enumerate(clients):
+                room_start = index - index % options['room_size']
+                room_size = min(options['room_size'], len(clients) - room_start)
+                senders.append(call_sender(client, room_size))
+        else:
+            senders = [notification_sender(client) for client in clients]
+        await asyncio.gather(*senders)
+        return counts
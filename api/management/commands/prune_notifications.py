@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.notifications import prune
+
+
+class Command(BaseCommand):
+    help = 'Deletes old read notifications (see NOTIFICATION_RETENTION_DAYS and NOTIFICATION_MAX_PER_USER)'
+
+    def handle(self, *args, **options):
+        deleted = prune()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} notifications'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.timeline import trim_all
+
+
+class Command(BaseCommand):
+    help = 'Cuts home timelines back to their TIMELINE_MAX_LENGTH most recent entries'
+
+    def handle(self, *args, **options):
+        deleted = trim_all()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} timeline entries'))
@@ -0,0 +1,127 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from . import imaging
+from .caching import invalidate
+from .models import Post, Profile
+
+logger = logging.getLogger(__name__)
+
+# Renditions of uploaded images.
+#
+# The request only moves the upload into MEDIA_ROOT (Django streams bodies over
+# FILE_UPLOAD_MAX_MEMORY_SIZE to a temporary file in chunks). Once the row is
+# committed, a pool of MEDIA_WORKERS processes decodes the image and writes a
+# recompressed WebP per MEDIA_RENDITIONS size into the row's <field>_renditions.
+# Serializers return the rendition URLs, so feeds reference a thumbnail instead of
+# the full-size upload. Files go through the content-addressed storage (see
+# storage.py), so each row holds a reference to its uploads and renditions.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+FILE_FIELDS = {Post: ['media'], Profile: ['profile_picture', 'cover_photo']}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the workers only import Pillow, not the
+            # threads and connections of this process
+            _pool = ProcessPoolExecutor(settings.MEDIA_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def process_uploads(serializer, fields):
+    """
+    Drops the old renditions of the given file fields the serializer just saved
+    and queues new ones for the images among them, once the transaction commits.
+    """
+    instance = serializer.instance
+    fields = [field for field in fields if field in serializer.validated_data]
+    stale = {f'{field}_renditions': getattr(instance, f'{field}_renditions') for field in fields}
+    stale = {attname: renditions for attname, renditions in stale.items() if renditions}
+    if stale:
+        type(instance).objects.filter(pk=instance.pk).update(**{attname: {} for attname in stale})
+        for attname, renditions in stale.items():
+            setattr(instance, attname, {})
+            release(renditions.values())
+
+    for field in fields:
+        name = getattr(instance, field).name
+        if name and name.lower().endswith(IMAGE_EXTENSIONS):
+            transaction.on_commit(partial(submit, type(instance), instance.pk, field, name))
+
+
+def submit(model, pk, field, name):
+    args = (default_storage.path(name), settings.MEDIA_RENDITIONS, settings.MEDIA_RENDITION_QUALITY)
+    if settings.MEDIA_WORKERS:
+        pool().submit(imaging.render, *args).add_done_callback(partial(rendered, model, pk, field, name))
+        return
+
+    try:
+        store(model, pk, field, name, imaging.render(*args))
+    except Exception:
+        logger.warning('Rendering %s failed', name, exc_info=True)
+
+
+def rendered(model, pk, field, name, future):
+    # Runs on the pool's result thread, which shouldn't hold a connection between jobs
+    try:
+        store(model, pk, field, name, future.result())
+    except Exception:
+        logger.warning('Rendering %s failed', name, exc_info=True)
+    finally:
+        connection.close()
+
+
+def store(model, pk, field, name, renditions):
+    """
+    Saves the rendered files and records them on the row, unless the field has
+    been given another file in the meantime.
+    """
+    # An image uploaded twice renders into the same files, which are stored once
+    paths = {
+        rendition: default_storage.save(f'{rendition}.{imaging.EXTENSION}', ContentFile(data))
+        for rendition, data in renditions.items()
+    }
+    if model.objects.filter(pk=pk, **{field: name}).update(**{f'{field}_renditions': paths}):
+        # The read cache kinds are named after the models ('post', 'profile')
+        invalidate(model._meta.model_name, pk)
+    else:
+        release(paths.values())
+
+
+def stored_files(instance):
+    """
+    Names of the files the row references: its uploads and their renditions.
+    """
+    names = []
+    for field in FILE_FIELDS[type(instance)]:
+        names.append(getattr(instance, field).name)
+        names.extend(getattr(instance, f'{field}_renditions').values())
+    return [name for name in names if name]
+
+
+def release(names):
+    """
+    Drops a reference to each file once the current transaction commits.
+    """
+    names = [name for name in names if name]
+
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+
+    if names:
+        transaction.on_commit(delete)
@@ -0,0 +1,124 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation, ConversationParticipant, Message
+
+# Direct message conversations.
+#
+# Each pair of users shares one Conversation. Its participant rows carry a copy of
+# the last message time, so the inbox is an index scan over (user, last_message_at)
+# and a thread is an index scan over (conversation, timestamp).
+
+
+def conversation_key(user_id, other_id):
+    low, high = sorted((user_id, other_id))
+    return f'{low}:{high}'
+
+
+def direct_conversation(user, other):
+    """
+    Returns the conversation between two users, creating it on the first message.
+    """
+    # One transaction, so a conversation never exists without its participants
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(key=conversation_key(user.id, other.id))
+        if created:
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(conversation=conversation, user_id=user_id) for user_id in {user.id, other.id}],
+                ignore_conflicts=True,
+            )
+    return conversation
+
+
+def record_messages(messages):
+    """
+    Moves the last-message pointers of the messages' conversations forward.
+    """
+    latest = {}
+    for message in messages:
+        current = latest.get(message.conversation_id)
+        if current is None or (message.timestamp, message.id) > (current.timestamp, current.id):
+            latest[message.conversation_id] = message
+
+    for conversation_id, message in latest.items():
+        Conversation.objects.filter(id=conversation_id).update(
+            last_message=message, last_message_at=message.timestamp
+        )
+        ConversationParticipant.objects.filter(conversation_id=conversation_id).update(
+            last_message_at=message.timestamp
+        )
+
+
+def direct_conversations(pairs):
+    """
+    Batch form of direct_conversation(): returns {key: Conversation} for (user id,
+    user id) pairs, creating the missing ones in bulk.
+    """
+    keys = {conversation_key(*pair): pair for pair in pairs}
+    conversations = Conversation.objects.in_bulk(keys, field_name='key')
+    missing = [key for key in keys if key not in conversations]
+    if missing:
+        with transaction.atomic():
+            Conversation.objects.bulk_create([Conversation(key=key) for key in missing], ignore_conflicts=True)
+            created = Conversation.objects.in_bulk(missing, field_name='key')
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(conversation=conversation, user_id=user_id)
+                 for key, conversation in created.items() for user_id in set(keys[key])],
+                ignore_conflicts=True,
+            )
+        conversations.update(created)
+    return conversations
+
+
+def persist_messages(drafts):
+    """
+    Stores a batch of (sender id, recipient id, content) drafts with one INSERT.
+
+    Returns the saved messages in draft order, with None for drafts whose
+    recipient does not exist.
+    """
+    recipient_ids = {recipient_id for _, recipient_id, _ in drafts}
+    existing = set(User.objects.filter(id__in=recipient_ids).values_list('id', flat=True))
+    valid = [draft for draft in drafts if draft[1] in existing]
+    conversations = direct_conversations({(sender_id, recipient_id) for sender_id, recipient_id, _ in valid})
+
+    messages = [
+        Message(
+            sender_id=sender_id, recipient_id=recipient_id, content=content,
+            conversation=conversations[conversation_key(sender_id, recipient_id)],
+        )
+        for sender_id, recipient_id, content in valid
+    ]
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        record_messages(messages)
+
+    saved = iter(messages)
+    return [next(saved) if draft[1] in existing else None for draft in drafts]
+
+
+def mark_conversation_read(user, conversation_id):
+    """
+    Moves the user's read marker in the conversation to now. Returns the read time
+    and the other participants' ids, or (None, []) if the user is not a participant.
+    """
+    read_at = timezone.now()
+    updated = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id, user=user
+    ).update(last_read_at=read_at)
+    if not updated:
+        return None, []
+    others = ConversationParticipant.objects.filter(conversation_id=conversation_id).exclude(user=user)
+    return read_at, list(others.values_list('user_id', flat=True))
+
+
+def message_payload(message, sender_name):
+    return {
+        'id': message.id,
+        'conversation': message.conversation_id,
+        'sender': {'id': message.sender_id, 'username': sender_name},
+        'recipient': message.recipient_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
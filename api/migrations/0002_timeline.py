@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+# Timeline settings as of this migration (settings.py may change later)
+FANOUT_THRESHOLD = 10000
+BACKFILL_LIMIT = 50
+BATCH_SIZE = 1000  # Follows per batch
+
+
+def populate_timelines(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Follower = apps.get_model('api', 'Follower')
+    Post = apps.get_model('api', 'Post')
+    TimelineEntry = apps.get_model('api', 'TimelineEntry')
+
+    follower_counts = (
+        Follower.objects.filter(user_to=OuterRef('user'))
+        .values('user_to').annotate(total=Count('id')).values('total')
+    )
+    Profile.objects.update(follower_count=Coalesce(Subquery(follower_counts), 0))
+
+    # Each batch of follows reads the recent posts of all its authors in one query
+    fanout_on_read = Profile.objects.filter(follower_count__gt=FANOUT_THRESHOLD).values('user')
+    follows = Follower.objects.exclude(user_to__in=fanout_on_read).order_by('id').values_list(
+        'id', 'user_from', 'user_to'
+    )
+    last_id = 0
+    while batch := list(follows.filter(id__gt=last_id)[:BATCH_SIZE]):
+        last_id = batch[-1][0]
+        recent_posts = {}
+        ranked = Post.objects.filter(author__in={author_id for _, _, author_id in batch}).annotate(
+            position=Window(RowNumber(), partition_by=F('author'), order_by=F('timestamp').desc())
+        )
+        for author_id, post_id, timestamp in ranked.filter(position__lte=BACKFILL_LIMIT).values_list(
+            'author', 'id', 'timestamp'
+        ):
+            recent_posts.setdefault(author_id, []).append((post_id, timestamp))
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=user_id, post_id=post_id, timestamp=timestamp)
+             for _, user_id, author_id in batch for post_id, timestamp in recent_posts.get(author_id, ())],
+            ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-timestamp'], name='api_timelin_owner_i_ebc0ce_idx')],
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    counters = {
+        'like_count': apps.get_model('api', 'Like'),
+        'comment_count': apps.get_model('api', 'Comment'),
+        'repost_count': apps.get_model('api', 'Repost'),
+    }
+    Post.objects.update(**{
+        field: Coalesce(Subquery(
+            model.objects.filter(post=OuterRef('pk'))
+            .values('post').annotate(total=Count('id')).values('total')
+        ), 0)
+        for field, model in counters.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_post_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='repost_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
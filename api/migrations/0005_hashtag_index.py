@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:40
+
+import re
+import unicodedata
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+
+# Tag extraction as of this migration (api/hashtags.py may change later)
+HASHTAG_PATTERN = re.compile(r'(?<![\w#&/])#(\w+)')
+MAX_LENGTH = 100
+
+
+def extract_hashtags(text):
+    names = HASHTAG_PATTERN.findall(text or '')
+    return list(dict.fromkeys(unicodedata.normalize('NFKC', name).casefold()[:MAX_LENGTH] for name in names))
+
+
+def dedupe_links(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    PostHashtag = apps.get_model('api', 'PostHashtag')
+
+    # Drop duplicate links before the unique constraint is added
+    keep = PostHashtag.objects.values('post', 'hashtag').annotate(first=Min('id')).values_list('first', flat=True)
+    PostHashtag.objects.exclude(id__in=list(keep)).delete()
+    PostHashtag.objects.update(
+        timestamp=Subquery(Post.objects.filter(id=OuterRef('post')).values('timestamp'))
+    )
+
+
+def populate_hashtags(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Hashtag = apps.get_model('api', 'Hashtag')
+    PostHashtag = apps.get_model('api', 'PostHashtag')
+
+    # Tag the posts written before hashtags were extracted
+    tagged = []
+    for post_id, content, timestamp in Post.objects.values_list('id', 'content', 'timestamp').iterator():
+        tagged.extend((post_id, name, timestamp) for name in extract_hashtags(content))
+    if not tagged:
+        return
+    Hashtag.objects.bulk_create(
+        [Hashtag(name=name) for name in {name for _, name, _ in tagged}], ignore_conflicts=True, batch_size=1000,
+    )
+    hashtag_ids = dict(Hashtag.objects.values_list('name', 'id'))
+    # Links that already exist are skipped by the unique (post, hashtag) constraint
+    PostHashtag.objects.bulk_create(
+        [PostHashtag(post_id=post_id, hashtag_id=hashtag_ids[name], timestamp=timestamp)
+         for post_id, name, timestamp in tagged],
+        ignore_conflicts=True, batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posthashtag',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(dedupe_links, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='posthashtag',
+            unique_together={('post', 'hashtag')},
+        ),
+        migrations.RunPython(populate_hashtags, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='posthashtag',
+            index=models.Index(fields=['hashtag', '-timestamp', '-post'], name='api_posthas_hashtag_6ab836_idx'),
+        ),
+    ]
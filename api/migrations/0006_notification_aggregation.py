@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:42
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000  # Notifications updated per query
+
+
+def populate_latest_actors(apps, schema_editor):
+    Notification = apps.get_model('api', 'Notification')
+    senders = Notification.objects.order_by('id').values_list('id', 'sender__username').iterator(chunk_size=BATCH_SIZE)
+    while batch := list(islice(senders, BATCH_SIZE)):
+        Notification.objects.bulk_update(
+            [Notification(id=notification_id, latest_actors=[username]) for notification_id, username in batch],
+            ['latest_actors'], batch_size=BATCH_SIZE,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_hashtag_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='latest_actors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(populate_latest_actors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'notification_type', 'post', 'is_read'], name='api_notific_user_id_874fd6_idx'),
+        ),
+    ]
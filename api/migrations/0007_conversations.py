@@ -0,0 +1,106 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:44
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+BATCH_SIZE = 1000  # Conversations created per batch
+
+
+def populate_conversations(apps, schema_editor):
+    Message = apps.get_model('api', 'Message')
+    Conversation = apps.get_model('api', 'Conversation')
+    ConversationParticipant = apps.get_model('api', 'ConversationParticipant')
+
+    # One conversation per pair of users that exchanged messages
+    pairs = (
+        Message.objects.annotate(low=Least('sender', 'recipient'), high=Greatest('sender', 'recipient'))
+        .values_list('low', 'high').distinct().order_by('low', 'high')
+    )
+    pairs = pairs.iterator(chunk_size=BATCH_SIZE)
+    while batch := list(islice(pairs, BATCH_SIZE)):
+        keys = {f'{low}:{high}': (low, high) for low, high in batch}
+        Conversation.objects.bulk_create([Conversation(key=key) for key in keys], batch_size=BATCH_SIZE)
+        ConversationParticipant.objects.bulk_create(
+            [ConversationParticipant(conversation_id=conversation_id, user_id=user_id)
+             for key, conversation_id in Conversation.objects.filter(key__in=keys).values_list('key', 'id')
+             for user_id in set(keys[key])],
+            batch_size=BATCH_SIZE,
+        )
+
+    # Then each message, conversation and participant in one UPDATE per table
+    key = Concat(
+        Cast(Least(OuterRef('sender'), OuterRef('recipient')), CharField()),
+        Value(':'),
+        Cast(Greatest(OuterRef('sender'), OuterRef('recipient')), CharField()),
+    )
+    Message.objects.update(conversation=Subquery(Conversation.objects.filter(key=key).values('id')[:1]))
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp', '-id')
+    Conversation.objects.update(
+        last_message=Subquery(latest.values('id')[:1]),
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+    )
+    ConversationParticipant.objects.update(
+        last_message_at=Subquery(Conversation.objects.filter(id=OuterRef('conversation')).values('last_message_at'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_notification_aggregation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='api.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-timestamp', '-id'], name='api_message_convers_23c293_idx'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='api.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='api_convers_user_id_ca6c0c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='conversationparticipant',
+            unique_together={('conversation', 'user')},
+        ),
+        migrations.RunPython(populate_conversations, migrations.RunPython.noop),
+    ]
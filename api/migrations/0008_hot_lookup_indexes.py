@@ -0,0 +1,66 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:59
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def drop_duplicates(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    counters = {
+        'like_count': apps.get_model('api', 'Like'),
+        'repost_count': apps.get_model('api', 'Repost'),
+    }
+    for field, model in counters.items():
+        # Keep the first like/repost of each (user, post) before the unique constraint is added
+        duplicated = list(
+            model.objects.values('user', 'post').annotate(first=Min('id'), total=Count('id')).filter(total__gt=1)
+        )
+        if not duplicated:
+            continue
+        for row in duplicated:
+            model.objects.filter(user=row['user'], post=row['post']).exclude(id=row['first']).delete()
+        # The counters counted every duplicate
+        Post.objects.filter(id__in=[row['post'] for row in duplicated]).update(**{
+            field: Coalesce(Subquery(
+                model.objects.filter(post=OuterRef('pk'))
+                .values('post').annotate(total=Count('id')).values('total')
+            ), 0)
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_conversations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='like',
+            unique_together={('user', 'post')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='repost',
+            unique_together={('user', 'post')},
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', '-timestamp', '-id'], name='api_message_sender__1ec8fa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', '-timestamp', '-id'], name='api_message_recipie_eca6ff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='api_notific_user_id_bf630b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-timestamp'], name='api_post_author__a5aa14_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Follower = apps.get_model('api', 'Follower')
+    counters = {'follower_count': 'user_to', 'following_count': 'user_from'}
+    Profile.objects.update(**{
+        field: Coalesce(Subquery(
+            Follower.objects.filter(**{side: OuterRef('user')})
+            .values(side).annotate(total=Count('id')).values('total')
+        ), 0)
+        for field, side in counters.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_stored_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='follower',
+            index=models.Index(fields=['user_to', '-created', '-id'], name='api_followe_user_to_cc4d02_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follower',
+            index=models.Index(fields=['user_from', '-created', '-id'], name='api_followe_user_fr_219992_idx'),
+        ),
+    ]
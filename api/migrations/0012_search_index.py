@@ -0,0 +1,120 @@
+from django.db import migrations
+
+# Full-text index for api/search.py, in the database's own full-text support.
+#
+# SQLite: FTS5 tables keyed by the entity id (rowid), kept current by triggers on
+# the source tables. Posts and hashtags are external-content tables (only the
+# index is stored; the text stays in api_post/api_hashtag); users combine
+# auth_user.username and api_profile.bio in one table. prefix='2 3' adds prefix
+# indexes for autocomplete.
+#
+# PostgreSQL: GIN indexes on the 'simple' tsvector of each column, which the
+# planner uses for the matching expressions in search.py. Hashtag prefixes use the
+# varchar_pattern_ops index Django already creates for the unique name.
+#
+# SQLite drops a table's triggers when a migration rebuilds it (most AlterField
+# and RemoveField operations do). A later migration that alters api_post,
+# api_hashtag, api_profile or auth_user should recreate that table's triggers;
+# search.restore_triggers() also recreates any missing ones after every migrate.
+
+TOKENIZE = "tokenize=\"unicode61 remove_diacritics 2 tokenchars '_'\", prefix='2 3'"
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE api_search_post USING fts5(content, content='api_post', content_rowid='id', {TOKENIZE})",
+    "INSERT INTO api_search_post(api_search_post) VALUES ('rebuild')",
+    """CREATE TRIGGER api_search_post_insert AFTER INSERT ON api_post BEGIN
+        INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER api_search_post_update AFTER UPDATE OF content ON api_post
+    WHEN old.content IS NOT new.content BEGIN
+        INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER api_search_post_delete AFTER DELETE ON api_post BEGIN
+        INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+
+    f"CREATE VIRTUAL TABLE api_search_hashtag USING fts5(name, content='api_hashtag', content_rowid='id', {TOKENIZE})",
+    "INSERT INTO api_search_hashtag(api_search_hashtag) VALUES ('rebuild')",
+    """CREATE TRIGGER api_search_hashtag_insert AFTER INSERT ON api_hashtag BEGIN
+        INSERT INTO api_search_hashtag(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER api_search_hashtag_update AFTER UPDATE OF name ON api_hashtag
+    WHEN old.name IS NOT new.name BEGIN
+        INSERT INTO api_search_hashtag(api_search_hashtag, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO api_search_hashtag(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER api_search_hashtag_delete AFTER DELETE ON api_hashtag BEGIN
+        INSERT INTO api_search_hashtag(api_search_hashtag, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+
+    f"CREATE VIRTUAL TABLE api_search_user USING fts5(username, bio, {TOKENIZE})",
+    """INSERT INTO api_search_user(rowid, username, bio)
+        SELECT auth_user.id, auth_user.username, COALESCE(api_profile.bio, '')
+        FROM auth_user LEFT JOIN api_profile ON api_profile.user_id = auth_user.id""",
+    """CREATE TRIGGER api_search_user_insert AFTER INSERT ON auth_user BEGIN
+        INSERT INTO api_search_user(rowid, username, bio) VALUES (new.id, new.username, '');
+    END""",
+    """CREATE TRIGGER api_search_user_update AFTER UPDATE OF username ON auth_user
+    WHEN old.username IS NOT new.username BEGIN
+        UPDATE api_search_user SET username = new.username WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER api_search_user_delete AFTER DELETE ON auth_user BEGIN
+        DELETE FROM api_search_user WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER api_search_profile_insert AFTER INSERT ON api_profile BEGIN
+        UPDATE api_search_user SET bio = new.bio WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER api_search_profile_update AFTER UPDATE OF bio ON api_profile
+    WHEN old.bio IS NOT new.bio BEGIN
+        UPDATE api_search_user SET bio = new.bio WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER api_search_profile_delete AFTER DELETE ON api_profile BEGIN
+        UPDATE api_search_user SET bio = '' WHERE rowid = old.user_id;
+    END""",
+]
+
+SQLITE_DROP = [
+    *(f'DROP TRIGGER IF EXISTS api_search_post_{event}' for event in ('insert', 'update', 'delete')),
+    *(f'DROP TRIGGER IF EXISTS api_search_hashtag_{event}' for event in ('insert', 'update', 'delete')),
+    *(f'DROP TRIGGER IF EXISTS api_search_user_{event}' for event in ('insert', 'update', 'delete')),
+    *(f'DROP TRIGGER IF EXISTS api_search_profile_{event}' for event in ('insert', 'update', 'delete')),
+    'DROP TABLE IF EXISTS api_search_post',
+    'DROP TABLE IF EXISTS api_search_hashtag',
+    'DROP TABLE IF EXISTS api_search_user',
+]
+
+POSTGRES_CREATE = [
+    "CREATE INDEX api_post_search ON api_post USING GIN (to_tsvector('simple', content))",
+    "CREATE INDEX auth_user_search ON auth_user USING GIN (to_tsvector('simple', username))",
+    "CREATE INDEX api_profile_search ON api_profile USING GIN (to_tsvector('simple', bio))",
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS api_post_search',
+    'DROP INDEX IF EXISTS auth_user_search',
+    'DROP INDEX IF EXISTS api_profile_search',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_follow_counters'),
+        # After the last rebuild of auth_user, which would drop its triggers
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}),
+        ),
+    ]
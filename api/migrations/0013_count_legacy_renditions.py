@@ -0,0 +1,46 @@
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+# Renditions rendered before content addressing are named after their content
+# ('renditions/<hash prefix>/<sha256>.webp') and shared by every row with the same
+# image, but have no StoredFile row. Counting their references here makes
+# storage.delete() release them like content-addressed files instead of deleting
+# them with the first row.
+
+RENDITION_FIELDS = {
+    'post': ['media_renditions'],
+    'profile': ['profile_picture_renditions', 'cover_photo_renditions'],
+}
+
+
+def size(name):
+    try:
+        return default_storage.size(name)
+    except OSError:
+        return 0
+
+
+def count_renditions(apps, schema_editor):
+    StoredFile = apps.get_model('api', 'StoredFile')
+    references = Counter()
+    for model_name, fields in RENDITION_FIELDS.items():
+        for row in apps.get_model('api', model_name).objects.values_list(*fields).iterator():
+            for renditions in row:
+                references.update(name for name in renditions.values() if name.startswith('renditions/'))
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, size=size(name), references=count) for name, count in references.items()],
+        ignore_conflicts=True, batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_renditions, migrations.RunPython.noop),
+    ]
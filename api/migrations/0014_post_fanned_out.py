@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Fan-out threshold as of this migration (settings.py may change later)
+FANOUT_THRESHOLD = 10000
+
+# Adding or removing the column rebuilds api_post on SQLite, which drops the search triggers of
+# 0012_search_index; recreate them as they were there
+SQLITE_POST_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS api_search_post_insert AFTER INSERT ON api_post BEGIN
+        INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_search_post_update AFTER UPDATE OF content ON api_post
+    WHEN old.content IS NOT new.content BEGIN
+        INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_search_post_delete AFTER DELETE ON api_post BEGIN
+        INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+]
+
+
+def mark_fanned_out(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Profile = apps.get_model('api', 'Profile')
+
+    # Until now the feed merged in every post of the authors above the threshold and
+    # took the rest from the timelines
+    fanout_on_read = Profile.objects.filter(follower_count__gt=FANOUT_THRESHOLD).values('user')
+    Post.objects.exclude(author__in=fanout_on_read).update(fanned_out=True)
+
+
+def recreate_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_POST_TRIGGERS:
+            schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_count_legacy_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Runs last when migrating back, after the column is removed again
+        migrations.RunPython(migrations.RunPython.noop, recreate_search_triggers),
+        migrations.AddField(
+            model_name='post',
+            name='fanned_out',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-timestamp'], name='api_post_fanout_on_read_idx'),
+        ),
+        migrations.RunPython(recreate_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(mark_fanned_out, migrations.RunPython.noop),
+    ]
@@ -12,6 +12,12 @@ class Profile(models.Model):
     location = models.CharField(max_length=255, blank=True)
     website = models.URLField(blank=True)
     cover_photo = models.ImageField(upload_to='cover_photos/', blank=True)
+    # Rendition name -> stored WebP, written by the media workers (see api/media.py)
+    profile_picture_renditions = models.JSONField(default=dict, blank=True)
+    cover_photo_renditions = models.JSONField(default=dict, blank=True)
+    # Denormalized counters, kept in sync by follows and deleted follows (see timeline.py)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -22,6 +28,20 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(default=timezone.now)
     media = models.FileField(upload_to='uploads/', null=True, blank=True)
+    media_renditions = models.JSONField(default=dict, blank=True)  # Filled in for images (see api/media.py)
+    # Denormalized counters, kept in sync by the Like/Comment/Repost viewsets
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    repost_count = models.PositiveIntegerField(default=0)
+    fanned_out = models.BooleanField(default=False)  # Pushed into the followers' timelines (see api/timeline.py)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-timestamp', '-id']),  # Keyset pagination of the post list
+            models.Index(fields=['author', '-timestamp']),  # Posts by the followed authors, newest first
+            # Posts merged into feeds at read time
+            models.Index(fields=['author', '-timestamp'], condition=models.Q(fanned_out=False), name='api_post_fanout_on_read_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.author} at {self.timestamp}'
@@ -32,6 +52,9 @@ class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        unique_together = ('user', 'post')  # One like per user; also serves the liked-by-me lookup
+
     def __str__(self):
         return f'{self.user.username} liked {self.post.id}'
 
@@ -53,6 +76,11 @@ class Follower(models.Model):
 
     class Meta:
         unique_together = ('user_from', 'user_to')
+        indexes = [
+            # Keyset pagination of a user's followers and followed users
+            models.Index(fields=['user_to', '-created', '-id']),
+            models.Index(fields=['user_from', '-created', '-id']),
+        ]
 
     def __str__(self):
         return f'{self.user_from.username} follows {self.user_to.username}'
@@ -70,6 +98,15 @@ class Notification(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
+    # Unread notifications of the same type on the same post are folded into one row
+    actor_count = models.PositiveIntegerField(default=1)
+    latest_actors = models.JSONField(default=list, blank=True)  # Usernames, most recent first
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'notification_type', 'post', 'is_read']),
+            models.Index(fields=['user', '-timestamp', '-id']),  # Keyset pagination of a user's notifications
+        ]
 
     def __str__(self):
         return f'{self.sender} sent a {self.notification_type} notification to {self.user}'
@@ -78,25 +115,94 @@ class Notification(models.Model):
 class Message(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     recipient = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
+    conversation = models.ForeignKey('Conversation', related_name='messages', on_delete=models.CASCADE, null=True, blank=True)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', '-timestamp', '-id']),  # Keyset pagination of a thread
+            # Messages sent by or to a user, newest first
+            models.Index(fields=['sender', '-timestamp', '-id']),
+            models.Index(fields=['recipient', '-timestamp', '-id']),
+        ]
+
     def __str__(self):
         return f'Message from {self.sender.username} to {self.recipient.username}'
 
+# Conversation Model (a direct message thread between two users)
+class Conversation(models.Model):
+    key = models.CharField(max_length=64, unique=True)  # '<lower user id>:<higher user id>'
+    created = models.DateTimeField(auto_now_add=True)
+    last_message = models.ForeignKey(Message, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Conversation {self.key}'
+
+# Conversation Participant Model (one row per user in a conversation, drives the inbox)
+class ConversationParticipant(models.Model):
+    conversation = models.ForeignKey(Conversation, related_name='participants', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='conversations', on_delete=models.CASCADE)
+    last_message_at = models.DateTimeField(null=True, blank=True)  # Copy of conversation.last_message_at for the inbox index
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('conversation', 'user')
+        indexes = [models.Index(fields=['user', '-last_message_at', '-id'])]
+
+    def __str__(self):
+        return f'{self.user.username} in {self.conversation}'
+
 # Repost Model
 class Repost(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='reposts')
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        unique_together = ('user', 'post')
+
     def __str__(self):
         return f'{self.user.username} reposted {self.post.id}'
 
 # Hashtag and PostHashtag Models
 class Hashtag(models.Model):
-    name = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=100, unique=True)  # Normalized (case-folded, no '#')
+
+    def __str__(self):
+        return self.name
 
 class PostHashtag(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hashtags')
-    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
\ No newline at end of file
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(default=timezone.now)  # Copy of post.timestamp for recent-posts-by-tag scans
+
+    class Meta:
+        unique_together = ('post', 'hashtag')
+        indexes = [models.Index(fields=['hashtag', '-timestamp', '-post'])]
+
+    def __str__(self):
+        return f'#{self.hashtag.name}'
+
+# Stored File Model (references to a content-addressed media file, see api/storage.py)
+class StoredFile(models.Model):
+    name = models.CharField(max_length=100, unique=True)  # 'cas/<hash prefix>/<sha256>.<ext>', or a shared rendition
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)  # Rows using the file; it is deleted at 0
+
+    def __str__(self):
+        return self.name
+
+# Timeline Entry Model (materialized home feed, filled by fan-out on write)
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    timestamp = models.DateTimeField()  # Copy of post.timestamp so the timeline sorts on its own index
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [models.Index(fields=['owner', '-timestamp'])]
+
+    def __str__(self):
+        return f'Post {self.post_id} in timeline of {self.owner_id}'
@@ -0,0 +1,187 @@
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(user_id):
+    """
+    Channel layer group the user's NotificationConsumer sockets listen on.
+    """
+    return f'notifications_{user_id}'
+
+
+def notify(user, sender, notification_type, post=None):
+    """
+    Stores a notification and pushes it to the recipient's open sockets once committed.
+
+    If the user has an unread notification of the same type on the same post, it is
+    folded into that row (actor count bumped, sender moved to the front of
+    latest_actors) instead of adding a new one. A sender still listed in
+    latest_actors is not counted twice.
+    """
+    with transaction.atomic():
+        notification = (
+            Notification.objects.select_for_update()
+            .filter(user=user, notification_type=notification_type, post=post, is_read=False)
+            .order_by('-timestamp')
+            .first()
+        )
+        if notification is None:
+            notification = Notification.objects.create(
+                user=user, sender=sender, notification_type=notification_type, post=post,
+                latest_actors=[sender.username],
+            )
+            transaction.on_commit(lambda: _adjust_unread_count(user.id, 1))
+        else:
+            if sender.username not in notification.latest_actors:
+                notification.actor_count += 1
+            others = [name for name in notification.latest_actors if name != sender.username]
+            notification.latest_actors = [sender.username, *others][:settings.NOTIFICATION_LATEST_ACTORS]
+            notification.sender = sender
+            notification.timestamp = timezone.now()
+            notification.save(update_fields=['actor_count', 'latest_actors', 'sender', 'timestamp'])
+    transaction.on_commit(lambda: publish(notification))
+    return notification
+
+
+def mark_read(user, up_to=None, notification_id=None):
+    """
+    Marks the user's unread notifications as read in a single UPDATE, optionally only
+    those with id <= up_to or the one with notification_id. Returns how many changed.
+    """
+    unread = Notification.objects.filter(user=user, is_read=False)
+    if up_to is not None:
+        unread = unread.filter(id__lte=up_to)
+    if notification_id is not None:
+        unread = unread.filter(id=notification_id)
+    updated = unread.update(is_read=True)
+    if updated:
+        _adjust_unread_count(user.id, -updated)
+    return updated
+
+
+def unread_count(user):
+    """
+    Returns the user's unread notification count from the cache, counting (and
+    caching) it only on a miss.
+    """
+    key = _unread_count_key(user.id)
+    try:
+        count = cache.get(key)
+    except Exception:
+        logger.warning('Reading the unread count of user %s failed', user.id, exc_info=True)
+        return Notification.objects.filter(user=user, is_read=False).count()
+    if count is None:
+        count = Notification.objects.filter(user=user, is_read=False).count()
+        try:
+            cache.set(key, count, settings.NOTIFICATION_UNREAD_COUNT_TTL)
+        except Exception:
+            logger.warning('Caching the unread count of user %s failed', user.id, exc_info=True)
+    return max(count, 0)
+
+
+def _unread_count_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _adjust_unread_count(user_id, delta):
+    try:
+        cache.incr(_unread_count_key(user_id), delta)
+    except ValueError:
+        # Not cached, the next read counts it
+        pass
+    except Exception:
+        # A cached count missing this change is recounted when its TTL runs out
+        logger.warning('Updating the unread count of user %s failed', user_id, exc_info=True)
+
+
+def prune(now=None):
+    """
+    Deletes read notifications older than NOTIFICATION_RETENTION_DAYS, and the read
+    notifications past the NOTIFICATION_MAX_PER_USER most recent ones of each user.
+    Unread notifications are never deleted. Returns the number of rows deleted.
+    """
+    now = now or timezone.now()
+    read = Notification.objects.filter(is_read=True)
+    deleted, _ = read.filter(timestamp__lt=now - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)).delete()
+
+    limit = settings.NOTIFICATION_MAX_PER_USER
+    heavy_users = (
+        Notification.objects.values('user').annotate(total=Count('id'))
+        .filter(total__gt=limit).values_list('user', flat=True)
+    )
+    for user_id in heavy_users:
+        cutoff = (
+            Notification.objects.filter(user=user_id).order_by('-timestamp', '-id')
+            .values_list('timestamp', flat=True)[limit - 1]
+        )
+        count, _ = read.filter(user=user_id, timestamp__lt=cutoff).delete()
+        deleted += count
+    return deleted
+
+
+def publish(notification):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    event = {
+        'type': 'notification.created',
+        'id': notification.id,
+        'notification_type': notification.notification_type,
+        'post': notification.post_id,
+        'sender': notification.sender.username,
+        'timestamp': notification.timestamp.isoformat(),
+    }
+    try:
+        async_to_sync(channel_layer.group_send)(group_name(notification.user_id), event)
+    except Exception:
+        # The notification is stored either way, clients pick it up on their next fetch
+        logger.warning('Could not push notification %s', notification.id, exc_info=True)
+
+
+VERBS = {
+    'like': 'liked your post',
+    'comment': 'commented on your post',
+    'follow': 'followed you',
+}
+
+
+def coalesce(events, max_actors=3):
+    """
+    Folds notification events of the same type on the same post into one entry
+    ("12 people liked your post"), most recent group first.
+    """
+    groups = {}
+    for event in events:
+        key = (event['notification_type'], event['post'])
+        group = groups.pop(key, None) or {
+            'notification_type': event['notification_type'],
+            'post': event['post'],
+            'count': 0,
+            'actors': [],
+        }
+        group['count'] += 1
+        group['latest_id'] = event['id']
+        group['timestamp'] = event['timestamp']
+        if event['sender'] in group['actors']:
+            group['actors'].remove(event['sender'])
+        group['actors'] = [event['sender'], *group['actors']][:max_actors]
+        groups[key] = group  # Re-inserted so the dict stays ordered by latest event
+
+    batch = list(reversed(groups.values()))
+    for group in batch:
+        verb = VERBS.get(group['notification_type'], 'sent you a notification')
+        who = group['actors'][0] if group['count'] == 1 else f"{group['count']} people"
+        group['message'] = f'{who} {verb}'
+    return batch
@@ -0,0 +1,117 @@
+import asyncio
+
+from django.db.models import Prefetch, aprefetch_related_objects
+from rest_framework import serializers
+
+from .user_cache import ahydrate_users
+
+# Declarative eager loading.
+#
+# Serializers list the relations they read in their Meta:
+#
+#     class Meta:
+#         model = Notification
+#         select_related = ['sender']
+#         prefetch_related = [Prefetch('post__likes', queryset=...)]
+#
+# Nested serializers are followed automatically, so PostSerializer's author (a nested
+# UserSerializer) becomes select_related('author') without being listed. Viewsets pick
+# the plan up through EagerLoadingMixin, which keeps the number of queries per list
+# endpoint fixed whatever the page size.
+#
+# User foreign keys listed in Meta.cached_users are not joined at the top level:
+# CachedUsersListSerializer fills them from the per-process user cache instead.
+
+
+def eager_load(queryset, serializer_class):
+    """
+    Applies the serializer's select_related/prefetch_related plan to the queryset.
+    """
+    queryset = select_related(queryset, serializer_class)
+    prefetch = get_prefetches(serializer_class)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def select_related(queryset, serializer_class):
+    """
+    Applies only the joins of the serializer's plan, for rows whose prefetches are
+    loaded afterwards with aload_related().
+    """
+    select, _ = get_plan(serializer_class)
+    if select:
+        queryset = queryset.select_related(*dict.fromkeys(select))
+    return queryset
+
+
+async def aload_related(instances, serializer_class):
+    """
+    Async views: runs the plan's prefetches and the user hydration for rows fetched
+    through select_related(). They don't depend on each other, so they are awaited
+    together.
+    """
+    prefetch = get_prefetches(serializer_class)
+    cached_users = getattr(getattr(serializer_class, 'Meta', None), 'cached_users', [])
+    await asyncio.gather(
+        *(aprefetch_related_objects(instances, lookup) for lookup in prefetch),
+        ahydrate_users(instances, cached_users),
+    )
+
+
+def get_prefetches(serializer_class):
+    _, prefetch = get_plan(serializer_class)
+    # A plain lookup can't be combined with a Prefetch() object for the same path
+    custom = {lookup.prefetch_to for lookup in prefetch if isinstance(lookup, Prefetch)}
+    return [lookup for lookup in prefetch if isinstance(lookup, Prefetch) or lookup not in custom]
+
+
+def get_plan(serializer_class, prefix='', many=False):
+    """
+    Returns the (select_related, prefetch_related) lookups a serializer needs.
+
+    Relations of a serializer nested through a to-many relation can't be joined, so
+    they are all prefetched.
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    select = [prefix + lookup for lookup in getattr(meta, 'select_related', [])]
+    prefetch = [_prefixed(prefix, lookup) for lookup in getattr(meta, 'prefetch_related', [])]
+    # Nested serializers are rendered one by one, so only the top level skips the join
+    cached = set(getattr(meta, 'cached_users', [])) if not prefix else set()
+
+    for name, field in getattr(serializer_class, '_declared_fields', {}).items():
+        source = (field.source or name).replace('.', '__')
+        if source == '*' or source in cached:
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(prefix + source)
+            nested = get_plan(type(field.child), prefix=f'{prefix}{source}__', many=True)
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(prefix + source)
+            nested = get_plan(type(field), prefix=f'{prefix}{source}__', many=many)
+        else:
+            continue
+        select += nested[0]
+        prefetch += nested[1]
+
+    if many:
+        return [], prefetch + select
+    return select, prefetch
+
+
+def _prefixed(prefix, lookup):
+    if isinstance(lookup, Prefetch):
+        return Prefetch(prefix + lookup.prefetch_through, queryset=lookup.queryset, to_attr=lookup.to_attr)
+    return prefix + lookup
+
+
+class EagerLoadingMixin:
+    """
+    Viewset mixin applying the serializer's eager loading plan to get_queryset().
+    """
+
+    def get_queryset(self):
+        return self.eager_load(super().get_queryset())
+
+    def eager_load(self, queryset):
+        return eager_load(queryset, self.get_serializer_class())
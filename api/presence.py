@@ -0,0 +1,72 @@
+import logging
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Video call room presence.
+#
+# A room has VIDEO_CALL_ROOM_LIMIT member slots, each a cache key holding the
+# member's channel name and user. Joining claims the first free slot with
+# cache.add(), which is atomic on every backend, so a full room rejects the socket
+# without a lock, and listing a room reads its slots in one get_many(). Slots expire
+# after VIDEO_CALL_PRESENCE_TTL seconds without activity, in case a worker dies
+# before its sockets disconnect.
+#
+# join() raises if the cache is unreachable, so the socket can be refused; the
+# other calls log the error and carry on, since an unreleased slot expires anyway.
+
+ROOM_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def is_valid_room(room_name):
+    # Channel layer group names only allow ASCII letters, digits, '_', '-' and '.'
+    return bool(ROOM_NAME.match(room_name))
+
+
+def _slot_key(room_name, slot):
+    return f'call:{room_name}:{slot}'
+
+
+async def join(room_name, member):
+    """
+    Claims a free slot in the room for member ({'peer', 'user', 'username'}).
+    Returns the slot number, or None if the room is full.
+    """
+    for slot in range(settings.VIDEO_CALL_ROOM_LIMIT):
+        if await cache.aadd(_slot_key(room_name, slot), member, settings.VIDEO_CALL_PRESENCE_TTL):
+            return slot
+    return None
+
+
+async def leave(room_name, slot, peer):
+    key = _slot_key(room_name, slot)
+    try:
+        member = await cache.aget(key)
+        # The slot may have expired and been claimed by someone else meanwhile
+        if member is not None and member['peer'] == peer:
+            await cache.adelete(key)
+    except Exception:
+        logger.warning('Leaving call room %s failed', room_name, exc_info=True)
+
+
+async def touch(room_name, slot):
+    try:
+        await cache.atouch(_slot_key(room_name, slot), settings.VIDEO_CALL_PRESENCE_TTL)
+    except Exception:
+        logger.warning('Refreshing call room %s failed', room_name, exc_info=True)
+
+
+async def members(room_name):
+    """
+    Returns the room's members, in slot order.
+    """
+    keys = [_slot_key(room_name, slot) for slot in range(settings.VIDEO_CALL_ROOM_LIMIT)]
+    try:
+        found = await cache.aget_many(keys)
+    except Exception:
+        logger.warning('Listing call room %s failed', room_name, exc_info=True)
+        return []
+    return [found[key] for key in keys if key in found]
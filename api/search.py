@@ -0,0 +1,242 @@
+import logging
+import re
+
+from django.db import connection, connections, transaction
+from django.db.models.functions import Length
+
+from .models import Hashtag
+
+# Full-text search over posts, users (username and bio) and hashtags.
+#
+# Queries go to the index built by migration 0012: FTS5 tables on SQLite, GIN
+# tsvector indexes on PostgreSQL. A query is split into word tokens that must
+# all match; the last one also matches as a prefix, so results follow what is
+# being typed. Each function returns ids, best match first; the views load the
+# rows (most through the caches) in that order.
+
+logger = logging.getLogger(__name__)
+
+TERM = re.compile(r'\w+')
+MAX_TERMS = 8  # Longer queries are cut, which bounds the cost of a match
+
+
+def terms(query):
+    return TERM.findall(query or '')[:MAX_TERMS]
+
+
+def search_posts(query, limit):
+    return backend().posts(terms(query), limit)
+
+
+def search_users(query, limit):
+    """
+    Users whose username or bio matches; username matches rank higher.
+    """
+    return backend().users(terms(query), limit)
+
+
+def search_hashtags(query, limit):
+    return backend().hashtags(terms(query), limit)
+
+
+def autocomplete_users(prefix, limit):
+    """
+    Users whose username, or a part of it after '.', '-', '@' or '+', starts with
+    the prefix.
+    """
+    return backend().users(terms(prefix), limit, usernames_only=True)
+
+
+# SQLite drops a table's triggers whenever a migration rebuilds the table, which
+# would leave its index silently stale. After every migrate, restore_triggers()
+# recreates the missing ones and rebuilds the indexes they feed.
+
+SQLITE_TRIGGERS = {
+    'api_search_post_insert': ('api_search_post', """
+        CREATE TRIGGER api_search_post_insert AFTER INSERT ON api_post BEGIN
+            INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+        END"""),
+    'api_search_post_update': ('api_search_post', """
+        CREATE TRIGGER api_search_post_update AFTER UPDATE OF content ON api_post
+        WHEN old.content IS NOT new.content BEGIN
+            INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO api_search_post(rowid, content) VALUES (new.id, new.content);
+        END"""),
+    'api_search_post_delete': ('api_search_post', """
+        CREATE TRIGGER api_search_post_delete AFTER DELETE ON api_post BEGIN
+            INSERT INTO api_search_post(api_search_post, rowid, content) VALUES ('delete', old.id, old.content);
+        END"""),
+    'api_search_hashtag_insert': ('api_search_hashtag', """
+        CREATE TRIGGER api_search_hashtag_insert AFTER INSERT ON api_hashtag BEGIN
+            INSERT INTO api_search_hashtag(rowid, name) VALUES (new.id, new.name);
+        END"""),
+    'api_search_hashtag_update': ('api_search_hashtag', """
+        CREATE TRIGGER api_search_hashtag_update AFTER UPDATE OF name ON api_hashtag
+        WHEN old.name IS NOT new.name BEGIN
+            INSERT INTO api_search_hashtag(api_search_hashtag, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO api_search_hashtag(rowid, name) VALUES (new.id, new.name);
+        END"""),
+    'api_search_hashtag_delete': ('api_search_hashtag', """
+        CREATE TRIGGER api_search_hashtag_delete AFTER DELETE ON api_hashtag BEGIN
+            INSERT INTO api_search_hashtag(api_search_hashtag, rowid, name) VALUES ('delete', old.id, old.name);
+        END"""),
+    'api_search_user_insert': ('api_search_user', """
+        CREATE TRIGGER api_search_user_insert AFTER INSERT ON auth_user BEGIN
+            INSERT INTO api_search_user(rowid, username, bio) VALUES (new.id, new.username, '');
+        END"""),
+    'api_search_user_update': ('api_search_user', """
+        CREATE TRIGGER api_search_user_update AFTER UPDATE OF username ON auth_user
+        WHEN old.username IS NOT new.username BEGIN
+            UPDATE api_search_user SET username = new.username WHERE rowid = new.id;
+        END"""),
+    'api_search_user_delete': ('api_search_user', """
+        CREATE TRIGGER api_search_user_delete AFTER DELETE ON auth_user BEGIN
+            DELETE FROM api_search_user WHERE rowid = old.id;
+        END"""),
+    'api_search_profile_insert': ('api_search_user', """
+        CREATE TRIGGER api_search_profile_insert AFTER INSERT ON api_profile BEGIN
+            UPDATE api_search_user SET bio = new.bio WHERE rowid = new.user_id;
+        END"""),
+    'api_search_profile_update': ('api_search_user', """
+        CREATE TRIGGER api_search_profile_update AFTER UPDATE OF bio ON api_profile
+        WHEN old.bio IS NOT new.bio BEGIN
+            UPDATE api_search_user SET bio = new.bio WHERE rowid = new.user_id;
+        END"""),
+    'api_search_profile_delete': ('api_search_user', """
+        CREATE TRIGGER api_search_profile_delete AFTER DELETE ON api_profile BEGIN
+            UPDATE api_search_user SET bio = '' WHERE rowid = old.user_id;
+        END"""),
+}
+
+SQLITE_REBUILD = {
+    'api_search_post': ["INSERT INTO api_search_post(api_search_post) VALUES ('rebuild')"],
+    'api_search_hashtag': ["INSERT INTO api_search_hashtag(api_search_hashtag) VALUES ('rebuild')"],
+    'api_search_user': [
+        'DELETE FROM api_search_user',
+        """INSERT INTO api_search_user(rowid, username, bio)
+            SELECT auth_user.id, auth_user.username, COALESCE(api_profile.bio, '')
+            FROM auth_user LEFT JOIN api_profile ON api_profile.user_id = auth_user.id""",
+    ],
+}
+
+
+def restore_triggers(using='default'):
+    """
+    Recreates the SQLite search triggers missing from the database and rebuilds the
+    indexes they feed. Returns the names of the recreated triggers.
+    """
+    database = connections[using]
+    if database.vendor != 'sqlite':
+        return []
+    with database.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+        # Before migration 0012 (or after migrating back past it) there is no index
+        missing = [name for name, (table, _) in SQLITE_TRIGGERS.items() if table in existing and name not in existing]
+        if not missing:
+            return []
+        logger.warning('Recreating dropped search triggers: %s', ', '.join(missing))
+        with transaction.atomic(using=using):
+            for name in missing:
+                cursor.execute(SQLITE_TRIGGERS[name][1])
+            for table in dict.fromkeys(SQLITE_TRIGGERS[name][0] for name in missing):
+                for statement in SQLITE_REBUILD[table]:
+                    cursor.execute(statement)
+    return missing
+
+
+def backend():
+    return PostgresSearch if connection.vendor == 'postgresql' else SQLiteSearch
+
+
+def _ids(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteSearch:
+    # bm25() weights per column of api_search_user (username, bio)
+    USER_WEIGHTS = (10.0, 1.0)
+
+    @staticmethod
+    def match(terms, column=None):
+        # Every term quoted, so FTS5 operators in the input are plain text
+        expression = ' '.join(f'"{term}"' for term in terms) + '*'
+        return f'{column} : ({expression})' if column else expression
+
+    @classmethod
+    def posts(cls, terms, limit):
+        if not terms:
+            return []
+        return _ids(
+            'SELECT rowid FROM api_search_post WHERE api_search_post MATCH %s ORDER BY rank, rowid DESC LIMIT %s',
+            [cls.match(terms), limit],
+        )
+
+    @classmethod
+    def users(cls, terms, limit, usernames_only=False):
+        if not terms:
+            return []
+        return _ids(
+            'SELECT rowid FROM api_search_user WHERE api_search_user MATCH %s '
+            'ORDER BY bm25(api_search_user, %s, %s), rowid LIMIT %s',
+            [cls.match(terms, 'username' if usernames_only else None), *cls.USER_WEIGHTS, limit],
+        )
+
+    @classmethod
+    def hashtags(cls, terms, limit):
+        if not terms:
+            return []
+        # Tags are single tokens, so the shortest completions come first
+        return _ids(
+            'SELECT rowid FROM api_search_hashtag WHERE api_search_hashtag MATCH %s '
+            'ORDER BY length(name), name LIMIT %s',
+            [cls.match(terms[:1]), limit],
+        )
+
+
+class PostgresSearch:
+    # The expressions must match the GIN indexes of migration 0012
+    POST = "to_tsvector('simple', api_post.content)"
+    USERNAME = "to_tsvector('simple', auth_user.username)"
+    BIO = "to_tsvector('simple', api_profile.bio)"
+
+    @staticmethod
+    def match(terms):
+        return ' & '.join(f"'{term}'" for term in terms) + ':*'
+
+    @classmethod
+    def posts(cls, terms, limit):
+        if not terms:
+            return []
+        return _ids(
+            f"SELECT id FROM api_post WHERE {cls.POST} @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({cls.POST}, to_tsquery('simple', %s)) DESC, id DESC LIMIT %s",
+            [cls.match(terms), cls.match(terms), limit],
+        )
+
+    @classmethod
+    def users(cls, terms, limit, usernames_only=False):
+        if not terms:
+            return []
+        # One indexed scan per column; username matches weigh ten times a bio match
+        sql = f"SELECT auth_user.id, 10 * ts_rank({cls.USERNAME}, query) AS rank " \
+              f"FROM auth_user, to_tsquery('simple', %s) query WHERE {cls.USERNAME} @@ query"
+        params = [cls.match(terms)]
+        if not usernames_only:
+            sql += f" UNION ALL SELECT api_profile.user_id, ts_rank({cls.BIO}, query) " \
+                   f"FROM api_profile, to_tsquery('simple', %s) query WHERE {cls.BIO} @@ query"
+            params.append(cls.match(terms))
+        return _ids(
+            f'SELECT id FROM ({sql}) matches GROUP BY id ORDER BY SUM(rank) DESC, id LIMIT %s',
+            [*params, limit],
+        )
+
+    @staticmethod
+    def hashtags(terms, limit):
+        if not terms:
+            return []
+        # LIKE 'prefix%' on the unique name's varchar_pattern_ops index
+        names = Hashtag.objects.filter(name__startswith=terms[0].casefold())
+        return list(names.order_by(Length('name'), 'name').values_list('id', flat=True)[:limit])
@@ -1,6 +1,59 @@
+import functools
+
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Post, Profile, Follower, Notification, Like, Comment, Message, Repost, Hashtag, PostHashtag
+from .models import (
+    Post, Profile, Follower, Notification, Like, Comment, Message, Repost, Hashtag, PostHashtag,
+    Conversation, ConversationParticipant,
+)
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db.models import Manager
+from .user_cache import hydrate_users
+
+# User foreign keys listed in Meta.cached_users are filled from the per-process user
+# cache rather than joined: a page of rows costs at most one query for the users
+# that aren't cached yet.
+class CachedUsersListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        hydrate_users(items, self.child.Meta.cached_users)
+        return super().to_representation(items)
+
+class CachedUsersMixin:
+    def to_representation(self, instance):
+        hydrate_users([instance], self.Meta.cached_users)
+        return super().to_representation(instance)
+
+# Image renditions ({'thumbnail': url, 'large': url}), empty until the media workers are done
+class RenditionsField(serializers.ReadOnlyField):
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {name: default_storage.url(path) for name, path in value.items()}
+        if request is not None:
+            urls = {name: request.build_absolute_uri(url) for name, url in urls.items()}
+        return urls
+
+# Representations cached for every requester (see caching.py) are serialized without
+# a request, so their file URLs stay relative instead of carrying the first
+# requester's host; this makes them absolute for the current request
+def absolute_urls(data, serializer_class, request):
+    file_fields, rendition_fields = _url_fields(serializer_class)
+    data = dict(data)
+    for name in file_fields:
+        if data.get(name):
+            data[name] = request.build_absolute_uri(data[name])
+    for name in rendition_fields:
+        data[name] = {size: request.build_absolute_uri(url) for size, url in data[name].items()}
+    return data
+
+@functools.cache
+def _url_fields(serializer_class):
+    fields = serializer_class().fields
+    return (
+        [name for name, field in fields.items() if isinstance(field, serializers.FileField)],
+        [name for name, field in fields.items() if isinstance(field, RenditionsField)],
+    )
 
 # User Serializer
 class UserSerializer(serializers.ModelSerializer):
@@ -11,21 +64,40 @@ class UserSerializer(serializers.ModelSerializer):
 # Profile Serializer
 class ProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    profile_picture_renditions = RenditionsField()
+    cover_photo_renditions = RenditionsField()
 
     class Meta:
         model = Profile
-        fields = ['user', 'bio', 'profile_picture', 'location', 'website', 'cover_photo']
+        fields = [
+            'user', 'bio', 'profile_picture', 'profile_picture_renditions', 'location', 'website',
+            'cover_photo', 'cover_photo_renditions', 'follower_count', 'following_count',
+        ]
+        read_only_fields = ['follower_count', 'following_count']
 
 # Post Serializer
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(CachedUsersMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes = serializers.StringRelatedField(many=True, read_only=True)
     comments = serializers.StringRelatedField(many=True, read_only=True)
     hashtags = serializers.StringRelatedField(many=True, read_only=True)
+    media_renditions = RenditionsField()
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'author', 'timestamp', 'media', 'likes', 'comments', 'hashtags']
+        fields = [
+            'id', 'content', 'author', 'timestamp', 'media', 'media_renditions', 'likes', 'comments', 'hashtags',
+            'like_count', 'comment_count', 'repost_count',
+        ]
+        read_only_fields = ['like_count', 'comment_count', 'repost_count']
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['author']
+        # likes/comments/hashtags render through __str__, which reads the user/hashtag
+        prefetch_related = [
+            Prefetch('likes', queryset=Like.objects.select_related('user')),
+            Prefetch('comments', queryset=Comment.objects.select_related('user')),
+            Prefetch('hashtags', queryset=PostHashtag.objects.select_related('hashtag')),
+        ]
 
     def validate_media(self, value):
         max_size = 5 * 1024 * 1024
@@ -35,54 +107,105 @@ class PostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Unsupported file format.")
         return value
 
+# Compact Post Serializer (counters instead of the unbounded like/comment lists)
+class CompactPostSerializer(PostSerializer):
+    likes = None
+    comments = None
+    hashtags = None
+    liked_by_me = serializers.SerializerMethodField()
+
+    class Meta(PostSerializer.Meta):
+        fields = [
+            'id', 'content', 'author', 'timestamp', 'media', 'media_renditions',
+            'like_count', 'comment_count', 'repost_count', 'liked_by_me',
+        ]
+        prefetch_related = []
+
+    def get_liked_by_me(self, obj):
+        # Views annotate this with an EXISTS subquery; fall back to a lookup otherwise
+        if hasattr(obj, 'liked_by_me'):
+            return obj.liked_by_me
+        request = self.context.get('request')
+        return Like.objects.filter(user=request.user, post=obj).exists()
+
 # Like Serializer
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(CachedUsersMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Like
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['user']
         fields = ['id', 'user', 'post', 'created']
 
 # Comment Serializer
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(CachedUsersMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Comment
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['user']
         fields = ['id', 'user', 'post', 'content', 'created']
 
 # Follower Serializer
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(CachedUsersMixin, serializers.ModelSerializer):
     user_from = UserSerializer(read_only=True)
     user_to = UserSerializer(read_only=True)
 
     class Meta:
         model = Follower
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['user_from', 'user_to']
         fields = ['user_from', 'user_to', 'created']
 
 # Notification Serializer
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(CachedUsersMixin, serializers.ModelSerializer):
     sender = serializers.StringRelatedField()
 
     class Meta:
         model = Notification
-        fields = ['id', 'sender', 'notification_type', 'post', 'timestamp', 'is_read']
+        fields = ['id', 'sender', 'notification_type', 'post', 'timestamp', 'is_read', 'actor_count', 'latest_actors']
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['sender']
 
 # Message Serializer
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(CachedUsersMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     recipient = UserSerializer(read_only=True)
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'recipient', 'content', 'timestamp']
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['sender', 'recipient']
+        fields = ['id', 'sender', 'recipient', 'conversation', 'content', 'timestamp']
+        read_only_fields = ['conversation']
+
+# Conversation Participant Serializer
+class ConversationParticipantSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = ConversationParticipant
+        fields = ['user', 'last_read_at']
+
+# Conversation Serializer
+class ConversationSerializer(serializers.ModelSerializer):
+    participants = ConversationParticipantSerializer(many=True, read_only=True)
+    last_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'participants', 'last_message', 'last_message_at']
 
 # Repost Serializer
-class RepostSerializer(serializers.ModelSerializer):
+class RepostSerializer(CachedUsersMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Repost
+        list_serializer_class = CachedUsersListSerializer
+        cached_users = ['user']
         fields = ['id', 'user', 'post', 'created']
 
 # Hashtag Serializer
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import media, search, timeline
+from .caching import invalidate
+from .graph import follower_graph
+from .models import Comment, Follower, Hashtag, Like, Post, PostHashtag, Profile, Repost
+from .trending import trending_posts
+from .user_cache import user_cache
+
+# Feed likes, comments and reposts into the trending engine once they are committed
+
+@receiver(post_save, sender=Like, dispatch_uid='trending_like_saved')
+@receiver(post_save, sender=Comment, dispatch_uid='trending_comment_saved')
+@receiver(post_save, sender=Repost, dispatch_uid='trending_repost_saved')
+def record_engagement(sender, instance, created, **kwargs):
+    if created:
+        kind = sender.__name__.lower()
+        transaction.on_commit(lambda: trending_posts.record(instance.post_id, kind, when=instance.created))
+
+
+@receiver(post_delete, sender=Like, dispatch_uid='trending_like_deleted')
+@receiver(post_delete, sender=Comment, dispatch_uid='trending_comment_deleted')
+@receiver(post_delete, sender=Repost, dispatch_uid='trending_repost_deleted')
+def retract_engagement(sender, instance, **kwargs):
+    kind = sender.__name__.lower()
+    transaction.on_commit(lambda: trending_posts.record(instance.post_id, kind, when=instance.created, undo=True))
+
+
+# Drop read-through cache entries (see caching.py) when their entity is written
+
+@receiver(post_save, sender=Profile, dispatch_uid='cache_profile_saved')
+@receiver(post_delete, sender=Profile, dispatch_uid='cache_profile_deleted')
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate('profile', instance.pk)
+
+
+@receiver(post_save, sender=User, dispatch_uid='cache_user_saved')
+def invalidate_user_profile(sender, instance, update_fields=None, **kwargs):
+    # Profiles embed the username and email; logins only touch last_login
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        invalidate('profile', *Profile.objects.filter(user=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Post, dispatch_uid='cache_post_saved')
+def invalidate_post(sender, instance, **kwargs):
+    invalidate('post', instance.pk)
+
+
+@receiver(post_delete, sender=Post, dispatch_uid='cache_post_deleted')
+def invalidate_deleted_post(sender, instance, **kwargs):
+    invalidate('post', instance.pk)
+    invalidate('trending', *settings.TRENDING_WINDOWS)
+
+
+@receiver(post_save, sender=Like, dispatch_uid='cache_like_saved')
+@receiver(post_delete, sender=Like, dispatch_uid='cache_like_deleted')
+@receiver(post_save, sender=Comment, dispatch_uid='cache_comment_saved')
+@receiver(post_delete, sender=Comment, dispatch_uid='cache_comment_deleted')
+@receiver(post_save, sender=Repost, dispatch_uid='cache_repost_saved')
+@receiver(post_delete, sender=Repost, dispatch_uid='cache_repost_deleted')
+@receiver(post_delete, sender=PostHashtag, dispatch_uid='cache_post_hashtag_deleted')
+def invalidate_engaged_post(sender, instance, **kwargs):
+    # Posts embed their likes, comments, hashtags and counters
+    invalidate('post', instance.post_id)
+
+
+@receiver(post_save, sender=Hashtag, dispatch_uid='cache_hashtag_saved')
+@receiver(post_delete, sender=Hashtag, dispatch_uid='cache_hashtag_deleted')
+def invalidate_hashtag(sender, instance, **kwargs):
+    invalidate('hashtag', instance.pk, f'name:{instance.name}')
+
+
+# Drop users from this process's user cache (see user_cache.py) when they change
+
+@receiver(post_save, sender=User, dispatch_uid='user_cache_user_saved')
+@receiver(post_delete, sender=User, dispatch_uid='user_cache_user_deleted')
+def forget_user(sender, instance, **kwargs):
+    # Again after commit, in case a concurrent request cached the old row meanwhile
+    user_cache.discard(instance.pk)
+    transaction.on_commit(lambda: user_cache.discard(instance.pk))
+
+
+@receiver(post_save, sender=Profile, dispatch_uid='user_cache_profile_saved')
+@receiver(post_delete, sender=Profile, dispatch_uid='user_cache_profile_deleted')
+def forget_profile_user(sender, instance, **kwargs):
+    user_cache.discard(instance.user_id)
+    transaction.on_commit(lambda: user_cache.discard(instance.user_id))
+
+
+# Release media files (see storage.py) when their row is deleted or given a new upload
+
+@receiver(pre_save, sender=Post, dispatch_uid='media_post_saving')
+@receiver(pre_save, sender=Profile, dispatch_uid='media_profile_saving')
+def remember_files(sender, instance, update_fields=None, **kwargs):
+    fields = [field for field in media.FILE_FIELDS[sender] if update_fields is None or field in update_fields]
+    # Only a new upload (not yet committed to storage) or a cleared field can replace a file
+    replaced = [field for field in fields if not getattr(instance, field)._committed or not getattr(instance, field)]
+    instance._stored_files = {}
+    if instance.pk is not None and replaced:
+        instance._stored_files = sender.objects.filter(pk=instance.pk).values(*replaced).first() or {}
+
+
+@receiver(post_save, sender=Post, dispatch_uid='media_post_saved')
+@receiver(post_save, sender=Profile, dispatch_uid='media_profile_saved')
+def release_replaced_files(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_files', {})
+    media.release(name for field, name in stored.items() if name != getattr(instance, field).name)
+
+
+@receiver(post_delete, sender=Post, dispatch_uid='media_post_deleted')
+@receiver(post_delete, sender=Profile, dispatch_uid='media_profile_deleted')
+def release_files(sender, instance, **kwargs):
+    media.release(media.stored_files(instance))
+
+
+# Follow counters (see timeline.py) and the follower graph (see graph.py) lose a
+# deleted follow. Unfollows are released one at a time; the follows of a deleted
+# user are released together before the cascade removes them.
+
+@receiver(post_delete, sender=Follower, dispatch_uid='follow_deleted')
+def release_follow(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        return  # Done by release_user_follows
+    timeline.follower_removed(instance.user_from_id, instance.user_to_id)
+    transaction.on_commit(lambda: follower_graph.remove(instance.user_from_id, instance.user_to_id))
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='follows_user_deleted')
+def release_user_follows(sender, instance, **kwargs):
+    user_id = instance.id  # Cleared once the user is deleted
+    timeline.user_follows_removed(user_id)
+    transaction.on_commit(lambda: follower_graph.remove_user(user_id))
+
+
+# Migrations that rebuild a table on SQLite drop its search triggers (see search.py)
+
+@receiver(post_migrate, dispatch_uid='search_triggers_migrated')
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'api':
+        search.restore_triggers(using)
@@ -0,0 +1,124 @@
+import hashlib
+import heapq
+import time
+from array import array
+from base64 import b64decode, b64encode
+from collections import deque
+
+# Streaming counters with bounded memory.
+
+
+class CountMinSketch:
+    """
+    Approximate counts for an unbounded set of keys in depth x width counters.
+
+    Estimates never undercount; they overcount by at most 2N/width with
+    probability 1 - 2**-depth, N being the total of all counts.
+    """
+
+    def __init__(self, width, depth, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array('I', [0]) * (width * depth)
+
+    def _cells(self, key):
+        # Double hashing: row i uses h1 + i * h2. blake2b keeps it stable across processes.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        for cell in self._cells(key):
+            self.counts[cell] += count
+
+    def estimate(self, key):
+        return min(self.counts[cell] for cell in self._cells(key))
+
+    def to_state(self):
+        return {'width': self.width, 'depth': self.depth, 'counts': b64encode(self.counts.tobytes()).decode()}
+
+    @classmethod
+    def from_state(cls, state):
+        counts = array('I')
+        counts.frombytes(b64decode(state['counts']))
+        return cls(state['width'], state['depth'], counts)
+
+
+class SlidingHeavyHitters:
+    """
+    Most frequent keys over a sliding time window.
+
+    The window is split into buckets, each with its own CountMinSketch, and the
+    oldest bucket is dropped as time moves on. A bounded candidate set tracks the
+    keys likely to be in the top; their counts are re-estimated from the live
+    buckets when read. Memory is buckets * width * depth counters plus `capacity`
+    candidates, whatever the number of distinct keys.
+    """
+
+    def __init__(self, window, buckets, width, depth, capacity):
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.window = deque()  # (bucket number, CountMinSketch), oldest first
+        self.candidates = {}
+
+    def add(self, keys, now=None):
+        now = time.time() if now is None else now
+        sketch = self._rotate(now)
+        for key in keys:
+            sketch.add(key)
+            self.candidates[key] = self._estimate(key)
+        if len(self.candidates) > self.capacity:
+            self.candidates = dict(heapq.nlargest(self.capacity, self.candidates.items(), key=lambda item: item[1]))
+
+    def top(self, n, now=None):
+        """
+        Returns up to n (key, estimated count) pairs for the current window, highest first.
+        """
+        now = time.time() if now is None else now
+        self._rotate(now)
+        estimates = ((key, self._estimate(key)) for key in self.candidates)
+        return [(key, count) for key, count in heapq.nlargest(n, estimates, key=lambda item: item[1]) if count]
+
+    def _estimate(self, key):
+        return sum(sketch.estimate(key) for _, sketch in self.window)
+
+    def _rotate(self, now):
+        current = int(now // self.bucket_seconds)
+        expired = False
+        while self.window and self.window[0][0] <= current - self.buckets:
+            self.window.popleft()
+            expired = True
+        if not self.window or self.window[-1][0] < current:
+            self.window.append((current, CountMinSketch(self.width, self.depth)))
+        if expired:
+            self.candidates = {key: count for key, count in self.candidates.items() if self._estimate(key)}
+        return self.window[-1][1]
+
+    def to_state(self):
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'window': [[number, sketch.to_state()] for number, sketch in self.window],
+            'candidates': self.candidates,
+        }
+
+    def load_state(self, state):
+        """
+        Replaces the window with a saved one. Returns False, keeping the current
+        window, if the state was taken with other settings and can't be used.
+        """
+        try:
+            window = [(number, CountMinSketch.from_state(sketch)) for number, sketch in state['window']]
+            compatible = state['bucket_seconds'] == self.bucket_seconds and all(
+                (sketch.width, sketch.depth) == (self.width, self.depth) for _, sketch in window
+            )
+            candidates = dict(state['candidates'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if compatible:
+            self.window = deque(window)
+            self.candidates = candidates
+        return compatible
@@ -0,0 +1,170 @@
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.utils import validate_file_name
+from django.db import transaction
+from django.db.models import F
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+
+from .models import StoredFile
+
+# Content-addressed media storage.
+#
+# Every file is stored under the SHA-256 of its bytes ('cas/3f/3fa2...c1.jpg'),
+# whatever name it was uploaded under, so an image attached to several posts or
+# profiles is on disk once. StoredFile counts the references to each file:
+# save() adds one, delete() drops one and removes the file with the last. Both
+# hold the StoredFile row locked until the file is written or removed, so a save
+# of the same content can't find the file present just before the last delete
+# removes it. Rows release their files through the receivers in signals.py.
+#
+# Files stored before content addressing have no StoredFile row and a single
+# owner, except renditions, which were shared and are counted by migration 0013.
+#
+# serve_media() serves MEDIA_URL with ETags, byte ranges and, for content-addressed
+# names (which never change), a year-long immutable Cache-Control.
+
+CONTENT_ADDRESSED_NAME = re.compile(r'^cas/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(\.\w+)?$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, **kwargs):
+        # A name always holds the same bytes, so writing it twice is harmless
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        """
+        Stores the content under its hash and returns that name; content that is
+        already stored only gains a reference.
+        """
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        digest = digest.hexdigest()
+        name = f'cas/{digest[:2]}/{digest}{os.path.splitext(name)[1].lower()}'
+
+        with transaction.atomic():
+            # The update locks the row; it finds none if the name is new or its
+            # last reference was deleted since the insert
+            while not StoredFile.objects.filter(name=name).update(references=F('references') + 1):
+                StoredFile.objects.bulk_create([StoredFile(name=name, size=size)], ignore_conflicts=True)
+            if not self.exists(name):
+                self._save(name, content)
+        return name
+
+    def delete(self, name):
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is None:
+                if name and not CONTENT_ADDRESSED_NAME.match(name):
+                    # Stored before content addressing, with a single owner
+                    super().delete(name)
+            elif stored.references > 1:
+                StoredFile.objects.filter(pk=stored.pk).update(references=F('references') - 1)
+            else:
+                stored.delete()
+                super().delete(name)
+
+
+class FileRange:
+    """
+    The next `length` bytes of an open file. It keeps fileno(), so WSGI servers
+    with a file wrapper (gunicorn) send it with sendfile() up to Content-Length.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Returns the (first, last) byte positions of a single 'bytes=' range, False if
+    it can't be satisfied, or None if there is no range the server supports (the
+    whole file is sent then).
+    """
+    match = RANGE.match(header)
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        first, last = max(size - int(last), 0), size - 1  # The last N bytes
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    return (first, last) if first <= last else False
+
+
+@require_safe
+def serve_media(request, name):
+    try:
+        file = open(default_storage.path(name), 'rb')
+    except (SuspiciousFileOperation, FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise Http404('No such media file')
+
+    stat = os.fstat(file.fileno())
+    match = CONTENT_ADDRESSED_NAME.match(name)
+    if match:
+        etag = f'"{match["digest"]}"'
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+    else:
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        cache_control = 'public, no-cache'  # Revalidate with the ETag
+
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Accept-Ranges': 'bytes'}
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        file.close()
+        return HttpResponseNotModified(headers=headers)
+
+    start, end = 0, stat.st_size - 1
+    status = 200
+    # If-Range: the range only applies to the version the client already has part of
+    if request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_range(request.headers.get('Range', ''), stat.st_size)
+        if byte_range is False:
+            file.close()
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+        if byte_range:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    file.seek(start)
+    response = FileResponse(
+        FileRange(file, end - start + 1), status=status,
+        content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream', headers=headers,
+    )
+    response['Content-Length'] = end - start + 1
+    return response
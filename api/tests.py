@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+import msgpack
+from PIL import Image
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from SocialMediaRobust import database
+
+from . import search, timeline
+from .caching import read_through
+from .consumers import ChatConsumer, NotificationConsumer, VideoCallConsumer, message_writer
+from .graph import follower_graph
+from .hashtags import extract_hashtags, sync_post_hashtags
+from .sketch import SlidingHeavyHitters
+from .trending import DecayedTopK, TrendingEngine, TrendingHashtags, trending_hashtags, trending_posts
+from .user_cache import user_cache
+from .messaging import direct_conversation, record_messages
+from .notifications import mark_read, notify, prune, unread_count
+from .models import (
+    Comment, Conversation, ConversationParticipant, Follower, Hashtag, Like, Message, Notification, Post, Profile, Repost,
+    StoredFile, TimelineEntry,
+)
 
 # Create your tests here.
+
+
+def setUpModule():
+    # Tests create tagged posts; keep them out of the real trending hashtags snapshot,
+    # which the process writes at exit
+    trending_hashtags.snapshot_path = None
+
+
+# Query counts per list endpoint
+@override_settings(SECURE_SSL_REDIRECT=False)
+class QueryCountTests(TestCase):
+    """
+    Every list endpoint must run the same number of queries for a page of 2 rows as
+    for a full page, i.e. serialization issues no per-row queries.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='viewer')
+        Profile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_rows(self, count):
+        for i in range(count):
+            author = User.objects.create(username=f'author{User.objects.count()}')
+            Profile.objects.create(user=author)
+            Follower.objects.create(user_from=self.user, user_to=author)
+            post = Post.objects.create(author=author, content=f'post {i}')
+            timeline.fan_out_post(post)
+            for fan in (self.user, author):
+                Like.objects.create(user=fan, post=post)
+                Comment.objects.create(user=fan, post=post, content='nice')
+            Repost.objects.create(user=author, post=post)
+            Notification.objects.create(user=self.user, sender=author, notification_type='like', post=post)
+            conversation = direct_conversation(author, self.user)
+            record_messages([Message.objects.create(
+                sender=author, recipient=self.user, conversation=conversation, content='hi'
+            )])
+            Hashtag.objects.create(name=f'tag{post.id}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url):
+        self.make_rows(2)
+        small_page = self.count_queries(url)
+        self.make_rows(10)
+        full_page = self.count_queries(url)
+        self.assertEqual(small_page, full_page, f'{url} runs queries per row')
+
+    def test_users(self):
+        self.assertConstantQueries('/api/users/')
+
+    def test_profiles(self):
+        self.assertConstantQueries('/api/profiles/')
+
+    def test_posts(self):
+        self.assertConstantQueries('/api/posts/')
+
+    def test_posts_compact(self):
+        self.assertConstantQueries('/api/posts/?compact=true')
+
+    def test_feed(self):
+        self.assertConstantQueries('/api/posts/feed/')
+        # Filled by fan-out, newest first
+        feed = [post['id'] for post in self.client.get('/api/posts/feed/').json()['results']]
+        newest = Post.objects.order_by('-timestamp', '-id').values_list('id', flat=True)
+        self.assertEqual(feed, list(newest[:len(feed)]))
+        self.assertEqual(len(feed), min(12, settings.REST_FRAMEWORK['PAGE_SIZE']))
+
+    def test_likes(self):
+        self.assertConstantQueries('/api/likes/')
+
+    def test_comments(self):
+        self.assertConstantQueries('/api/comments/')
+
+    def test_followers(self):
+        self.assertConstantQueries('/api/followers/')
+
+    def test_user_following(self):
+        self.assertConstantQueries(f'/api/users/{self.user.id}/following/')
+
+    def test_messages(self):
+        self.assertConstantQueries('/api/messages/')
+
+    def test_conversations(self):
+        self.assertConstantQueries('/api/conversations/')
+
+    def test_notifications(self):
+        self.assertConstantQueries('/api/notifications/')
+
+    def test_reposts(self):
+        self.assertConstantQueries('/api/reposts/')
+
+    def test_hashtags(self):
+        self.assertConstantQueries('/api/hashtags/')
+
+
+# Home timelines
+@override_settings(TIMELINE_MAX_LENGTH=3)
+class TimelineTests(TestCase):
+
+    def test_trim_all_keeps_the_newest_entries(self):
+        reader, quiet_reader, author = (User.objects.create(username=name) for name in ('reader', 'quiet', 'author'))
+        Follower.objects.create(user_from=reader, user_to=author)
+        posts = [Post.objects.create(author=author, content=f'post {i}') for i in range(5)]
+        for post in posts:
+            timeline.fan_out_post(post)
+        TimelineEntry.objects.create(owner=quiet_reader, post=posts[0], timestamp=posts[0].timestamp)
+
+        self.assertEqual(timeline.trim_all(), 2)
+        kept = TimelineEntry.objects.filter(owner=reader).order_by('-timestamp').values_list('post', flat=True)
+        self.assertEqual(list(kept), [post.id for post in reversed(posts[2:])])
+        self.assertEqual(TimelineEntry.objects.filter(owner=quiet_reader).count(), 1)
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_posts_survive_the_author_crossing_the_threshold(self):
+        reader, author = (User.objects.create(username=name) for name in ('reader', 'author'))
+        Profile.objects.create(user=reader)
+        profile = Profile.objects.create(user=author, follower_count=2)
+        Follower.objects.create(user_from=reader, user_to=author)
+        merged_on_read = Post.objects.create(author=author, content='popular')
+        timeline.fan_out_post(merged_on_read)
+
+        Profile.objects.filter(pk=profile.pk).update(follower_count=1)
+        pushed = Post.objects.create(author=author, content='quiet')
+        timeline.fan_out_post(pushed)
+        self.assertEqual(set(timeline.home_timeline(reader)), {merged_on_read, pushed})
+
+        Profile.objects.filter(pk=profile.pk).update(follower_count=2)
+        self.assertEqual(set(timeline.home_timeline(reader)), {merged_on_read, pushed})
+
+
+# Keyset pagination
+@override_settings(SECURE_SSL_REDIRECT=False)
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        Profile.objects.create(user=self.user)
+        start = timezone.now() - timedelta(hours=1)
+        self.posts = [
+            Post.objects.create(author=self.user, content=f'post {i}', timestamp=start + timedelta(minutes=i))
+            for i in range(25)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return [post['id'] for post in body['results']], body['next'], body['previous']
+
+    def test_pages_are_stable_while_rows_are_inserted(self):
+        newest_first = [post.id for post in reversed(self.posts)]
+        first, next_url, previous_url = self.page('/api/posts/')
+        self.assertEqual((first, previous_url), (newest_first[:10], None))
+
+        Post.objects.create(author=self.user, content='newer')
+        second, next_url, _ = self.page(next_url)
+        third, last_url, _ = self.page(next_url)
+        self.assertEqual((second, third, last_url), (newest_first[10:20], newest_first[20:], None))
+
+    def test_previous_links_walk_back(self):
+        newest_first = [post.id for post in reversed(self.posts)]
+        _, next_url, _ = self.page('/api/posts/')
+        _, next_url, _ = self.page(next_url)
+        third, _, previous_url = self.page(next_url)
+        self.assertEqual(third, newest_first[20:])
+
+        second, next_url, previous_url = self.page(previous_url)
+        self.assertEqual(second, newest_first[10:20])
+        self.assertEqual(self.page(next_url)[0], third)
+        first, _, previous_url = self.page(previous_url)
+        self.assertEqual((first, previous_url), (newest_first[:10], None))
+
+    def test_bad_cursors_are_rejected(self):
+        def encode(payload):
+            return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        timestamp = self.posts[0].timestamp.isoformat()
+        cursors = [
+            'not a cursor',
+            encode(['not', 'a', 'dict']),
+            encode({'p': [timestamp]}),  # Too few values
+            encode({'p': ['yesterday', 1]}),
+            encode({'p': [timestamp, 2 ** 70]}),  # Outside the id column
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/posts/', {'cursor': cursor}).status_code, 400)
+        response = self.client.get('/api/posts/feed/', {'sort_by': 'popularity', 'cursor': encode({'p': ['many', 1]})})
+        self.assertEqual(response.status_code, 400)
+
+
+# Trending posts
+class DecayedTopKTests(SimpleTestCase):
+
+    def test_scores_decay_and_survive_long_idle_periods(self):
+        scores = DecayedTopK(half_life=60, capacity=10, landmark=0)
+        scores.add('a', 4, when=0)
+        scores.add('b', 1, when=60)
+        self.assertEqual(scores.top(2, now=60), [('a', 2.0), ('b', 1.0)])
+        # Far more half-lives than a float's exponent covers
+        self.assertEqual(scores.top(2, now=60 * 5000), [])
+        scores.add('c', 1, when=60 * 5000)
+        self.assertEqual(scores.top(1, now=60 * 5001), [('c', 0.5)])
+
+
+# Hashtag extraction and indexing
+class HashtagExtractionTests(SimpleTestCase):
+
+    def test_tags_are_folded_and_deduplicated(self):
+        self.assertEqual(extract_hashtags('#Django and #DJANGO, #Straße #STRASSE'), ['django', 'strasse'])
+        self.assertEqual(extract_hashtags('#ｆｕｌｌ #full'), ['full'])  # NFKC folds full-width letters
+
+    def test_tags_end_at_punctuation(self):
+        self.assertEqual(extract_hashtags('#end. (#paren) #a-b #snake_case!'), ['end', 'paren', 'a', 'snake_case'])
+        self.assertEqual(extract_hashtags('a#b page#top &#39; ##double /#slash'), [])
+
+    def test_non_ascii_and_long_tags(self):
+        self.assertEqual(extract_hashtags('#café #日本語'), ['café', '日本語'])
+        self.assertEqual(extract_hashtags('#' + 'x' * 150), ['x' * 100])
+        self.assertEqual(extract_hashtags(None), [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class HashtagIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tagger')
+        Profile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tags(self, post):
+        return set(post.hashtags.values_list('hashtag__name', flat=True))
+
+    def test_edits_resync_the_tags(self):
+        post = Post.objects.create(author=self.user, content='#old #kept')
+        sync_post_hashtags(post)
+        self.assertEqual(self.tags(post), {'old', 'kept'})
+
+        response = self.client.patch(f'/api/posts/{post.id}/', {'content': '#kept #New'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.tags(post), {'kept', 'new'})
+        self.assertTrue(Hashtag.objects.filter(name='old').exists())  # Other posts may still use it
+
+        self.client.patch(f'/api/posts/{post.id}/', {'content': 'no tags'})
+        self.assertEqual(self.tags(post), set())
+
+    def test_posts_are_listed_newest_first(self):
+        start = timezone.now() - timedelta(hours=1)
+        tagged = []
+        for i in range(12):
+            post = Post.objects.create(author=self.user, content=f'#Paging {i}', timestamp=start + timedelta(minutes=i))
+            sync_post_hashtags(post)
+            tagged.append(post.id)
+        sync_post_hashtags(Post.objects.create(author=self.user, content='#other'))
+
+        first = self.client.get('/api/hashtags/PAGING/posts/').json()
+        self.assertEqual([post['id'] for post in first['results']], tagged[::-1][:10])
+        second = self.client.get(first['next']).json()
+        self.assertEqual(([post['id'] for post in second['results']], second['next']), (tagged[1::-1], None))
+        self.assertEqual(self.client.get('/api/hashtags/missing/posts/').status_code, 404)
+
+
+# Trending hashtags
+class SlidingHeavyHittersTests(SimpleTestCase):
+
+    def sketch(self, **kwargs):
+        return SlidingHeavyHitters(**{'window': 600, 'buckets': 2, 'width': 64, 'depth': 2, 'capacity': 10, **kwargs})
+
+    def test_window_slides_and_state_round_trips(self):
+        sketch = self.sketch()
+        sketch.add(['django', 'django', 'python'], now=1000)
+        sketch.add(['python'], now=1400)
+        restored = self.sketch()
+        self.assertTrue(restored.load_state(sketch.to_state()))
+        self.assertEqual(restored.top(5, now=1400), [('django', 2), ('python', 2)])
+        self.assertEqual(restored.top(5, now=1700), [('python', 1)])  # The first bucket expired
+        # Taken with other settings, so ignored
+        self.assertFalse(self.sketch(width=32).load_state(sketch.to_state()))
+
+
+@override_settings(
+    TRENDING_FLUSH_INTERVAL=60, TRENDING_HASHTAGS_WINDOW=600, TRENDING_HASHTAGS_BUCKETS=2,
+    TRENDING_HASHTAGS_SKETCH_WIDTH=64, TRENDING_HASHTAGS_SKETCH_DEPTH=2, TRENDING_HASHTAGS_CAPACITY=10,
+)
+class TrendingHashtagsTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'hashtags.json'
+
+    def test_workers_share_counts_and_a_restart_resumes_them(self):
+        # Two processes' engines over the same cache
+        first, second = (TrendingHashtags('test', snapshot_path=self.path) for _ in range(2))
+        first.record(['django', 'django', 'python'])
+        second.record(['python'])
+        self.assertEqual(first.top(5), [('django', 2), ('python', 1)])  # Only its own tags merged yet
+        self.assertEqual(second.top(5), [('django', 2), ('python', 2)])
+
+        # Processes that never counted anything (migrate, an idle worker) don't snapshot
+        TrendingHashtags('test', snapshot_path=self.path).snapshot()
+        self.assertFalse(self.path.exists())
+        first.snapshot()
+        cache.clear()
+        self.assertEqual(TrendingHashtags('test', snapshot_path=self.path).top(5), [('django', 2), ('python', 2)])
+
+
+@override_settings(TRENDING_WINDOWS={'1h': 3600}, TRENDING_FLUSH_INTERVAL=60)
+class TrendingEngineTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create(username='author')
+        self.posts = [Post.objects.create(author=author, content=str(i)) for i in range(3)]
+
+    def test_workers_merge_their_events(self):
+        # Two processes' engines, both buffering events over the same cached scores
+        first, second = TrendingEngine('test'), TrendingEngine('test')
+        self.assertEqual(first.top('1h'), [])  # Cold: rebuilt from the (empty) tables
+        first.record(self.posts[0].id, 'like')
+        second.record(self.posts[1].id, 'repost')
+        second.record(self.posts[0].id, 'like')
+        self.assertEqual(first.top('1h'), [self.posts[0].id])  # Only its own events merged yet
+        second.flush()
+        self.assertEqual(first.top('1h'), [self.posts[1].id, self.posts[0].id])
+        second.record(self.posts[1].id, 'repost', undo=True)
+        self.assertEqual(second.top('1h'), [self.posts[0].id])
+
+    def test_cold_cache_is_rebuilt_from_the_tables(self):
+        fan = User.objects.create(username='fan')
+        Like.objects.create(user=fan, post=self.posts[2])
+        Comment.objects.create(user=fan, post=self.posts[1], content='!')
+        self.assertEqual(TrendingEngine('test').top('1h'), [self.posts[1].id, self.posts[2].id])
+
+
+# Direct message conversations
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ConversationTests(TestCase):
+
+    def setUp(self):
+        self.me, self.alice, self.bob = (User.objects.create(username=name) for name in ('me', 'alice', 'bob'))
+        self.client = APIClient()
+
+    def send(self, sender, recipient, content):
+        self.client.force_authenticate(sender)
+        response = self.client.post('/api/messages/', {'recipient': recipient.id, 'content': content})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def inbox(self, user):
+        self.client.force_authenticate(user)
+        return [conversation['id'] for conversation in self.client.get('/api/conversations/').json()['results']]
+
+    def test_inbox_is_ordered_by_last_message(self):
+        self.send(self.me, self.alice, 'hi alice')
+        self.send(self.bob, self.me, 'hi me')
+        with_alice, with_bob = direct_conversation(self.me, self.alice).id, direct_conversation(self.me, self.bob).id
+        self.assertEqual(self.inbox(self.me), [with_bob, with_alice])
+        self.send(self.alice, self.me, 'back')
+        self.assertEqual(self.inbox(self.me), [with_alice, with_bob])
+        self.assertEqual(self.inbox(self.bob), [with_bob])
+
+    def test_thread_pages_newest_first(self):
+        sent = [self.send(self.me if i % 2 else self.alice, self.alice if i % 2 else self.me, str(i)) for i in range(12)]
+        conversation = Conversation.objects.get()
+        self.client.force_authenticate(self.me)
+        first = self.client.get(f'/api/conversations/{conversation.id}/messages/').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(
+            [message['id'] for message in first['results'] + second['results']], list(reversed(sent)),
+        )
+        self.assertIsNone(second['next'])
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get(f'/api/conversations/{conversation.id}/messages/').status_code, 404)
+
+    def test_conversation_is_created_with_its_participants(self):
+        with mock.patch.object(ConversationParticipant.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                direct_conversation(self.me, self.alice)
+        self.assertFalse(Conversation.objects.exists())
+        conversation = direct_conversation(self.me, self.alice)
+        self.assertEqual(
+            set(conversation.participants.values_list('user', flat=True)), {self.me.id, self.alice.id},
+        )
+
+
+# Chat WebSocket
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_messages_and_receipts(self):
+        alice = await database_sync_to_async(User.objects.create)(username='alice')
+        bob = await database_sync_to_async(User.objects.create)(username='bob')
+        alice_socket = await self.connect(alice)
+        bob_socket = await self.connect(bob)
+
+        for i in range(3):
+            await alice_socket.send_json_to({'type': 'message', 'recipient': bob.id, 'content': f'hi {i}', 'client_id': i})
+        await alice_socket.send_json_to({'type': 'message', 'recipient': 0, 'content': 'lost', 'client_id': 'x'})
+
+        received = [await bob_socket.receive_json_from() for _ in range(3)]
+        self.assertEqual([frame['message']['content'] for frame in received], ['hi 0', 'hi 1', 'hi 2'])
+        frames = [await alice_socket.receive_json_from() for _ in range(10)]
+        by_type = {}
+        for frame in frames:
+            by_type.setdefault(frame['type'], []).append(frame)
+        self.assertEqual(sorted(frame['client_id'] for frame in by_type['sent']), [0, 1, 2])
+        self.assertEqual(by_type['error'][0]['client_id'], 'x')
+        self.assertEqual([frame['status'] for frame in by_type['receipt']], ['delivered'] * 3)
+
+        conversation = await database_sync_to_async(Conversation.objects.get)()
+        self.assertEqual(await database_sync_to_async(conversation.messages.count)(), 3)
+        await bob_socket.send_json_to({'type': 'read', 'conversation': conversation.id})
+        receipt = await alice_socket.receive_json_from()
+        self.assertEqual((receipt['type'], receipt['status'], receipt['user']), ('receipt', 'read', bob.id))
+
+        await alice_socket.disconnect()
+        await bob_socket.disconnect()
+
+    async def test_storage_errors_are_reported_to_the_socket(self):
+        alice = await database_sync_to_async(User.objects.create)(username='alice')
+        socket = await self.connect(alice)
+        with mock.patch.object(message_writer, 'submit', side_effect=DatabaseError('down')):
+            with self.assertLogs('api.consumers', 'WARNING'):
+                await socket.send_json_to({'type': 'message', 'recipient': alice.id, 'content': 'hi', 'client_id': 7})
+                frame = await socket.receive_json_from()
+        self.assertEqual(frame, {'type': 'error', 'error': 'Message could not be stored', 'client_id': 7})
+        await socket.disconnect()
+
+
+# Notification push
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, NOTIFICATION_BATCH_WINDOW=0.2,
+)
+class NotificationConsumerTests(TransactionTestCase):
+
+    async def test_committed_notifications_are_pushed_in_batches(self):
+        author, alice, bob = [
+            await database_sync_to_async(User.objects.create)(username=name) for name in ('author', 'alice', 'bob')
+        ]
+        post = await database_sync_to_async(Post.objects.create)(author=author, content='hi')
+        socket = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        socket.scope['user'] = author
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+
+        def engage(rollback):
+            with transaction.atomic():
+                notify(author, alice, 'like', post)
+                notify(author, bob, 'like', post)
+                notify(author, bob, 'comment', post)
+                transaction.set_rollback(rollback)
+
+        await database_sync_to_async(engage)(True)
+        self.assertTrue(await socket.receive_nothing(timeout=0.4))
+
+        await database_sync_to_async(engage)(False)
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame['type'], 'notifications')
+        self.assertEqual(
+            [(group['notification_type'], group['count'], group['message']) for group in frame['batch']],
+            [('comment', 1, 'bob commented on your post'), ('like', 2, '2 people liked your post')],
+        )
+        self.assertTrue(await socket.receive_nothing(timeout=0.4))
+        await socket.disconnect()
+
+
+# Notification folding and retention
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationTests(TestCase):
+
+    def setUp(self):
+        self.author, self.alice, self.bob = (User.objects.create(username=name) for name in ('author', 'alice', 'bob'))
+        self.post = Post.objects.create(author=self.author, content='hi')
+
+    def test_repeated_notifications_fold(self):
+        for sender in (self.alice, self.bob, self.alice):
+            notify(self.author, sender, 'like', self.post)
+        folded = Notification.objects.get()
+        self.assertEqual((folded.actor_count, folded.latest_actors, folded.sender), (2, ['alice', 'bob'], self.alice))
+
+        # Another verb or post, or a notification already read, starts a new row
+        other_post = Post.objects.create(author=self.author, content='again')
+        notify(self.author, self.bob, 'comment', self.post)
+        notify(self.author, self.bob, 'like', other_post)
+        folded.is_read = True
+        folded.save()
+        notify(self.author, self.bob, 'like', self.post)
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual(Notification.objects.filter(actor_count=1).count(), 3)
+
+    @override_settings(NOTIFICATION_RETENTION_DAYS=30, NOTIFICATION_MAX_PER_USER=2)
+    def test_prune_deletes_old_and_excess_read_notifications(self):
+        now = timezone.now()
+
+        def notification(user, days_ago, is_read):
+            return Notification.objects.create(
+                user=user, sender=self.alice, notification_type='follow',
+                timestamp=now - timedelta(days=days_ago), is_read=is_read,
+            )
+
+        expired = notification(self.bob, 40, True)
+        old_unread = notification(self.bob, 40, False)
+        unread = notification(self.author, 10, False)
+        excess = [notification(self.author, days_ago, True) for days_ago in (9, 8)]
+        kept = [notification(self.author, days_ago, True) for days_ago in (2, 1)]
+
+        self.assertEqual(prune(now), 3)
+        self.assertEqual(
+            set(Notification.objects.values_list('id', flat=True)),
+            {old_unread.id, unread.id, *(row.id for row in kept)},
+        )
+        self.assertFalse(Notification.objects.filter(id__in=[expired.id, *(row.id for row in excess)]).exists())
+
+
+# Unread notification counter
+@override_settings(
+    SECURE_SSL_REDIRECT=False, CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class UnreadCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.alice, self.bob = (User.objects.create(username=name) for name in ('user', 'alice', 'bob'))
+        self.posts = [Post.objects.create(author=self.user, content=str(i)) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def notify(self, sender, post):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify(self.user, sender, 'like', post)
+
+    def assertUnread(self, expected):
+        # The cached counter and the table agree
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json(), {'unread': expected})
+        self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), expected)
+
+    def test_counter_follows_writes(self):
+        self.assertUnread(0)  # Counted and cached on the first read
+        for post in self.posts:
+            self.notify(self.alice, post)
+        self.notify(self.bob, self.posts[0])  # Folded, still one unread row
+        self.assertUnread(3)
+
+        first = Notification.objects.filter(post=self.posts[0]).get()
+        self.client.post(f'/api/notifications/{first.id}/read/')
+        self.client.post(f'/api/notifications/{first.id}/read/')  # Already read, no change
+        self.assertUnread(2)
+
+        self.client.post('/api/notifications/read/')
+        self.assertUnread(0)
+
+    def test_counter_is_rebuilt_on_a_miss(self):
+        self.assertEqual(unread_count(self.user), 0)
+        self.notify(self.alice, self.posts[0])
+        Notification.objects.create(user=self.user, sender=self.bob, notification_type='follow')  # Not counted
+        self.assertEqual(unread_count(self.user), 1)
+        cache.clear()
+        self.assertUnread(2)
+        mark_read(self.user, up_to=Notification.objects.order_by('id').first().id)
+        self.assertUnread(1)
+
+
+
+# Redis cache unreachable (nothing listens on port 1)
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:1/0'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    TRENDING_WINDOWS={'1h': 3600},
+    TRENDING_FLUSH_INTERVAL=0,
+)
+class CacheOutageTests(TestCase):
+
+    def setUp(self):
+        self.author, self.user = User.objects.create(username='author'), User.objects.create(username='user')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.client = APIClient()
+
+    def test_writes_and_counts_fall_back_to_the_database(self):
+        self.client.force_authenticate(self.user)
+        with self.assertLogs('api', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/likes/', {'post': self.post.id}).status_code, 201)
+        with self.assertLogs('api.trending', 'WARNING'):
+            self.assertEqual(trending_posts.top('1h'), [self.post.id])  # Rebuilt from the rows
+
+        self.client.force_authenticate(self.author)
+        with self.assertLogs('api.notifications', 'WARNING'):
+            self.assertEqual(self.client.get('/api/notifications/unread-count/').json(), {'unread': 1})
+
+    async def test_calls_are_refused(self):
+        communicator = WebsocketCommunicator(VideoCallConsumer.as_asgi(), '/ws/call/room/')
+        communicator.scope['user'] = User(id=1, username='alice')
+        communicator.scope['url_route'] = {'kwargs': {'room_name': 'room'}}
+        with self.assertLogs('api.consumers', 'WARNING'):
+            self.assertTrue((await communicator.connect())[0])
+            self.assertEqual((await communicator.receive_json_from())['error'], 'Calls are unavailable')
+            self.assertEqual((await communicator.receive_output())['code'], 1011)
+
+
+# Video call signaling
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, VIDEO_CALL_ROOM_LIMIT=3
+)
+class VideoCallConsumerTests(TestCase):
+
+    async def join(self, room, user, subprotocols=None):
+        communicator = WebsocketCommunicator(VideoCallConsumer.as_asgi(), f'/ws/call/{room}/', subprotocols=subprotocols)
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'room_name': room}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        if subprotocols:
+            return communicator, msgpack.unpackb(await communicator.receive_from())
+        return communicator, await communicator.receive_json_from()
+
+    async def test_signals_reach_only_their_peer(self):
+        users = [User(id=i, username=f'user{i}') for i in range(1, 5)]
+        (alice, _), (bob, bob_peers), (carol, carol_peers) = [await self.join('room', user) for user in users[:3]]
+        outsider, outsider_peers = await self.join('elsewhere', users[3])
+        self.assertEqual(len(carol_peers['peers']), 2)
+        self.assertEqual(outsider_peers['peers'], [])
+        for communicator in (alice, alice, bob):
+            self.assertEqual((await communicator.receive_json_from())['type'], 'peer-joined')
+
+        await alice.send_json_to({'type': 'offer', 'to': carol_peers['peer'], 'data': {'sdp': 'x'}})
+        offer = await carol.receive_json_from()
+        self.assertEqual((offer['type'], offer['user'], offer['data']), ('offer', 1, {'sdp': 'x'}))
+        self.assertTrue(await bob.receive_nothing())
+        self.assertTrue(await outsider.receive_nothing())
+
+        # Peers in other rooms can't be signaled
+        await outsider.send_json_to({'type': 'ice', 'to': bob_peers['peer'], 'data': {}})
+        self.assertEqual((await outsider.receive_json_from())['error'], 'Unknown peer')
+
+        # The room is full
+        late, error = await self.join('room', users[3])
+        self.assertEqual(error['error'], 'Room is full')
+
+        await bob.disconnect()
+        self.assertEqual((await alice.receive_json_from())['type'], 'peer-left')
+        for communicator in (alice, carol, outsider, late):
+            await communicator.disconnect()
+
+    async def test_msgpack_frames(self):
+        alice, _ = await self.join('room', User(id=1, username='alice'), subprotocols=['msgpack'])
+        bob, bob_peers = await self.join('room', User(id=2, username='bob'))
+        joined = msgpack.unpackb(await alice.receive_from())
+        self.assertEqual((joined['type'], joined['username']), ('peer-joined', 'bob'))
+
+        # Binary in, text out to the JSON peer
+        await alice.send_to(bytes_data=msgpack.packb({'type': 'offer', 'to': bob_peers['peer'], 'data': {'sdp': 'x'}}))
+        offer = await bob.receive_json_from()
+        self.assertEqual((offer['type'], offer['data']), ('offer', {'sdp': 'x'}))
+
+        await alice.send_to(bytes_data=b'\xc1')
+        self.assertEqual(msgpack.unpackb(await alice.receive_from())['error'], 'Invalid frame')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_malformed_frames_and_presence_refresh(self):
+        alice, _ = await self.join('room', User(id=1, username='alice'))
+        with mock.patch('api.consumers.presence.touch') as touch:
+            for frame in ([1, 2], 'offer', {'type': ['offer']}, {'type': 'offer', 'to': ['x']}, {'type': 'offer', 'to': {}}):
+                await alice.send_json_to(frame)
+                self.assertIn((await alice.receive_json_from())['error'], ('Invalid frame', 'Unknown peer'))
+            touch.assert_not_called()  # Joined moments ago
+
+            with mock.patch('api.consumers.time.monotonic', return_value=time.monotonic() + 3600):
+                for _ in range(3):
+                    await alice.send_json_to({'type': 'ice', 'to': 'nobody'})
+                    await alice.receive_json_from()
+            self.assertEqual(touch.call_count, 1)
+        await alice.disconnect()
+
+
+# Read-through cache
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReadCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_post_is_cached_until_written(self):
+        post = Post.objects.create(author=self.user, content='hello')
+        self.assertEqual(self.client.get(f'/api/posts/{post.id}/').data['like_count'], 0)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f'/api/posts/{post.id}/')
+        self.assertEqual(len(context.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, post=post)
+            Post.objects.filter(pk=post.pk).update(like_count=1)
+        response = self.client.get(f'/api/posts/{post.id}/')
+        self.assertEqual((response.data['like_count'], response.data['likes']), (1, [f'reader liked {post.id}']))
+
+    def test_cached_media_urls_follow_the_request(self):
+        post = Post.objects.create(
+            author=self.user, content='photo', media='uploads/photo.png',
+            media_renditions={'thumbnail': 'renditions/photo.webp'},
+        )
+        first = self.client.get(f'/api/posts/{post.id}/', HTTP_HOST='localhost').data
+        self.assertEqual(first['media'], 'http://localhost/media/uploads/photo.png')
+        second = self.client.get(f'/api/posts/{post.id}/', HTTP_HOST='127.0.0.1', secure=True).data
+        self.assertEqual(
+            (second['media'], second['media_renditions']),
+            ('https://127.0.0.1/media/uploads/photo.png', {'thumbnail': 'https://127.0.0.1/media/renditions/photo.webp'}),
+        )
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(read_through('post', 'hot', compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['value'] * 8))
+
+
+# Per-process user cache
+@override_settings(SECURE_SSL_REDIRECT=False)
+class UserCacheTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(username='cached')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in context.captured_queries if 'FROM "auth_user"' in query['sql']]
+
+    def test_authentication_and_authors_come_from_the_cache(self):
+        Post.objects.create(author=self.user, content='hello')
+        self.assertEqual(len(self.user_queries('/api/posts/')), 1)
+        self.assertEqual(self.user_queries('/api/posts/'), [])
+
+    def test_saving_the_user_drops_it(self):
+        self.user_queries('/api/posts/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/posts/').status_code, 401)
+
+
+# Async read views
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.profile = Profile.objects.create(user=self.user, bio='hello')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_feed(self):
+        author = User.objects.create(username='author')
+        Profile.objects.create(user=author)
+        Follower.objects.create(user_from=self.user, user_to=author)
+        post = Post.objects.create(author=author, content='hi')
+        timeline.fan_out_post(post)
+        Like.objects.create(user=self.user, post=post)
+
+        results = self.client.get('/api/posts/feed/?compact=true').json()['results']
+        self.assertEqual([(row['id'], row['author']['username'], row['liked_by_me']) for row in results],
+                         [(post.id, 'author', True)])
+
+    def test_profile_reads_are_async_and_writes_still_work(self):
+        cache.clear()
+        self.assertEqual(self.client.get(f'/api/profiles/{self.profile.id}/').json()['bio'], 'hello')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/profiles/{self.profile.id}/', {'bio': 'updated'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'/api/profiles/{self.profile.id}/').json()['bio'], 'updated')
+
+    def test_head_and_options(self):
+        url = f'/api/profiles/{self.profile.id}/'
+        self.assertEqual(self.client.head(url).status_code, 200)
+        self.assertIn('PATCH', self.client.options(url)['Allow'])
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.assertEqual(self.client.head('/api/posts/feed/').status_code, 200)
+
+    def test_authentication_and_permissions_are_drf_s(self):
+        client = APIClient()
+        response = client.get('/api/notifications/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(client.get('/api/notifications/').status_code, 200)
+        with mock.patch('rest_framework.permissions.IsAuthenticated.has_permission', return_value=False):
+            self.assertEqual(client.get('/api/posts/trending/').status_code, 403)
+
+
+# Follower graph
+@override_settings(
+    SECURE_SSL_REDIRECT=False, CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+)
+class FollowerGraphTests(TestCase):
+
+    def setUp(self):
+        follower_graph.clear()
+        self.me, self.friend, self.other, self.popular = (
+            User.objects.create(username=name) for name in ('me', 'friend', 'other', 'popular')
+        )
+        for user in (self.me, self.friend, self.other, self.popular):
+            Profile.objects.create(user=user)
+        # Loaded from the table on first use
+        Follower.objects.create(user_from=self.friend, user_to=self.popular)
+        Follower.objects.create(user_from=self.other, user_to=self.popular)
+        Follower.objects.create(user_from=self.other, user_to=self.friend)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def follow(self, user, action='follow'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/followers/{action}/', {'user_to': user.id})
+
+    def edges(self, user_id):
+        # (ids user_id follows, ids of their followers) as the graph has them
+        follower_graph.ready()
+        return list(follower_graph.following.get(user_id, ())), list(follower_graph.followers.get(user_id, ()))
+
+    def test_follows_update_the_graph(self):
+        self.assertEqual(self.edges(self.me.id), ([], []))
+        self.follow(self.friend)
+        self.follow(self.other)
+        self.assertEqual(self.edges(self.me.id), ([self.friend.id, self.other.id], []))
+        self.assertEqual(self.edges(self.friend.id), ([self.popular.id], [self.me.id, self.other.id]))
+
+        with self.assertNumQueries(1):  # The suggested user, not in the user cache yet
+            suggestions = self.client.get('/api/followers/suggestions/').json()
+        self.assertEqual(suggestions, [{'user': {'id': self.popular.id, 'username': 'popular', 'email': ''},
+                                        'followed_by_following': 2}])
+        common = self.client.get(f'/api/followers/common/?user={self.other.id}').json()
+        self.assertEqual([user['username'] for user in common], ['friend'])
+
+        self.follow(self.friend, 'unfollow')
+        self.assertEqual(self.edges(self.me.id), ([self.other.id], []))
+        self.assertEqual(follower_graph.common_following(self.me.id, self.other.id), [])
+
+    def test_profiles_show_counts_and_relationship_flags(self):
+        self.follow(self.friend)
+        self.client.force_authenticate(self.friend)
+        self.follow(self.me)
+
+        profiles = {row['user']['username']: row for row in self.client.get('/api/profiles/').json()['results']}
+        # Only follows made through the API count; setUp's rows were inserted directly
+        self.assertEqual(
+            {name: (row['follower_count'], row['following_count'], row['following'], row['followed_by'])
+             for name, row in profiles.items()},
+            {'me': (1, 1, True, True), 'friend': (1, 1, False, False),
+             'other': (0, 0, False, True), 'popular': (0, 0, True, False)},
+        )
+        profile = self.client.get(f'/api/profiles/{self.me.profile.id}/').json()
+        self.assertEqual((profile['follower_count'], profile['following'], profile['followed_by']), (1, True, True))
+
+        followers = self.client.get(f'/api/users/{self.friend.id}/followers/').json()['results']
+        self.assertEqual([row['user_from']['username'] for row in followers], ['me', 'other'])
+        self.assertEqual(self.client.get(f'/api/users/{self.popular.id}/following/').json()['results'], [])
+
+    def test_deleting_a_user_releases_their_follows(self):
+        for user in (self.friend, self.popular, self.other):
+            self.follow(user)
+        self.follow(self.other, 'unfollow')  # Counted once, by the signal
+        self.me.profile.refresh_from_db()
+        self.assertEqual(self.me.profile.following_count, 2)
+        self.client.force_authenticate(self.friend)
+        self.follow(self.me)
+        friend_id = self.friend.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.friend.delete()
+
+        self.me.profile.refresh_from_db()
+        self.assertEqual((self.me.profile.follower_count, self.me.profile.following_count), (0, 1))
+        self.assertEqual(self.edges(self.me.id), ([self.popular.id], []))
+        self.assertEqual(self.edges(friend_id), ([], []))
+
+    def test_deleting_a_user_takes_the_same_queries_for_any_number_of_follows(self):
+        def deletion_queries(name, follows):
+            user = User.objects.create(username=name)
+            Profile.objects.create(user=user)
+            for i in range(follows):
+                other = User.objects.create(username=f'{name}{i}')
+                Profile.objects.create(user=other, follower_count=1, following_count=1)
+                Follower.objects.create(user_from=user, user_to=other)
+                Follower.objects.create(user_from=other, user_to=user)
+            with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+                user.delete()
+            others = Profile.objects.filter(user__username__startswith=name)
+            self.assertEqual(set(others.values_list('follower_count', 'following_count')), {(0, 0)} if follows else set())
+            return len(context.captured_queries)
+
+        self.assertEqual(deletion_queries('few', 1), deletion_queries('many', 6))
+
+    @override_settings(FOLLOWER_SUGGESTION_SAMPLE=2)
+    def test_suggestions_sample_is_deterministic(self):
+        users = [User.objects.create(username=f'followed{i}') for i in range(4)]
+        # Of the four follows, the first and third are sampled
+        for user, suggested in zip(users, (self.friend, self.other, self.popular, self.other)):
+            Follower.objects.create(user_from=self.me, user_to=user)
+            Follower.objects.create(user_from=user, user_to=suggested)
+        for _ in range(3):
+            self.assertEqual(follower_graph.suggestions(self.me.id, 5), [(self.friend.id, 1), (self.popular.id, 1)])
+
+    def test_changes_during_a_reload_are_replayed(self):
+        follower_graph.ready()
+        follower_graph.reloading = []
+        follower_graph.add(self.me.id, self.friend.id)  # Not in the table the reload reads
+        follower_graph.reload()
+        self.assertEqual(self.edges(self.me.id)[0], [self.friend.id])
+        self.assertEqual(self.edges(self.other.id)[0], [self.friend.id, self.popular.id])
+
+    def test_failed_reloads_are_retried_after_the_ttl(self):
+        follower_graph.ready()
+        follower_graph.loaded_at -= settings.FOLLOWER_GRAPH_TTL + 1
+        with mock.patch.object(follower_graph, 'load', side_effect=DatabaseError), self.assertLogs('api.graph'):
+            follower_graph.reload()
+        with mock.patch('api.graph.threading.Thread') as thread:
+            follower_graph.ready()
+        thread.assert_not_called()
+        self.assertEqual(self.edges(self.friend.id)[0], [self.popular.id])
+
+
+# Unique likes and reposts
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DuplicateWriteTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='fan')
+        author = User.objects.create(username='author')
+        self.post = Post.objects.create(author=author, content='hi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_second_like_and_repost_are_rejected(self):
+        for url, model, counter in (('/api/likes/', Like, 'like_count'), ('/api/reposts/', Repost, 'repost_count')):
+            self.assertEqual(self.client.post(url, {'post': self.post.id}).status_code, 201)
+            self.assertEqual(self.client.post(url, {'post': self.post.id}).status_code, 400)
+            self.assertEqual(model.objects.filter(user=self.user, post=self.post).count(), 1)
+            self.post.refresh_from_db()
+            self.assertEqual(getattr(self.post, counter), 1)
+
+
+# Image renditions
+@override_settings(SECURE_SSL_REDIRECT=False, MEDIA_WORKERS=0)
+class MediaPipelineTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(username='photographer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'teal').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_post_image_is_rendered_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {'content': 'view', 'media': self.upload('view.png', (2000, 1000))})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['media_renditions'], {})
+
+        renditions = self.client.get(f'/api/posts/{response.json()["id"]}/').json()['media_renditions']
+        self.assertEqual(set(renditions), {'thumbnail', 'large'})
+        post = Post.objects.get()
+        with default_storage.open(post.media_renditions['thumbnail']) as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+
+        # The same picture on a profile is stored once
+        profile = Profile.objects.create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/profiles/{profile.id}/', {'profile_picture': self.upload('me.png', (2000, 1000))})
+        profile.refresh_from_db()
+        self.assertEqual(profile.profile_picture_renditions, post.media_renditions)
+
+
+# Content-addressed media storage
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MediaStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(username='sharer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_document(self):
+        upload = SimpleUploadedFile('report.pdf', bytes(range(256)) * 4, content_type='application/pdf')
+        return self.client.post('/api/posts/', {'content': 'read this', 'media': upload}).json()['id']
+
+    def test_identical_uploads_are_stored_once_until_the_last_is_deleted(self):
+        first, second = self.post_document(), self.post_document()
+        name = Post.objects.get(id=first).media.name
+        self.assertEqual(Post.objects.get(id=second).media.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/posts/{first}/')
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/posts/{second}/')
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_files_stored_before_content_addressing(self):
+        # Shared renditions are released by reference once migration 0013 counts them
+        rendition = default_storage._save('renditions/ab/abc.webp', ContentFile(b'webp'))
+        upload = default_storage._save('post_media/old.pdf', ContentFile(b'pdf'))
+        for _ in range(2):
+            Post.objects.create(author=self.user, content='old', media=upload, media_renditions={'small': rendition})
+        importlib.import_module('api.migrations.0013_count_legacy_renditions').count_renditions(apps, None)
+        self.assertEqual(StoredFile.objects.values_list('name', 'size', 'references').get(), (rendition, 4, 2))
+
+        default_storage.delete(rendition)
+        self.assertTrue(default_storage.exists(rendition))
+        default_storage.delete(rendition)
+        self.assertFalse(default_storage.exists(rendition))
+        default_storage.delete(upload)  # Single owner
+        self.assertFalse(default_storage.exists(upload))
+
+    def test_serving_with_etag_and_ranges(self):
+        url = f'/media/{Post.objects.get(id=self.post_document()).media.name}'
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)) * 4)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        partial = self.client.get(url, HTTP_RANGE='bytes=250-259')
+        self.assertEqual((partial.status_code, partial['Content-Range']), (206, 'bytes 250-259/1024'))
+        self.assertEqual(b''.join(partial.streaming_content), bytes([250, 251, 252, 253, 254, 255, 0, 1, 2, 3]))
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=2000-').status_code, 416)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+
+# Full-text search
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(username='alice_w')
+        self.pythonista = User.objects.create(username='pythonista')
+        Profile.objects.create(user=self.alice, bio='Writes Python on weekends')
+        Profile.objects.create(user=self.pythonista)
+        # Indexed by the triggers as the rows are written
+        self.once = Post.objects.create(author=self.alice, content='Café opening with live jazz')
+        self.twice = Post.objects.create(author=self.alice, content='Jazz night, more jazz tomorrow')
+        Post.objects.create(author=self.alice, content='Nothing to see')
+        for name in ('python', 'pythonic', 'jazz'):
+            Hashtag.objects.create(name=name)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def search(self, query, kind='posts', **params):
+        response = self.client.get('/api/search/', {'q': query, 'type': kind, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_posts_are_ranked_and_follow_edits(self):
+        self.assertEqual([post['id'] for post in self.search('jazz')], [self.twice.id, self.once.id])
+        # All terms must match; diacritics are ignored and the last term is a prefix
+        self.assertEqual([post['id'] for post in self.search('cafe jaz')], [self.once.id])
+        self.assertEqual(self.search('"jazz" OR NOT'), [])
+
+        self.once.content = 'Closed for the season'
+        self.once.save()
+        self.twice.delete()
+        self.assertEqual(self.search('jazz'), [])
+        self.assertEqual([post['id'] for post in self.search('season')], [self.once.id])
+
+    def test_users_and_hashtags(self):
+        # A username match ranks above a bio match
+        self.assertEqual([user['id'] for user in self.search('python', 'users')], [self.pythonista.id, self.alice.id])
+        self.assertEqual([tag['name'] for tag in self.search('#pyth', 'hashtags')], ['python', 'pythonic'])
+
+        Profile.objects.filter(user=self.alice).update(bio='')  # Trigger on UPDATE, not only save()
+        self.pythonista.username = 'snake'
+        self.pythonista.save()
+        self.assertEqual([user['username'] for user in self.search('snak', 'users')], ['snake'])
+        self.assertEqual(self.search('python', 'users'), [])
+
+    @override_settings(SEARCH_MAX_RESULTS=2)
+    def test_limit_is_clamped(self):
+        for limit, expected in ((-1, 1), (0, 1), (1, 1), (5, 2)):
+            self.assertEqual(len(self.search('pyth', 'hashtags', limit=limit)), expected)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'jazz', 'limit': 'all'}).status_code, 400)
+
+    def test_autocomplete(self):
+        response = self.client.get('/api/search/autocomplete/', {'q': 'py'}).json()
+        self.assertEqual([user['username'] for user in response['users']], ['pythonista'])  # Not the bio
+        self.assertEqual([tag['name'] for tag in response['hashtags']], ['python', 'pythonic'])
+        self.assertEqual(self.client.get('/api/search/autocomplete/', {'q': 'alice_'}).json()['users'][0]['id'], self.alice.id)
+        self.assertEqual(self.client.get('/api/search/', {'q': '  '}).status_code, 400)
+
+    def test_dropped_triggers_are_restored(self):
+        self.assertEqual(search.restore_triggers(), [])  # All in place after migrate
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER api_search_post_insert')
+        unindexed = Post.objects.create(author=self.alice, content='lost saxophone')
+        self.assertEqual(self.search('saxophone'), [])
+
+        with self.assertLogs('api.search', 'WARNING'):
+            self.assertEqual(search.restore_triggers(), ['api_search_post_insert'])
+        self.assertEqual([post['id'] for post in self.search('saxophone')], [unindexed.id])
+        indexed = Post.objects.create(author=self.alice, content='saxophone found')
+        self.assertEqual({post['id'] for post in self.search('saxophone')}, {unindexed.id, indexed.id})
+
+
+# SQLite database profile
+class SQLiteWriteConcurrencyTests(SimpleTestCase):
+    """
+    Read-then-write transactions from many threads on a database file, as likes,
+    notifications and messages do. With plain deferred transactions they deadlock
+    on the lock upgrade and fail with "database is locked".
+    """
+    databases = {'default'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_dict = ConnectionHandler().configure_settings(
+            {'default': database.sqlite(Path(directory.name) / 'db.sqlite3')}
+        )['default']
+
+    def connect(self):
+        return DatabaseWrapper(self.settings_dict)
+
+    def test_concurrent_writers(self):
+        setup = self.connect()
+        with setup.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER)')
+            cursor.execute('INSERT INTO counter VALUES (1, 0)')
+
+        errors = []
+
+        def writer():
+            connection = self.connect()
+            try:
+                for _ in range(25):
+                    with connection.cursor() as cursor:
+                        # What transaction.atomic() issues with this profile
+                        cursor.execute(f'BEGIN {connection.transaction_mode}')
+                        cursor.execute('SELECT value FROM counter WHERE id = 1')
+                        value = cursor.fetchone()[0]
+                        cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+                        cursor.execute('COMMIT')
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with setup.cursor() as cursor:
+            cursor.execute('SELECT value FROM counter WHERE id = 1')
+            self.assertEqual(cursor.fetchone()[0], 8 * 25)
+        setup.close()
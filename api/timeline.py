@@ -0,0 +1,151 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+
+from .caching import invalidate
+from .models import Follower, Post, Profile, TimelineEntry
+
+# Materialized home timelines.
+#
+# Posts by regular authors are pushed into every follower's timeline when they are
+# created (fan-out on write). Authors with more than TIMELINE_FANOUT_THRESHOLD followers
+# are skipped on write and merged in when the feed is read (fan-out on read), so a
+# single post never turns into millions of inserts. Each post records which way it went
+# (Post.fanned_out), so crossing the threshold later never hides a post from a feed.
+#
+# Fan-out appends without trimming (that would be a query per follower per post);
+# trim_all(), run by `python manage.py trim_timelines`, cuts every timeline back to
+# TIMELINE_MAX_LENGTH entries. Feeds only read that many, so longer timelines are
+# wasted space rather than wrong results.
+
+
+def is_fanout_on_read(author):
+    """
+    Returns True if posts by this author are merged in at read time instead of pushed.
+    """
+    return Profile.objects.filter(
+        user=author, follower_count__gt=settings.TIMELINE_FANOUT_THRESHOLD
+    ).exists()
+
+
+def fan_out_post(post):
+    """
+    Pushes a freshly created post into the timeline of each of its author's followers.
+    """
+    if is_fanout_on_read(post.author):
+        return
+
+    follower_ids = Follower.objects.filter(user_to=post.author_id).values_list('user_from', flat=True)
+    entries = (
+        TimelineEntry(owner_id=follower_id, post=post, timestamp=post.timestamp)
+        for follower_id in follower_ids.iterator(chunk_size=settings.TIMELINE_BATCH_SIZE)
+    )
+    _bulk_insert(entries)
+    Post.objects.filter(pk=post.pk).update(fanned_out=True)
+    post.fanned_out = True
+
+
+def backfill(user, followed):
+    """
+    Copies the most recent fanned-out posts of a newly followed author into the user's
+    timeline. The author's other posts are merged in when the feed is read.
+    """
+    recent_posts = (
+        Post.objects.filter(author=followed, fanned_out=True)
+        .order_by('-timestamp')
+        .values_list('id', 'timestamp')[:settings.TIMELINE_BACKFILL_LIMIT]
+    )
+    _bulk_insert(
+        TimelineEntry(owner=user, post_id=post_id, timestamp=timestamp)
+        for post_id, timestamp in recent_posts
+    )
+    trim(user)
+
+
+def evict(user, unfollowed):
+    """
+    Removes an unfollowed author's posts from the user's timeline.
+    """
+    TimelineEntry.objects.filter(owner=user, post__author=unfollowed).delete()
+
+
+def trim(user):
+    """
+    Drops the entries that fall past TIMELINE_MAX_LENGTH in the user's timeline.
+    Returns the number of entries deleted.
+    """
+    cutoff = list(
+        TimelineEntry.objects.filter(owner=user)
+        .order_by('-timestamp')
+        .values_list('timestamp', flat=True)[settings.TIMELINE_MAX_LENGTH:settings.TIMELINE_MAX_LENGTH + 1]
+    )
+    if not cutoff:
+        return 0
+    deleted, _ = TimelineEntry.objects.filter(owner=user, timestamp__lte=cutoff[0]).delete()
+    return deleted
+
+
+def trim_all():
+    """
+    Trims every timeline longer than TIMELINE_MAX_LENGTH. Returns the number of
+    entries deleted.
+    """
+    owners = list(
+        TimelineEntry.objects.values('owner').annotate(total=Count('id'))
+        .filter(total__gt=settings.TIMELINE_MAX_LENGTH).values_list('owner', flat=True)
+    )
+    return sum(trim(owner_id) for owner_id in owners)
+
+
+def home_timeline(user):
+    """
+    Returns the posts making up the user's home feed.
+
+    The precomputed timeline is capped at TIMELINE_MAX_LENGTH entries and merged with
+    the posts of followed authors that were not fanned out on write.
+    """
+    timeline_posts = (
+        TimelineEntry.objects.filter(owner=user)
+        .order_by('-timestamp')
+        .values('post_id')[:settings.TIMELINE_MAX_LENGTH]
+    )
+    followed_authors = Follower.objects.filter(user_from=user).values('user_to')
+    return Post.objects.filter(Q(id__in=timeline_posts) | Q(author__in=followed_authors, fanned_out=False))
+
+
+def follower_added(user, followed):
+    Profile.objects.filter(user=followed).update(follower_count=F('follower_count') + 1)
+    Profile.objects.filter(user=user).update(following_count=F('following_count') + 1)
+    _invalidate_profiles(user, followed)
+
+
+def follower_removed(user, followed):
+    Profile.objects.filter(user=followed, follower_count__gt=0).update(follower_count=F('follower_count') - 1)
+    Profile.objects.filter(user=user, following_count__gt=0).update(following_count=F('following_count') - 1)
+    _invalidate_profiles(user, followed)
+
+
+def user_follows_removed(user):
+    """
+    Releases every follow of a user about to be deleted: one counter update per
+    direction covers all the profiles involved.
+    """
+    following = Follower.objects.filter(user_from=user).values('user_to')
+    followers = Follower.objects.filter(user_to=user).values('user_from')
+    Profile.objects.filter(user__in=following, follower_count__gt=0).update(follower_count=F('follower_count') - 1)
+    Profile.objects.filter(user__in=followers, following_count__gt=0).update(following_count=F('following_count') - 1)
+    affected = Profile.objects.filter(Q(user__in=following) | Q(user__in=followers))
+    invalidate('profile', *affected.values_list('pk', flat=True))
+
+
+def _invalidate_profiles(*users):
+    # Cached profiles show the counters; update() sends no signal to drop them
+    invalidate('profile', *Profile.objects.filter(user__in=users).values_list('pk', flat=True))
+
+
+def _bulk_insert(entries):
+    # bulk_create() materializes its input, so feed it one batch at a time
+    entries = iter(entries)
+    while batch := list(islice(entries, settings.TIMELINE_BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
@@ -0,0 +1,335 @@
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import Comment, Like, Repost
+from .sketch import SlidingHeavyHitters
+
+logger = logging.getLogger(__name__)
+
+# Trending posts and hashtags.
+#
+# Every like, comment and repost adds a weight to its post's score, and scores decay
+# exponentially with a per-window half-life. Scores use forward decay: an event at
+# time t is stored as weight * 2 ** ((t - landmark) / half_life), so older scores
+# never need to be touched and ranking by stored value equals ranking by decayed
+# score. The landmark moves forward (rescaling every score once) before the numbers
+# grow too large, on reads as well as writes, so a window left idle for weeks is
+# rescaled instead of overflowing.
+#
+# Hashtags on new posts are counted over a sliding window in Count-Min Sketches
+# (see sketch.py). Both kinds of state live in the Django cache, shared by every
+# worker when the cache is (see BufferedCacheState).
+
+# Rebase once the landmark is this many half-lives in the past
+REBASE_AFTER = 32
+LOCK_POLL_INTERVAL = 0.01
+
+
+class DecayedTopK:
+    """
+    Time-decayed scores for a bounded number of keys.
+    """
+
+    def __init__(self, half_life, capacity, landmark=None, scores=None):
+        self.half_life = half_life
+        self.capacity = capacity
+        self.landmark = time.time() if landmark is None else landmark
+        self.scores = scores or {}
+
+    def add(self, key, weight, when):
+        self._advance(when)
+        score = self.scores.get(key, 0.0) + weight * self._growth(when)
+        if score > 0:
+            self.scores[key] = score
+        else:
+            self.scores.pop(key, None)
+        # Prune in batches, keeping the strongest candidates
+        if len(self.scores) > self.capacity + self.capacity // 4:
+            self.scores = dict(heapq.nlargest(self.capacity, self.scores.items(), key=lambda item: item[1]))
+
+    def top(self, k, now):
+        """
+        Returns the k highest (key, score) pairs, scores decayed to `now`.
+        """
+        self._advance(now)
+        decay = 1 / self._growth(now)
+        best = heapq.nlargest(k, self.scores.items(), key=lambda item: item[1])
+        return [(key, score * decay) for key, score in best]
+
+    def _growth(self, when):
+        return 2 ** ((when - self.landmark) / self.half_life)
+
+    def _advance(self, when):
+        if (when - self.landmark) / self.half_life > REBASE_AFTER:
+            self._rebase(when)
+
+    def _rebase(self, when):
+        # Computed as a decay, which underflows to 0 where the growth would overflow
+        decay = 2 ** ((self.landmark - when) / self.half_life)
+        self.scores = {key: score * decay for key, score in self.scores.items() if score * decay > 1e-6}
+        self.landmark = when
+
+    def to_state(self):
+        return {'landmark': self.landmark, 'scores': self.scores}
+
+    @classmethod
+    def from_state(cls, half_life, capacity, state):
+        return cls(half_life, capacity, landmark=state['landmark'], scores=state['scores'])
+
+
+class BufferedCacheState:
+    """
+    State in the Django cache that every worker updates.
+
+    With a shared cache backend (Redis) every worker reads and updates the same
+    state; with the local-memory cache each process keeps its own. Events are
+    buffered per process and merged into the cached state at most every
+    TRENDING_FLUSH_INTERVAL seconds, holding a cache lock for the read-modify-write:
+    concurrent workers don't overwrite each other's merges, and rewriting the
+    state costs once per interval instead of once per event. Subclasses merge().
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.pending = []  # Events not merged into the cache yet
+        self.flusher = None  # Timer that merges them
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[settings.TRENDING_CACHE]
+
+    def buffer(self, event):
+        with self.lock:
+            self.pending.append(event)
+            if self.flusher is None and settings.TRENDING_FLUSH_INTERVAL:
+                self.flusher = threading.Timer(settings.TRENDING_FLUSH_INTERVAL, self.flush)
+                self.flusher.daemon = True
+                self.flusher.start()
+        if not settings.TRENDING_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Merges the buffered events into the cached state.
+        """
+        with self.lock:
+            events, self.pending = self.pending, []
+            if self.flusher is not None:
+                self.flusher.cancel()
+                self.flusher = None
+        if not events:
+            return
+
+        lock_key = self.cache_key('lock')
+        try:
+            if not self.acquire(lock_key):
+                # The holder is slow or died; its lock expires and the next flush retries
+                with self.lock:
+                    self.pending[:0] = events
+                return
+            try:
+                self.merge(events)
+            finally:
+                self.cache.delete(lock_key)
+        except Exception:
+            # Cache unavailable: the events are dropped from the cached state
+            logger.warning('Dropped %d trending events of %s', len(events), self.name, exc_info=True)
+
+    def merge(self, events):
+        raise NotImplementedError
+
+    def acquire(self, lock_key):
+        deadline = time.monotonic() + settings.TRENDING_LOCK_TIMEOUT
+        while not self.cache.add(lock_key, 1, settings.TRENDING_LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
+        return True
+
+    def cache_key(self, part):
+        return f'trending:{self.name}:{part}'
+
+
+class TrendingEngine(BufferedCacheState):
+    """
+    Keeps one DecayedTopK per window in the Django cache (see BufferedCacheState).
+    A cold window is rebuilt from the Like, Comment and Repost rows.
+    """
+
+    sources = {'like': Like, 'comment': Comment, 'repost': Repost}
+
+    def record(self, post_id, kind, when=None, undo=False):
+        """
+        Adds a like/comment/repost to every window. undo=True takes it back out.
+        """
+        when = (when or timezone.now()).timestamp()
+        weight = settings.TRENDING_WEIGHTS[kind] * (-1 if undo else 1)
+        self.buffer((post_id, weight, when))
+
+    def merge(self, events):
+        for window, half_life in settings.TRENDING_WINDOWS.items():
+            state = self.cache.get(self.cache_key(window))
+            if state is None:
+                # The events are committed rows, which the next load() rebuilds from
+                continue
+            scores = DecayedTopK.from_state(half_life, settings.TRENDING_CAPACITY, state)
+            for post_id, weight, when in events:
+                scores.add(post_id, weight, when)
+            self.cache.set(self.cache_key(window), scores.to_state(), timeout=None)
+
+    def top(self, window, k=None):
+        """
+        Returns the ids of the k highest-scoring posts in the window, best first.
+        """
+        k = k or settings.TRENDING_TOP_K
+        self.flush()  # This process's own events first
+        return [post_id for post_id, score in self.load(window).top(k, time.time())]
+
+    def load(self, window):
+        half_life = settings.TRENDING_WINDOWS[window]
+        try:
+            state = self.cache.get(self.cache_key(window))
+        except Exception:
+            logger.warning('Reading trending %s scores failed', self.name, exc_info=True)
+            state = None
+        if state is None:
+            return self.rebuild(window)
+        return DecayedTopK.from_state(half_life, settings.TRENDING_CAPACITY, state)
+
+    def rebuild(self, window):
+        """
+        Recomputes a window from the rows written in its last few half-lives,
+        used when the cache is cold.
+        """
+        half_life = settings.TRENDING_WINDOWS[window]
+        since = timezone.now() - timedelta(seconds=half_life * 4)
+        scores = DecayedTopK(half_life, settings.TRENDING_CAPACITY, landmark=since.timestamp())
+        for kind, model in self.sources.items():
+            weight = settings.TRENDING_WEIGHTS[kind]
+            rows = model.objects.filter(created__gte=since).values_list('post_id', 'created')
+            for post_id, created in rows.iterator():
+                scores.add(post_id, weight, created.timestamp())
+        try:
+            # add(), so a flush that got in first isn't overwritten
+            self.cache.add(self.cache_key(window), scores.to_state(), timeout=None)
+        except Exception:
+            logger.warning('Storing trending %s scores failed', self.name, exc_info=True)
+        return scores
+
+
+trending_posts = TrendingEngine('posts')
+atexit.register(trending_posts.flush)
+
+
+class TrendingHashtags(BufferedCacheState):
+    """
+    Tags on new posts counted in a SlidingHeavyHitters kept in the Django cache
+    (see BufferedCacheState), so every worker with a shared cache serves the same
+    counts. The process merging into it writes it to snapshot_path when a bucket has
+    closed, and each process that merged anything does at exit, so a cold cache (a
+    restart) resumes the window from disk.
+    """
+
+    def __init__(self, name, snapshot_path=None):
+        super().__init__(name)
+        self.snapshot_path = snapshot_path
+        self.merged = False  # Merged since the last snapshot
+
+    def record(self, tags):
+        if tags:
+            self.buffer(list(tags))
+
+    def merge(self, events):
+        # Counted at merge time; the buffering delay is well under a bucket
+        trends = self.load()
+        newest = trends.window[-1][0] if trends.window else None
+        now = time.time()
+        for tags in events:
+            trends.add(tags, now)
+        state = trends.to_state()
+        self.cache.set(self.cache_key('state'), state, timeout=None)
+        self.merged = True
+        if newest is not None and trends.window[-1][0] != newest:
+            self.write_snapshot(state)  # A bucket just closed
+
+    def top(self, n):
+        """
+        Returns up to n (tag, estimated count) pairs, highest first.
+        """
+        self.flush()  # This process's own tags first
+        try:
+            return self.load().top(n)
+        except Exception:
+            logger.warning('Reading trending %s failed', self.name, exc_info=True)
+            return []
+
+    def load(self):
+        trends = SlidingHeavyHitters(
+            window=settings.TRENDING_HASHTAGS_WINDOW,
+            buckets=settings.TRENDING_HASHTAGS_BUCKETS,
+            width=settings.TRENDING_HASHTAGS_SKETCH_WIDTH,
+            depth=settings.TRENDING_HASHTAGS_SKETCH_DEPTH,
+            capacity=settings.TRENDING_HASHTAGS_CAPACITY,
+        )
+        state = self.cache.get(self.cache_key('state'))
+        if state is None:
+            state = self.read_snapshot()
+            if state is not None:
+                # add(), so a merge that got in first isn't overwritten
+                self.cache.add(self.cache_key('state'), state, timeout=None)
+        if state is not None:
+            trends.load_state(state)
+        return trends
+
+    def snapshot(self):
+        self.flush()
+        if not self.snapshot_path or not self.merged:
+            # A process that never counted anything (migrate, idle workers) has
+            # nothing the saved snapshot lacks
+            return
+        try:
+            state = self.cache.get(self.cache_key('state'))
+        except Exception:
+            logger.warning('Reading trending %s failed', self.name, exc_info=True)
+            return
+        if state is not None:
+            self.write_snapshot(state)
+
+    def read_snapshot(self):
+        if not self.snapshot_path:
+            return None
+        try:
+            with open(self.snapshot_path) as snapshot:
+                return json.load(snapshot)
+        except (OSError, ValueError):
+            return None
+
+    def write_snapshot(self, state):
+        if not self.snapshot_path:
+            return
+        # Write then rename, so a crash never leaves a truncated snapshot; the
+        # temporary file is per process, as several may write at once
+        temporary = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'w') as snapshot:
+                json.dump(state, snapshot)
+            os.replace(temporary, self.snapshot_path)
+        except OSError:
+            logger.warning('Writing the trending %s snapshot failed', self.name, exc_info=True)
+            return
+        self.merged = False
+
+
+trending_hashtags = TrendingHashtags('hashtags', snapshot_path=settings.TRENDING_HASHTAGS_SNAPSHOT)
+atexit.register(trending_hashtags.snapshot)
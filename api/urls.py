@@ -1,10 +1,11 @@
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, ProfileViewSet, PostViewSet, FollowerViewSet, LikeViewSet, CommentViewSet,
-    NotificationListView, MarkNotificationReadView, MessageViewSet, RepostViewSet, HashtagViewSet,
-    TrendingPostView, SignUpView
+    MarkNotificationReadView, MarkAllNotificationsReadView, UnreadNotificationCountView, MessageViewSet, RepostViewSet, HashtagViewSet,
+    SignUpView, ConversationViewSet, SearchView, AutocompleteView
 )
 from django.urls import path, include
+from . import async_views
 
 router = DefaultRouter()
 router.register('users', UserViewSet)
@@ -14,14 +15,22 @@ router.register('followers', FollowerViewSet)
 router.register('likes', LikeViewSet)
 router.register('comments', CommentViewSet)
 router.register('messages', MessageViewSet)
+router.register('conversations', ConversationViewSet, basename='conversation')
 router.register('reposts', RepostViewSet)
 router.register('hashtags', HashtagViewSet)
 
 urlpatterns = [
+    # Async read views, listed before the router so they take over its routes
+    path('posts/feed/', async_views.feed, name='feed'),
+    path('posts/trending/', async_views.trending, name='trending-posts'),
+    path('profiles/<int:pk>/', async_views.profile_detail, name='profile-detail'),
     path('', include(router.urls)),
     path('signup/', SignUpView.as_view(), name='signup'),
-    path('notifications/', NotificationListView.as_view(), name='notifications'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('search/autocomplete/', AutocompleteView.as_view(), name='search_autocomplete'),
+    path('notifications/', async_views.notifications, name='notifications'),
     path('notifications/<int:notification_id>/read/', MarkNotificationReadView.as_view(), name='mark_notification_read'),
-    path('posts/trending/', TrendingPostView.as_view(), name='trending-posts'),
+    path('notifications/read/', MarkAllNotificationsReadView.as_view(), name='mark_all_notifications_read'),
+    path('notifications/unread-count/', UnreadNotificationCountView.as_view(), name='unread_notification_count'),
 ]
 
@@ -0,0 +1,130 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+# Per-process cache of User rows.
+#
+# Request authentication and author hydration in serializers read the same few
+# users over and over; this keeps the USER_CACHE_SIZE most recently used ones in
+# memory for USER_CACHE_TTL seconds. Saving a user or profile drops its entry in
+# this process (see signals.py); other processes see the change when their entry
+# expires, so the TTL bounds how stale a user can be.
+
+
+class LRUCache:
+    """
+    Thread-safe mapping holding at most `size` entries, each for `ttl` seconds.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = LRUCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+def get_users(user_ids):
+    """
+    Returns {id: User} for the ids that exist, loading the uncached ones in one query.
+
+    Each call gets its own copies, so callers may modify them.
+    """
+    users, missing = _cached(user_ids)
+    if missing:
+        users.update(_remember(list(User.objects.filter(id__in=missing))))
+    return {user_id: copy.copy(user) for user_id, user in users.items()}
+
+
+async def aget_users(user_ids):
+    users, missing = _cached(user_ids)
+    if missing:
+        users.update(_remember([user async for user in User.objects.filter(id__in=missing)]))
+    return {user_id: copy.copy(user) for user_id, user in users.items()}
+
+
+def get_user(user_id):
+    return get_users([user_id]).get(user_id)
+
+
+def hydrate_users(instances, fields):
+    """
+    Sets the given User foreign keys on the instances from the cache, skipping the
+    ones already loaded (e.g. through select_related).
+    """
+    pending = _pending(instances, fields)
+    if pending:
+        _assign(pending, get_users([user_id for _, _, user_id in pending]))
+
+
+async def ahydrate_users(instances, fields):
+    pending = _pending(instances, fields)
+    if pending:
+        _assign(pending, await aget_users([user_id for _, _, user_id in pending]))
+
+
+def _cached(user_ids):
+    users = {}
+    missing = []
+    for user_id in set(user_ids):
+        user = user_cache.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = user
+    return users, missing
+
+
+def _remember(users):
+    for user in users:
+        user_cache.set(user.id, user)
+    return {user.id: user for user in users}
+
+
+def _pending(instances, fields):
+    pending = []
+    for instance in instances:
+        for name in fields:
+            field = instance._meta.get_field(name)
+            user_id = getattr(instance, field.attname)
+            if user_id is not None and not field.is_cached(instance):
+                pending.append((instance, field, user_id))
+    return pending
+
+
+def _assign(pending, users):
+    for instance, field, user_id in pending:
+        if user_id in users:
+            field.set_cached_value(instance, users[user_id])
@@ -7,14 +7,31 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from django.db import IntegrityError, transaction
+from django.conf import settings
 from .models import (
-    Profile, Post, Follower, Notification, Like, Comment, Message, Repost, Hashtag, PostHashtag
+    Profile, Post, Follower, Notification, Like, Comment, Message, Repost, Hashtag, PostHashtag,
+    Conversation, ConversationParticipant,
 )
 from .serializers import (
-    UserSerializer, ProfileSerializer, PostSerializer, FollowerSerializer, NotificationSerializer,
-    LikeSerializer, CommentSerializer, MessageSerializer, RepostSerializer, HashtagSerializer, PostHashtagSerializer
+    UserSerializer, ProfileSerializer, PostSerializer, CompactPostSerializer, FollowerSerializer,
+    LikeSerializer, CommentSerializer, MessageSerializer, RepostSerializer, HashtagSerializer, PostHashtagSerializer,
+    ConversationSerializer, absolute_urls,
 )
-from django.db.models import Count
+from django.db.models import Exists, F, OuterRef, Q
+from . import timeline
+from .pagination import KeysetPagination
+from .prefetch import EagerLoadingMixin, eager_load
+from .trending import trending_hashtags
+from .notifications import mark_read, notify, unread_count
+from .messaging import direct_conversation, record_messages
+from .hashtags import normalize as normalize_hashtag, sync_post_hashtags
+from .caching import read_through
+from .media import process_uploads
+from .graph import follower_graph, relationship_flags
+from .user_cache import get_users
+from . import search
 
 # User Sign-Up API View
 class SignUpView(APIView):
@@ -40,13 +57,28 @@ class SignUpView(APIView):
         return Response({'message': 'User created successfully'}, status=status.HTTP_201_CREATED)
 
 # User ViewSet (CRUD for users)
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
+    @action(detail=True, methods=['get'])
+    def followers(self, request, pk=None):
+        # Newest followers first, read off the (user_to, created) index
+        return self.follows(Follower.objects.filter(user_to=self.get_object()))
+
+    @action(detail=True, methods=['get'])
+    def following(self, request, pk=None):
+        return self.follows(Follower.objects.filter(user_from=self.get_object()))
+
+    def follows(self, queryset):
+        paginator = KeysetPagination(ordering=('-created', '-id'))
+        page = paginator.paginate_queryset(eager_load(queryset, FollowerSerializer), self.request, view=self)
+        serializer = FollowerSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
 # Profile ViewSet
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     #queryset = Profile.objects.all()
     queryset = Profile.objects.all().order_by('user__username')  # Order by username or another field
     serializer_class = ProfileSerializer
@@ -55,45 +87,69 @@ class ProfileViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Associate the profile with the authenticated user
         serializer.save(user=self.request.user)
+        process_uploads(serializer, ['profile_picture', 'cover_photo'])
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        add_relationship_flags(request.user, response.data['results'])
+        return response
     
     def update(self, request, *args, **kwargs):
         profile = self.get_object()  # Get the profile instance
         serializer = self.get_serializer(profile, data=request.data, partial=True)  # Allow partial updates
         serializer.is_valid(raise_exception=True)  # Validate the data
         serializer.save()  # Save the updated profile
+        process_uploads(serializer, ['profile_picture', 'cover_photo'])  # Renditions of new pictures
         return Response(serializer.data)  # Return the updated profile data
+
 # Post ViewSet
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all().order_by('-timestamp')
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]  # Enable file uploads
+    pagination_class = KeysetPagination  # Cursor on (timestamp, id), no OFFSET or COUNT
+
+    def get_serializer_class(self):
+        # ?compact=true returns counters and a liked_by_me flag instead of the like/comment lists
+        if self.request.query_params.get('compact') in ('1', 'true'):
+            return CompactPostSerializer
+        return PostSerializer
+
+    def get_queryset(self):
+        return self.annotate_liked_by_me(super().get_queryset())
+
+    def annotate_liked_by_me(self, queryset):
+        if self.get_serializer_class() is CompactPostSerializer:
+            queryset = annotate_liked_by_me(queryset, self.request.user)
+        return queryset
 
     def perform_create(self, serializer):
         # Automatically link the author to the authenticated user
-        serializer.save(author=self.request.user)
-
-    @action(detail=False, methods=['get'])
-    def feed(self, request):
-        followed_users = Follower.objects.filter(user_from=request.user).values_list('user_to', flat=True)
-        posts = Post.objects.filter(author__in=followed_users)
-
-        # Sorting by date or popularity (likes)
-        sort_by = request.query_params.get('sort_by', 'date')
-        if sort_by == 'date':
-            posts = posts.order_by('-timestamp')
-        elif sort_by == 'popularity':
-            posts = posts.annotate(like_count=Count('likes')).order_by('-like_count')
-
-        page = self.paginate_queryset(posts)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(posts, many=True)
-        return Response(serializer.data)
+        post = serializer.save(author=self.request.user)
+        process_uploads(serializer, ['media'])
+        # Extract #tags, then push the new post into the followers' home timelines
+        trending_hashtags.record(sync_post_hashtags(post))
+        timeline.fan_out_post(post)
+
+    def retrieve(self, request, *args, **kwargs):
+        # The full representation is the same for everyone, so it is served from the
+        # read-through cache; likes, comments and edits drop the entry
+        if self.get_serializer_class() is not PostSerializer:
+            return super().retrieve(request, *args, **kwargs)
+        data = read_through('post', kwargs['pk'], lambda: PostSerializer(self.get_object()).data)
+        return Response(absolute_urls(data, PostSerializer, request))
+
+    def perform_update(self, serializer):
+        # One transaction, so the cached post is dropped after its new tags are in
+        with transaction.atomic():
+            post = serializer.save()
+            process_uploads(serializer, ['media'])
+            # Re-extract #tags in case the content was edited
+            sync_post_hashtags(post)
 
 # Like ViewSet
-class LikeViewSet(viewsets.ModelViewSet):
+class LikeViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Like.objects.all()
     serializer_class = LikeSerializer
     permission_classes = [IsAuthenticated]
@@ -101,22 +157,28 @@ class LikeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         try:
             post = Post.objects.get(id=self.request.data['post'])
-            # Prevent double likes by the same user
-            if Like.objects.filter(user=self.request.user, post=post).exists():
-                return Response({'error': 'You have already liked this post'}, status=status.HTTP_400_BAD_REQUEST)
-
+        except Post.DoesNotExist:
+            raise NotFound('Post not found')
+
+        # Save the like and bump the post's counter together
+        with transaction.atomic():
+            # The unique (user, post) constraint rejects double likes, without a lookup first
+            try:
+                with transaction.atomic():
+                    serializer.save(user=self.request.user)
+            except IntegrityError:
+                raise serializers.ValidationError('You have already liked this post')
+            Post.objects.filter(pk=post.pk).update(like_count=F('like_count') + 1)
             # Create notification
-            Notification.objects.create(
-                user=post.author, sender=self.request.user,
-                notification_type='like', post=post
-            )
-            serializer.save(user=self.request.user)
+            notify(post.author, self.request.user, 'like', post=post)
 
-        except Post.DoesNotExist:
-            return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Post.objects.filter(pk=instance.post_id, like_count__gt=0).update(like_count=F('like_count') - 1)
 
 # Comment ViewSet
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
@@ -124,94 +186,145 @@ class CommentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         try:
             post = Post.objects.get(id=self.request.data['post'])
-            # Create notification for the comment
-            Notification.objects.create(
-                user=post.author, sender=self.request.user,
-                notification_type='comment', post=post
-            )
+        except Post.DoesNotExist:
+            raise NotFound('Post not found')
+
+        # Save the comment and bump the post's counter together
+        with transaction.atomic():
             serializer.save(user=self.request.user)
+            Post.objects.filter(pk=post.pk).update(comment_count=F('comment_count') + 1)
+            # Create notification for the comment
+            notify(post.author, self.request.user, 'comment', post=post)
 
-        except Post.DoesNotExist:
-            return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
 
 # Follower ViewSet
-class FollowerViewSet(viewsets.ModelViewSet):
+class FollowerViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Follower.objects.all()
     serializer_class = FollowerSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # Only your own follows and followers; other users' are under /users/<id>/followers/ and /following/
+        user = self.request.user
+        return self.eager_load(Follower.objects.filter(Q(user_from=user) | Q(user_to=user)))
+
     @action(detail=False, methods=['post'])
     def follow(self, request):
         user_to_follow = User.objects.get(id=request.data['user_to'])
         if request.user == user_to_follow:
             return Response({'error': 'You cannot follow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if Follower.objects.filter(user_from=request.user, user_to=user_to_follow).exists():
+        # Insert or fail on the unique (user_from, user_to) constraint instead of checking first
+        try:
+            with transaction.atomic():
+                Follower.objects.create(user_from=request.user, user_to=user_to_follow)
+                timeline.follower_added(request.user, user_to_follow)
+        except IntegrityError:
             return Response({'error': 'You are already following this user'}, status=status.HTTP_400_BAD_REQUEST)
-
-        Follower.objects.create(user_from=request.user, user_to=user_to_follow)
-        Notification.objects.create(user=user_to_follow, sender=request.user, notification_type='follow')
+        transaction.on_commit(lambda: follower_graph.add(request.user.id, user_to_follow.id))
+        timeline.backfill(request.user, user_to_follow)
+        notify(user_to_follow, request.user, 'follow')
         return Response({'status': 'You are now following this user'})
 
     @action(detail=False, methods=['post'])
     def unfollow(self, request):
         user_to_unfollow = User.objects.get(id=request.data['user_to'])
-        follow_relation = Follower.objects.filter(user_from=request.user, user_to=user_to_unfollow).first()
-        if follow_relation:
-            follow_relation.delete()
+        # The counters and the follower graph are updated by signals.py
+        deleted, _ = Follower.objects.filter(user_from=request.user, user_to=user_to_unfollow).delete()
+        if deleted:
+            timeline.evict(request.user, user_to_unfollow)
             return Response({'status': 'You have unfollowed this user'})
         return Response({'error': 'You are not following this user'}, status=status.HTTP_400_BAD_REQUEST)
 
-# Notification Views
-class NotificationListView(APIView):
-    permission_classes = [IsAuthenticated]
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        # Users followed by the most of the people you follow, from the in-memory graph
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        suggested = follower_graph.suggestions(request.user.id, limit)
+        users = get_users([user_id for user_id, _ in suggested])
+        return Response([
+            {'user': UserSerializer(users[user_id]).data, 'followed_by_following': count}
+            for user_id, count in suggested if user_id in users
+        ])
 
-    def get(self, request):
-        notifications = Notification.objects.filter(user=request.user).order_by('-timestamp')
-        serializer = NotificationSerializer(notifications, many=True)
-        return Response(serializer.data)
+    @action(detail=False, methods=['get'])
+    def common(self, request):
+        # Users both you and ?user= follow
+        try:
+            other_id = int(request.query_params['user'])
+        except (KeyError, ValueError):
+            return Response({'error': 'user must be a user id'}, status=status.HTTP_400_BAD_REQUEST)
+        common_ids = follower_graph.common_following(request.user.id, other_id)[:100]
+        users = get_users(common_ids)
+        return Response([UserSerializer(users[user_id]).data for user_id in common_ids if user_id in users])
 
+# Notification Views
 class MarkNotificationReadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, notification_id):
-        try:
-            notification = Notification.objects.get(id=notification_id, user=request.user)
-            notification.is_read = True
-            notification.save()
+        # Single UPDATE instead of get() + save()
+        if mark_read(request.user, notification_id=notification_id):
+            return Response({'message': 'Notification marked as read'}, status=200)
+        if Notification.objects.filter(id=notification_id, user=request.user).exists():
             return Response({'message': 'Notification marked as read'}, status=200)
-        except Notification.DoesNotExist:
-            return Response({'error': 'Notification not found'}, status=404)
+        return Response({'error': 'Notification not found'}, status=404)
+
+class MarkAllNotificationsReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Marks every unread notification (or those with id <= up_to) as read in one UPDATE
+        up_to = request.data.get('up_to')
+        if up_to is not None:
+            try:
+                up_to = int(up_to)
+            except (TypeError, ValueError):
+                return Response({'error': 'up_to must be a notification id'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'marked_read': mark_read(request.user, up_to=up_to)})
+
+class UnreadNotificationCountView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Served from a cached per-user counter
+        return Response({'unread': unread_count(request.user)})
 
 
 
 # Message ViewSet
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all().order_by('-timestamp')  # Order messages by timestamp
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]  # Require authentication to access
+    pagination_class = KeysetPagination  # Cursor on (timestamp, id), no OFFSET or COUNT
 
     def perform_create(self, serializer):
-        # Debug: Check incoming request data
-        print("Incoming request data:", self.request.data)  # Debugging line to print incoming data
-
         # Extract the recipient ID from the request data
         recipient_id = self.request.data.get('recipient')
-        
+
         # Check if recipient ID is provided
         if recipient_id is None:
             raise serializers.ValidationError("Recipient ID is required.")
 
-        # Check if the recipient exists
-        if not User.objects.filter(id=recipient_id).exists():
-            raise serializers.ValidationError("Recipient does not exist.")
-
         # Retrieve the recipient User object
-        recipient = User.objects.get(id=recipient_id)
+        recipient = User.objects.filter(id=recipient_id).first()
+        if recipient is None:
+            raise serializers.ValidationError("Recipient does not exist.")
 
-        # Save the message with the sender and recipient
-        serializer.save(sender=self.request.user, recipient=recipient)
+        # Save the message in the pair's conversation and move its inbox pointers
+        conversation = direct_conversation(self.request.user, recipient)
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user, recipient=recipient, conversation=conversation)
+            record_messages([message])
 
     def get_queryset(self):
         """
@@ -219,31 +332,157 @@ class MessageViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         # Return messages sent by or received by the authenticated user
-        return Message.objects.filter(sender=user).union(Message.objects.filter(recipient=user)).order_by('-timestamp')
+        # (a plain OR instead of UNION so the paginator can filter and order it)
+        return self.eager_load(Message.objects.filter(Q(sender=user) | Q(recipient=user)).order_by('-timestamp'))
+
+
+# Conversation ViewSet (inbox and threads)
+class ConversationViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = ConversationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # Only the conversations the authenticated user takes part in
+        return self.eager_load(Conversation.objects.filter(participants__user=self.request.user))
+
+    def list(self, request):
+        # Inbox by recency, read off the (user, last_message_at) participant index
+        paginator = KeysetPagination(ordering=('-last_message_at', '-id'))
+        entries = ConversationParticipant.objects.filter(user=request.user, last_message_at__isnull=False)
+        page = paginator.paginate_queryset(entries, request, view=self)
+        conversations = self.get_queryset().in_bulk([entry.conversation_id for entry in page])
+        serializer = self.get_serializer([conversations[entry.conversation_id] for entry in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        # One thread, newest first, read off the (conversation, timestamp) index
+        conversation = self.get_object()
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(eager_load(conversation.messages.all(), MessageSerializer), request, view=self)
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
 
 # Repost ViewSet
-class RepostViewSet(viewsets.ModelViewSet):
+class RepostViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Repost.objects.all()
     serializer_class = RepostSerializer
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
         post = Post.objects.get(id=self.request.data['post'])
-        serializer.save(user=self.request.user, post=post)
+        # Save the repost and bump the post's counter together
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    serializer.save(user=self.request.user, post=post)
+            except IntegrityError:
+                raise serializers.ValidationError('You have already reposted this post')
+            Post.objects.filter(pk=post.pk).update(repost_count=F('repost_count') + 1)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Post.objects.filter(pk=instance.post_id, repost_count__gt=0).update(repost_count=F('repost_count') - 1)
 
 # Hashtag ViewSet
-class HashtagViewSet(viewsets.ModelViewSet):
+class HashtagViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Hashtag.objects.all()
     serializer_class = HashtagSerializer
     permission_classes = [IsAuthenticated]
 
-# Trending Posts
-class TrendingPostView(APIView):
+    def retrieve(self, request, *args, **kwargs):
+        data = read_through('hashtag', kwargs['pk'], lambda: self.get_serializer(self.get_object()).data)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        # Most used tags over the last TRENDING_HASHTAGS_WINDOW seconds (approximate counts)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), settings.TRENDING_HASHTAGS_CAPACITY))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        # Merged from every worker's counts; cached briefly, as reading the sketches is not free
+        data = read_through('trending', f'hashtags:{limit}', lambda: [
+            {'name': name, 'count': count} for name, count in trending_hashtags.top(limit)
+        ])
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path=r'(?P<name>[^/.]+)/posts')
+    def posts(self, request, name=None):
+        # Recent posts for a tag, read from the (hashtag, timestamp, post) index
+        name = normalize_hashtag(name)
+        hashtag = read_through('hashtag', f'name:{name}', lambda: Hashtag.objects.filter(name=name).first())
+        if hashtag is None:
+            return Response({'error': 'Hashtag not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        paginator = KeysetPagination(ordering=('-timestamp', '-post_id'))
+        page = paginator.paginate_queryset(PostHashtag.objects.filter(hashtag=hashtag), request, view=self)
+        posts = eager_load(Post.objects.filter(id__in=[tag.post_id for tag in page]), PostSerializer).in_bulk()
+        serializer = PostSerializer([posts[tag.post_id] for tag in page], many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+# Search Views
+class SearchView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        trending_posts = Post.objects.annotate(like_count=Count('likes')).order_by('-like_count')[:10]
-        serializer = PostSerializer(trending_posts, many=True)
-        return Response(serializer.data)
+        # ?q= over posts (default), users or hashtags (?type=), ranked by the full-text index
+        kind = request.query_params.get('type', 'posts')
+        if kind not in ('posts', 'users', 'hashtags'):
+            return Response({'error': 'type must be posts, users or hashtags'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', settings.SEARCH_RESULTS))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        # Clamped both ways: a negative LIMIT is no limit at all to SQLite
+        limit = max(1, min(limit, settings.SEARCH_MAX_RESULTS))
+        query = request.query_params.get('q', '')
+        if not search.terms(query):
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if kind == 'posts':
+            ids = search.search_posts(query, limit)
+            posts = eager_load(Post.objects.filter(id__in=ids), CompactPostSerializer)
+            posts = annotate_liked_by_me(posts, request.user).in_bulk()
+            results = CompactPostSerializer(
+                [posts[post_id] for post_id in ids if post_id in posts], many=True, context={'request': request},
+            ).data
+        elif kind == 'users':
+            results = serialize_users(search.search_users(query, limit))
+        else:
+            results = serialize_hashtags(search.search_hashtags(query, limit))
+        return Response({'results': results})
+
+class AutocompleteView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def get(self, request):
+        # Usernames and tags starting with ?q=, for completing '@' and '#' as they are typed
+        query = request.query_params.get('q', '')
+        limit = settings.SEARCH_AUTOCOMPLETE_RESULTS
+        return Response({
+            'users': serialize_users(search.autocomplete_users(query, limit)),
+            'hashtags': serialize_hashtags(search.search_hashtags(query, limit)),
+        })
+
+# Helpers shared by the views
+def serialize_users(user_ids):
+    users = get_users(user_ids)
+    return [UserSerializer(users[user_id]).data for user_id in user_ids if user_id in users]
+
+def serialize_hashtags(hashtag_ids):
+    hashtags = Hashtag.objects.in_bulk(hashtag_ids)
+    return HashtagSerializer([hashtags[hashtag_id] for hashtag_id in hashtag_ids if hashtag_id in hashtags], many=True).data
+
+def add_relationship_flags(user, profiles):
+    # 'following' and 'followed_by' for a page of serialized profiles, in one query
+    flags = relationship_flags(user.id, [profile['user']['id'] for profile in profiles])
+    for profile in profiles:
+        profile.update(flags[profile['user']['id']])
+
+def annotate_liked_by_me(queryset, user):
+    # EXISTS subquery read by CompactPostSerializer.liked_by_me
+    liked = Like.objects.filter(user=user, post=OuterRef('pk'))
+    return queryset.annotate(liked_by_me=Exists(liked))